@@ -0,0 +1,563 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Dict, Any, AsyncIterator, List, Optional, Sequence
+
+import torch
+
+from api.detokenize import StopSequences
+from api.inference import Inference, context_window, fit_to_context, format_prompt
+from api.model_cache import model_cache
+from api.prefix_cache import PrefixCache
+from monitoring.metrics import (
+    DECODE_STEP_SECONDS, PREFILL_SECONDS, TIME_TO_FIRST_TOKEN_SECONDS, TOKENS_PER_SECOND, registry
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BATCH_SIZE = int(os.getenv('INFERENCE_MAX_BATCH_SIZE', '8'))
+DEFAULT_MAX_WAIT_MS = float(os.getenv('INFERENCE_MAX_WAIT_MS', '10'))
+
+
+def _to_legacy_cache(past_key_values):
+    """Normalize past key/values to the legacy tuple-of-tuples layout"""
+    if hasattr(past_key_values, "to_legacy_cache"):
+        return past_key_values.to_legacy_cache()
+    return past_key_values
+
+
+def _left_pad(tensor: torch.Tensor, length: int, dim: int) -> torch.Tensor:
+    """Left-pad a tensor with zeros along `dim` up to `length`"""
+    missing = length - tensor.shape[dim]
+    if missing <= 0:
+        return tensor
+    shape = list(tensor.shape)
+    shape[dim] = missing
+    return torch.cat([tensor.new_zeros(shape), tensor], dim=dim)
+
+
+class _Sequence:
+    """A single request living inside the running batch"""
+
+    def __init__(self, prompt_ids: List[int], max_new_tokens: int, temperature: float,
+                 loop: asyncio.AbstractEventLoop, future: asyncio.Future, stop: StopSequences,
+                 stream: Optional[asyncio.Queue] = None, seed: Optional[int] = None):
+        self.prompt_ids = prompt_ids
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.seed = seed
+        # Detokenizes the generated tokens as they arrive and watches for stops
+        self.stop = stop
+        # Per-request RNG, created on the batch's device at the first sampled token
+        self.generator: Optional[torch.Generator] = None
+        self.loop = loop
+        self.future = future
+        self.stream = stream
+        self.generated: List[int] = []
+        self.cancelled = False
+        self.submitted_at = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+
+    def emit(self, text: Optional[str]):
+        """Forward a text delta to a streaming consumer; None marks the end"""
+        if self.stream is not None:
+            self.loop.call_soon_threadsafe(self.stream.put_nowait, text)
+
+    def resolve(self, result: Any = None, error: Optional[BaseException] = None):
+        """Hand the outcome back to the event loop that submitted the request"""
+        def _set():
+            if self.future.done():
+                return
+            if error is not None:
+                self.future.set_exception(error)
+            else:
+                self.future.set_result(result)
+
+        self.loop.call_soon_threadsafe(_set)
+        self.emit(None)
+
+
+class ContinuousBatchScheduler:
+    """Micro-batches concurrent requests for one deployment into shared forward passes.
+
+    Requests arriving within `max_wait_ms` of each other are prefilled together as a
+    left-padded batch. While the batch decodes, finished sequences are retired and
+    queued ones are admitted at every token boundary, so a single forward pass keeps
+    serving as many HTTP requests as `max_batch_size` allows.
+
+    LoRA deployments on a shared base model each get their own scheduler, so every
+    batch runs a single adapter; the schedulers interleave forward passes on the
+    base model at token granularity.
+    """
+
+    # Draft model of a speculative scheduler (api/speculative.py); batches decode without one
+    draft: Optional[Inference] = None
+
+    def __init__(self, inference: Inference, max_batch_size: Optional[int] = None,
+                 max_wait_ms: Optional[float] = None):
+        self.inference = inference
+        self.max_batch_size = max_batch_size or DEFAULT_MAX_BATCH_SIZE
+        self.max_wait = (DEFAULT_MAX_WAIT_MS if max_wait_ms is None else max_wait_ms) / 1000.0
+
+        self._queue: "queue.Queue[_Sequence]" = queue.Queue()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+        # Running batch state, only touched by the worker thread
+        self._active: List[_Sequence] = []
+        self._past = None
+        self._attention_mask: Optional[torch.Tensor] = None
+        self._next_tokens: Optional[torch.Tensor] = None
+
+        self.prefix_cache = PrefixCache()
+        self.stats = {
+            "requests": 0,
+            "prefill_batches": 0,
+            "decode_steps": 0,
+            "tokens_generated": 0,
+            "max_batch_size_seen": 0,
+        }
+
+    @property
+    def device(self):
+        return self.inference.model.device
+
+    def start(self):
+        """Start the worker thread if it is not running yet"""
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(
+                    target=self._run, name="batch-scheduler", daemon=True
+                )
+                self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Stop the worker thread and fail anything still waiting"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+        error = RuntimeError("Inference scheduler stopped")
+        for seq in self._active:
+            seq.resolve(error=error)
+        self._reset_batch()
+        while True:
+            try:
+                self._queue.get_nowait().resolve(error=error)
+            except queue.Empty:
+                break
+
+    def _enqueue(self, prompt: str, max_length: int, max_new_tokens: int, temperature: float,
+                 stream: bool = False, seed: Optional[int] = None, stop: Sequence[str] = (),
+                 stop_token_ids: Sequence[int] = ()) -> _Sequence:
+        self.start()
+
+        tokenizer = self.inference.tokenizer
+        # Prompt plus new tokens must stay within the position embeddings, or the
+        # decode step fails for every sequence sharing the batch
+        context = context_window(self.inference.model)
+        prompt_ids = tokenizer(
+            format_prompt(prompt),
+            truncation=True,
+            max_length=min(max_length, context - 1) if context else max_length
+        )["input_ids"]
+        max_new_tokens = fit_to_context(len(prompt_ids), max_new_tokens, context)
+
+        loop = asyncio.get_running_loop()
+        seq = _Sequence(
+            prompt_ids, max_new_tokens, temperature, loop, loop.create_future(),
+            StopSequences(tokenizer, stop, stop_token_ids),
+            stream=asyncio.Queue() if stream else None, seed=seed
+        )
+        self._queue.put(seq)
+        return seq
+
+    async def submit(self, prompt: str, max_length: int = 512, max_new_tokens: int = 256,
+                     temperature: float = 0.7, seed: Optional[int] = None, stop: Sequence[str] = (),
+                     stop_token_ids: Sequence[int] = ()) -> Dict[str, Any]:
+        """Queue a prompt and wait for its completion, usage counts and stop reason"""
+        seq = self._enqueue(prompt, max_length, max_new_tokens, temperature, seed=seed,
+                            stop=stop, stop_token_ids=stop_token_ids)
+
+        try:
+            return await seq.future
+        except asyncio.CancelledError:
+            # The worker drops the sequence at the next token boundary
+            seq.cancelled = True
+            raise
+
+    async def stream(self, prompt: str, max_length: int = 512, max_new_tokens: int = 256,
+                     temperature: float = 0.7, seed: Optional[int] = None, stop: Sequence[str] = (),
+                     stop_token_ids: Sequence[int] = ()) -> AsyncIterator[Dict[str, Any]]:
+        """Queue a prompt and yield text deltas as tokens are decoded.
+
+        Text that could be the start of a stop string is only sent once it turns
+        out not to be. The final event carries the usage counts, stop reason and
+        time-to-first-token. Closing the iterator early cancels the sequence at
+        the next token boundary.
+        """
+        seq = self._enqueue(prompt, max_length, max_new_tokens, temperature, stream=True, seed=seed,
+                            stop=stop, stop_token_ids=stop_token_ids)
+
+        try:
+            while True:
+                text = await seq.stream.get()
+                if text is None:
+                    break
+                yield {"token": text}
+
+            result = await seq.future
+            yield {
+                "done": True,
+                "prompt_tokens": result["prompt_tokens"],
+                "completion_tokens": result["completion_tokens"],
+                "stop_reason": result["stop_reason"],
+                "time_to_first_token": result["time_to_first_token"],
+            }
+        finally:
+            if not seq.future.done():
+                seq.cancelled = True
+
+    def _run(self):
+        while not self._stop.is_set():
+            new: List[_Sequence] = []
+            try:
+                if not self._active:
+                    new = self._collect_window()
+                else:
+                    new = self._drain(self.max_batch_size - len(self._active))
+
+                if new:
+                    self._admit(new)
+                if self._active:
+                    self._step()
+
+            except Exception as e:
+                logger.error(f"Batch scheduler step failed: {str(e)}")
+                # Newcomers that failed before joining the batch are not in _active yet
+                for seq in self._active + [seq for seq in new if seq not in self._active]:
+                    seq.resolve(error=e)
+                self._reset_batch()
+
+    def _collect_window(self) -> List[_Sequence]:
+        """Block for a first request, then gather followers for up to max_wait"""
+        try:
+            batch = [self._queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self, limit: int) -> List[_Sequence]:
+        """Take up to `limit` already-queued requests without waiting"""
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _reset_batch(self):
+        self._active = []
+        self._past = None
+        self._attention_mask = None
+        self._next_tokens = None
+
+    def _sample(self, logits: torch.Tensor, sequences: List[_Sequence]) -> torch.Tensor:
+        """Greedy for temperature <= 0, temperature sampling otherwise"""
+        next_tokens = logits.argmax(dim=-1)
+        temperatures = torch.tensor(
+            [seq.temperature for seq in sequences], device=logits.device, dtype=torch.float32
+        )
+        greedy = temperatures <= 0
+        if not bool(greedy.all()):
+            scaled = logits.float() / temperatures.clamp(min=1e-5).unsqueeze(-1)
+            probs = torch.softmax(scaled, dim=-1)
+            sampled = torch.multinomial(probs, 1).squeeze(-1)
+            # Seeded requests draw from their own generator so they replay exactly
+            for i, seq in enumerate(sequences):
+                if seq.seed is not None and seq.temperature > 0:
+                    if seq.generator is None:
+                        seq.generator = torch.Generator(device=probs.device).manual_seed(seq.seed)
+                    sampled[i] = torch.multinomial(probs[i], 1, generator=seq.generator)[0]
+            next_tokens = torch.where(greedy, next_tokens, sampled)
+        return next_tokens
+
+    def _prefill(self, new: List[_Sequence]):
+        """Run the prompt forward pass, resuming from cached prefixes where possible.
+
+        Each row is laid out as [pad][cached prefix][pad][uncached suffix]; the
+        attention mask and explicit position ids make the gap in the middle
+        invisible to the model.
+        """
+        pad_id = self.inference.tokenizer.pad_token_id or 0
+        hashes = [self.prefix_cache.block_hashes(seq.prompt_ids) for seq in new]
+        matches = [self.prefix_cache.match(seq.prompt_ids, h) for seq, h in zip(new, hashes)]
+        prefix_len = max(length for length, _ in matches)
+
+        suffixes = [seq.prompt_ids[length:] for seq, (length, _) in zip(new, matches)]
+        suffix_len = max(len(suffix) for suffix in suffixes)
+        input_ids = torch.tensor(
+            [[pad_id] * (suffix_len - len(suffix)) + suffix for suffix in suffixes],
+            device=self.device
+        )
+        attention_mask = torch.tensor(
+            [[0] * (suffix_len - len(suffix)) + [1] * len(suffix) for suffix in suffixes],
+            device=self.device
+        )
+
+        past = None
+        if prefix_len:
+            template = next(cached for _, cached in matches if cached is not None)
+            past = tuple(
+                tuple(
+                    torch.cat([
+                        _left_pad(
+                            cached[layer][i] if cached is not None else template[layer][i][:, :, :0],
+                            prefix_len, -2
+                        )
+                        for _, cached in matches
+                    ], dim=0)
+                    for i in range(len(template[layer]))
+                )
+                for layer in range(len(template))
+            )
+            prefix_mask = torch.tensor(
+                [[0] * (prefix_len - length) + [1] * length for length, _ in matches],
+                device=self.device
+            )
+            attention_mask = torch.cat([prefix_mask, attention_mask], dim=1)
+
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)[:, -suffix_len:]
+        with self.inference.activate():
+            outputs = self.inference.model(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                past_key_values=past,
+                use_cache=True,
+            )
+        past = _to_legacy_cache(outputs.past_key_values)
+
+        # Keep prefixes that keep showing up, e.g. shared system preambles
+        for row, (seq_hashes, (length, _)) in enumerate(zip(hashes, matches)):
+            candidate = self.prefix_cache.observe(seq_hashes, length)
+            if candidate is None:
+                continue
+            key, store_len = candidate
+            columns = attention_mask[row].nonzero().squeeze(-1)[:store_len]
+            self.prefix_cache.store(key, store_len, tuple(
+                tuple(tensor[row:row + 1].index_select(-2, columns) for tensor in layer)
+                for layer in past
+            ))
+
+        return past, attention_mask, outputs.logits[:, -1, :]
+
+    @torch.no_grad()
+    def _admit(self, new: List[_Sequence]):
+        """Prefill newly admitted sequences and merge them into the running batch"""
+        new = [seq for seq in new if not seq.cancelled]
+        if not new:
+            return
+        self.stats["requests"] += len(new)
+        self.stats["prefill_batches"] += 1
+
+        started = time.perf_counter()
+        try:
+            past, attention_mask, logits = self._prefill(new)
+            next_tokens = self._sample(logits, new)
+        except Exception as e:
+            # A failed prefill (e.g. out of memory) only fails its own requests;
+            # the running batch has not been touched and keeps decoding
+            logger.error(f"Prefill of {len(new)} request(s) failed: {str(e)}")
+            for seq in new:
+                seq.resolve(error=e)
+            return
+        PREFILL_SECONDS.observe(time.perf_counter() - started)
+
+        if not self._active:
+            self._past = past
+            self._attention_mask = attention_mask
+            self._next_tokens = next_tokens
+        else:
+            # Align both KV caches on the right before stacking them along the batch
+            length = max(self._attention_mask.shape[1], attention_mask.shape[1])
+            self._past = tuple(
+                tuple(
+                    torch.cat([_left_pad(old, length, -2), _left_pad(fresh, length, -2)], dim=0)
+                    for old, fresh in zip(old_layer, new_layer)
+                )
+                for old_layer, new_layer in zip(self._past, past)
+            )
+            self._attention_mask = torch.cat(
+                [_left_pad(self._attention_mask, length, 1), _left_pad(attention_mask, length, 1)],
+                dim=0
+            )
+            self._next_tokens = torch.cat([self._next_tokens, next_tokens], dim=0)
+
+        self._active.extend(new)
+        self.stats["max_batch_size_seen"] = max(self.stats["max_batch_size_seen"], len(self._active))
+        self._retire()
+
+    @torch.no_grad()
+    def _step(self):
+        """Run one decode step for every active sequence"""
+        self._attention_mask = torch.cat(
+            [self._attention_mask, self._attention_mask.new_ones((len(self._active), 1))], dim=1
+        )
+        position_ids = self._attention_mask.sum(dim=-1, keepdim=True) - 1
+
+        started = time.perf_counter()
+        # Deployments sharing a base model take turns here, one adapter per forward pass
+        with self.inference.activate():
+            outputs = self.inference.model(
+                input_ids=self._next_tokens.unsqueeze(-1),
+                attention_mask=self._attention_mask,
+                position_ids=position_ids,
+                past_key_values=self._past,
+                use_cache=True,
+            )
+        self._past = _to_legacy_cache(outputs.past_key_values)
+        self._next_tokens = self._sample(outputs.logits[:, -1, :], self._active)
+        DECODE_STEP_SECONDS.observe(time.perf_counter() - started)
+        self.stats["decode_steps"] += 1
+        self._retire()
+
+    def _retire(self):
+        """Record the latest tokens and drop finished or cancelled sequences"""
+        eos_id = self.inference.tokenizer.eos_token_id
+        tokens = self._next_tokens.tolist()
+        keep = []
+
+        for index, (seq, token) in enumerate(zip(self._active, tokens)):
+            if seq.cancelled:
+                continue
+            stop_reason = self._record(seq, token, eos_id)
+            if stop_reason is not None:
+                self._finish(seq, stop_reason)
+                continue
+            keep.append(index)
+
+        if len(keep) == len(self._active):
+            return
+        if not keep:
+            self._reset_batch()
+            return
+
+        index = torch.tensor(keep, device=self.device)
+        self._active = [self._active[i] for i in keep]
+        self._next_tokens = self._next_tokens.index_select(0, index)
+        self._attention_mask = self._attention_mask.index_select(0, index)
+        self._past = tuple(
+            tuple(tensor.index_select(0, index) for tensor in layer)
+            for layer in self._past
+        )
+
+        # Drop leading columns that are padding for every remaining sequence
+        start = int(self._attention_mask.any(dim=0).int().argmax())
+        if start > 0:
+            self._attention_mask = self._attention_mask[:, start:]
+            self._past = tuple(
+                tuple(tensor[..., start:, :] for tensor in layer)
+                for layer in self._past
+            )
+
+    def _record(self, seq: _Sequence, token: int, eos_id: Optional[int]) -> Optional[str]:
+        """Add a generated token to a sequence; returns why it stopped once it is done"""
+        if token == eos_id:
+            return "eos"
+        if seq.first_token_at is None:
+            seq.first_token_at = time.perf_counter()
+            TIME_TO_FIRST_TOKEN_SECONDS.observe(seq.first_token_at - seq.submitted_at)
+        seq.generated.append(token)
+        self.stats["tokens_generated"] += 1
+
+        # Only the new tokens are detokenized, a few at a time
+        text = seq.stop.push(token)
+        if text:
+            seq.emit(text)
+        if seq.stop.reason is not None:
+            return seq.stop.reason
+        if len(seq.generated) >= seq.max_new_tokens:
+            return "length"
+        return None
+
+    def _finish(self, seq: _Sequence, stop_reason: str):
+        # Held-back text that never became a stop string still belongs to the response
+        tail = seq.stop.flush()
+        if tail:
+            seq.emit(tail)
+        now = time.perf_counter()
+        first_token_at = seq.first_token_at or now
+        if seq.generated:
+            TOKENS_PER_SECOND.observe(len(seq.generated) / max(now - seq.submitted_at, 1e-9))
+        seq.resolve({
+            "text": seq.stop.text.strip(),
+            "prompt_tokens": len(seq.prompt_ids),
+            "completion_tokens": len(seq.generated),
+            "stop_reason": stop_reason,
+            "time_to_first_token": first_token_at - seq.submitted_at,
+        })
+
+
+# One scheduler per deployment
+schedulers: Dict[str, ContinuousBatchScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+def get_scheduler(deployment_id: str, inference: Inference, draft: Optional[Inference] = None,
+                  num_draft_tokens: Optional[int] = None) -> ContinuousBatchScheduler:
+    """Get or create the scheduler serving a deployment with the given model.
+
+    Deployments with a draft model decode speculatively instead of in batches.
+    """
+    with _schedulers_lock:
+        scheduler = schedulers.get(deployment_id)
+        if scheduler is None or scheduler.inference is not inference or scheduler.draft is not draft:
+            if scheduler is not None:
+                scheduler.stop()
+            if draft is None:
+                scheduler = ContinuousBatchScheduler(inference)
+            else:
+                from api.speculative import SpeculativeScheduler
+                scheduler = SpeculativeScheduler(inference, draft, num_draft_tokens)
+            schedulers[deployment_id] = scheduler
+        return scheduler
+
+def _drop_schedulers(model_id: str, inference: Inference):
+    """Stop schedulers still pointing at an evicted model so its memory can be freed"""
+    with _schedulers_lock:
+        for deployment_id, scheduler in list(schedulers.items()):
+            if scheduler.inference is inference or scheduler.draft is inference:
+                scheduler.stop()
+                del schedulers[deployment_id]
+
+model_cache.add_evict_callback(_drop_schedulers)
+
+registry.gauge("inference_queue_depth", "Requests waiting to join a running batch", ("deployment",),
+               fn=lambda: {(d,): s._queue.qsize() for d, s in list(schedulers.items())})
+registry.gauge("inference_active_sequences", "Sequences in the running batch", ("deployment",),
+               fn=lambda: {(d,): len(s._active) for d, s in list(schedulers.items())})
+
+def shutdown_schedulers():
+    """Stop every scheduler worker thread"""
+    with _schedulers_lock:
+        for scheduler in schedulers.values():
+            scheduler.stop()
+        schedulers.clear()
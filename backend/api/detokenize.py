@@ -0,0 +1,80 @@
+from typing import Iterable, Optional
+
+
+class IncrementalDecoder:
+    """Turns a growing list of token ids into text deltas.
+
+    Only a short window of recent tokens is re-decoded for each new token, and
+    output is held back while a multi-byte character is still incomplete.
+    """
+    def __init__(self, tokenizer, skip_special_tokens: bool = True):
+        self.tokenizer = tokenizer
+        self.skip_special_tokens = skip_special_tokens
+        self.token_ids = []
+        self.prefix_offset = 0
+        self.read_offset = 0
+
+    def _decode(self, token_ids: list) -> str:
+        return self.tokenizer.decode(token_ids, skip_special_tokens=self.skip_special_tokens)
+
+    def push(self, token_id: int) -> str:
+        """Add a token and return the text it completes (possibly empty)"""
+        self.token_ids.append(token_id)
+        prefix_text = self._decode(self.token_ids[self.prefix_offset:self.read_offset])
+        new_text = self._decode(self.token_ids[self.prefix_offset:])
+
+        if len(new_text) > len(prefix_text) and not new_text.endswith("\ufffd"):
+            self.prefix_offset = self.read_offset
+            self.read_offset = len(self.token_ids)
+            return new_text[len(prefix_text):]
+        return ""
+
+
+class StopSequences:
+    """Incremental detokenization of generated tokens that ends at stop strings or stop token ids.
+
+    push() returns the text that is safe to hand out: a tail that could still grow
+    into a stop string is held back until it either does (and is dropped with
+    everything after it) or cannot anymore. `reason` is set once a stop matched.
+    """
+    def __init__(self, tokenizer, stop: Iterable[str] = (), stop_token_ids: Iterable[int] = ()):
+        self.decoder = IncrementalDecoder(tokenizer)
+        self.stop = [s for s in stop if s]
+        self.stop_token_ids = set(stop_token_ids)
+        self.holdback = max((len(s) for s in self.stop), default=1) - 1
+        self.text = ""
+        self.emitted = 0
+        self.reason: Optional[str] = None
+
+    def _emit(self, end: int) -> str:
+        if end <= self.emitted:
+            return ""
+        delta = self.text[self.emitted:end]
+        self.emitted = end
+        return delta
+
+    def push(self, token_id: int) -> str:
+        """Add a generated token and return the text it releases (possibly empty)"""
+        if self.reason is not None:
+            return ""
+        if token_id in self.stop_token_ids:
+            self.reason = "stop_token"
+            return self.flush()
+
+        self.text += self.decoder.push(token_id)
+        # Anything already released was checked, so a match can only start after it
+        matches = [i for i in (self.text.find(s, self.emitted) for s in self.stop) if i >= 0]
+        if matches:
+            self.reason = "stop_sequence"
+            self.text = self.text[:min(matches)]
+            return self.flush()
+
+        for start in range(max(self.emitted, len(self.text) - self.holdback), len(self.text)):
+            tail = self.text[start:]
+            if any(s.startswith(tail) for s in self.stop):
+                return self._emit(start)
+        return self._emit(len(self.text))
+
+    def flush(self) -> str:
+        """Release held-back text once generation has ended"""
+        return self._emit(len(self.text))
@@ -0,0 +1,273 @@
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from api.model_cache import EXPORT_MANIFEST_NAME, EXPORT_STORAGE_PATH, QUANTIZED_WEIGHTS_NAME, adapter_base
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXPORT_OPTIONS = {
+    "merge_lora": True,
+    "quantize": True,
+    "benchmark_max_new_tokens": 32,
+}
+
+# Short, varied prompts; greedy decoding keeps both runs of the benchmark comparable
+BENCHMARK_PROMPTS = [
+    "Summarize the benefits of unit testing in two sentences.",
+    "Write a Python function that reverses a string.",
+    "What is the capital of France?",
+    "Explain what a REST API is to a beginner.",
+    "List three ways to reduce memory usage in a web server.",
+]
+
+
+def export_dir(deployment_id: str) -> str:
+    return os.path.join(EXPORT_STORAGE_PATH, deployment_id)
+
+
+def _load_source(model_path: str):
+    """Load a trained model (or base plus LoRA adapter) in fp32 on CPU"""
+    import torch
+    from peft import PeftModel
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    base_name = adapter_base(model_path)
+    model = AutoModelForCausalLM.from_pretrained(
+        base_name or model_path,
+        torch_dtype=torch.float32,
+        low_cpu_mem_usage=True,
+        trust_remote_code=True
+    )
+    if base_name is not None:
+        model = PeftModel.from_pretrained(model, model_path)
+    model.eval()
+    return model, tokenizer
+
+
+def benchmark(model, tokenizer, prompts: List[str], max_new_tokens: int) -> Dict[str, Any]:
+    """Greedy single-request generation: latency, throughput and the generated token ids"""
+    import torch
+    from api.inference import format_prompt, model_nbytes
+
+    def generate(prompt: str) -> List[int]:
+        inputs = tokenizer(format_prompt(prompt), return_tensors="pt")
+        with torch.no_grad():
+            outputs = model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                do_sample=False,
+                pad_token_id=tokenizer.pad_token_id,
+                eos_token_id=tokenizer.eos_token_id,
+            )
+        return outputs[0, inputs["input_ids"].shape[1]:].tolist()
+
+    # Warm-up run so one-off allocation and kernel selection are not timed
+    generate(prompts[0])
+
+    latencies = []
+    outputs = []
+    for prompt in prompts:
+        started = time.perf_counter()
+        outputs.append(generate(prompt))
+        latencies.append(time.perf_counter() - started)
+
+    tokens = sum(len(ids) for ids in outputs)
+    return {
+        "latency_ms_mean": round(statistics.mean(latencies) * 1000, 2),
+        "latency_ms_max": round(max(latencies) * 1000, 2),
+        "tokens_per_second": round(tokens / max(sum(latencies), 1e-9), 2),
+        "generated_tokens": tokens,
+        "weights_bytes": model_nbytes(model),
+        "outputs": outputs,
+    }
+
+
+def agreement(reference: List[List[int]], candidate: List[List[int]]) -> Dict[str, float]:
+    """Position-wise token agreement and exact-match rate of two sets of generations"""
+    matched = 0
+    total = 0
+    exact = 0
+    for ref, cand in zip(reference, candidate):
+        matched += sum(1 for a, b in zip(ref, cand) if a == b)
+        total += max(len(ref), len(cand))
+        exact += ref == cand
+    return {
+        "token_agreement": round(matched / total, 4) if total else 1.0,
+        "exact_match": round(exact / len(reference), 4) if reference else 1.0,
+    }
+
+
+def export_model(deployment_id: str, model_id: str, options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Build a deployment's serving artifact and benchmark it against the source model.
+
+    LoRA weights are merged into the base when asked (always when quantizing,
+    since quantized layers cannot carry adapters), and every nn.Linear is
+    dynamically quantized to int8 for CPU serving. Returns the report stored on
+    the deployment, including where the artifact was written. Runs in the
+    export worker process, which is the only place the ML stack is imported.
+    """
+    import torch
+    from peft import PeftModel
+    from api.inference import quantize_int8
+
+    options = {**DEFAULT_EXPORT_OPTIONS, **(options or {})}
+    model_path = f"outputs/{model_id}"
+    if not os.path.exists(model_path):
+        raise ValueError(f"Model not found: {model_id}")
+
+    torch.manual_seed(0)
+    model, tokenizer = _load_source(model_path)
+    is_adapter = isinstance(model, PeftModel)
+    merge = is_adapter and (options["merge_lora"] or options["quantize"])
+    if merge:
+        model = model.merge_and_unload()
+        logger.info(f"Merged LoRA weights of {model_id} into its base model")
+
+    max_new_tokens = int(options["benchmark_max_new_tokens"])
+    reference = benchmark(model, tokenizer, BENCHMARK_PROMPTS, max_new_tokens)
+
+    output_dir = export_dir(deployment_id)
+    tmp_dir = f"{output_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    exported = None
+    if options["quantize"]:
+        model = quantize_int8(model)
+        exported = benchmark(model, tokenizer, BENCHMARK_PROMPTS, max_new_tokens)
+        model.config.save_pretrained(tmp_dir)
+        torch.save(model.state_dict(), os.path.join(tmp_dir, QUANTIZED_WEIGHTS_NAME))
+    else:
+        # Unmerged adapters are saved as adapters and served on a shared base
+        model.save_pretrained(tmp_dir, safe_serialization=True)
+    tokenizer.save_pretrained(tmp_dir)
+
+    manifest = {
+        "source_model": model_id,
+        "merged": merge,
+        "quantized": bool(options["quantize"]),
+        "torch_version": torch.__version__,
+        "created_at": time.time(),
+    }
+    with open(os.path.join(tmp_dir, EXPORT_MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.replace(tmp_dir, output_dir)
+
+    report = {
+        **manifest,
+        "artifact_path": output_dir,
+        "artifact_bytes": sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, files in os.walk(output_dir)
+            for name in files
+        ),
+        "prompts": len(BENCHMARK_PROMPTS),
+        "max_new_tokens": max_new_tokens,
+        "reference": {k: v for k, v in reference.items() if k != "outputs"},
+    }
+    if exported is not None:
+        report["exported"] = {k: v for k, v in exported.items() if k != "outputs"}
+        report["agreement"] = agreement(reference["outputs"], exported["outputs"])
+        report["speedup"] = round(exported["tokens_per_second"] / max(reference["tokens_per_second"], 1e-9), 3)
+        report["memory_ratio"] = round(exported["weights_bytes"] / max(reference["weights_bytes"], 1), 3)
+
+    logger.info(f"Exported {model_id} for deployment {deployment_id} to {output_dir}")
+    return report
+
+
+def benchmark_speculative(model_id: str, draft_model_id: str, num_draft_tokens: Optional[int] = None,
+                          max_new_tokens: int = DEFAULT_EXPORT_OPTIONS["benchmark_max_new_tokens"]) -> Dict[str, Any]:
+    """Greedy plain vs draft-assisted decoding of a deployment's model on the benchmark prompts.
+
+    Both runs go through the same decoding loop, so the speedup isolates what
+    speculation saves; greedy outputs must match exactly. Model ids are model
+    cache keys, so exported artifacts and LoRA adapters load as they are served.
+    Runs in the export worker process.
+    """
+    import torch
+    from api.inference import format_prompt
+    from api.model_cache import model_cache
+    from api.speculative import SpeculativeDecoder
+
+    torch.manual_seed(0)
+    target = model_cache.acquire(model_id)
+    draft = model_cache.acquire(draft_model_id)
+    try:
+        prompt_ids = [target.tokenizer(format_prompt(prompt))["input_ids"] for prompt in BENCHMARK_PROMPTS]
+        eos_id = target.tokenizer.eos_token_id
+
+        def run(decoder: SpeculativeDecoder) -> Dict[str, Any]:
+            def generate(ids: List[int]) -> List[int]:
+                generated = []
+                for token in decoder.generate(ids, max_new_tokens):
+                    if token == eos_id:
+                        break
+                    generated.append(token)
+                return generated
+
+            # Warm-up run so one-off allocation and kernel selection are not timed
+            generate(prompt_ids[0])
+
+            started = time.perf_counter()
+            outputs = [generate(ids) for ids in prompt_ids]
+            seconds = max(time.perf_counter() - started, 1e-9)
+            tokens = sum(len(ids) for ids in outputs)
+            return {
+                "tokens_per_second": round(tokens / seconds, 2),
+                "generated_tokens": tokens,
+                "outputs": outputs,
+            }
+
+        reference = run(SpeculativeDecoder(target))
+        decoder = SpeculativeDecoder(target, draft, num_draft_tokens)
+        speculative = run(decoder)
+    finally:
+        model_cache.release(draft_model_id)
+        model_cache.release(model_id)
+
+    metrics = decoder.metrics()
+    return {
+        "draft_model_id": draft_model_id,
+        "num_draft_tokens": decoder.num_draft_tokens,
+        "prompts": len(BENCHMARK_PROMPTS),
+        "max_new_tokens": max_new_tokens,
+        "reference": {k: v for k, v in reference.items() if k != "outputs"},
+        "speculative": {k: v for k, v in speculative.items() if k != "outputs"},
+        "acceptance_rate": round(metrics["acceptance_rate"], 4),
+        "tokens_per_target_pass": round(metrics["tokens_per_target_pass"], 3),
+        "agreement": agreement(reference["outputs"], speculative["outputs"]),
+        "speedup": round(speculative["tokens_per_second"] / max(reference["tokens_per_second"], 1e-9), 3),
+        "created_at": time.time(),
+    }
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_export_executor() -> ProcessPoolExecutor:
+    """One spawned worker runs exports so the API process never holds a second model copy"""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def shutdown_export_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
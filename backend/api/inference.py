@@ -1,18 +1,56 @@
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from transformers import AutoConfig, AutoTokenizer, AutoModelForCausalLM, StoppingCriteria, StoppingCriteriaList
 from peft import PeftModel
 import logging
-from typing import Dict, Any, Optional
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, Optional, Union
 import os
+import threading
+import time
+
+from api.detokenize import StopSequences
+from api.model_cache import QUANTIZED_WEIGHTS_NAME
+from monitoring.metrics import TOKENS_PER_SECOND
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+PROMPT_TEMPLATE = "### Instruction:\n{prompt}\n\n### Response:\n"
+
+def format_prompt(prompt: str) -> str:
+    """Wrap a raw prompt in the instruction template used during training"""
+    return PROMPT_TEMPLATE.format(prompt=prompt)
+
+def context_window(model) -> Optional[int]:
+    """Positions a model can attend over (prompt plus new tokens), None if unbounded or unknown"""
+    config = getattr(model, "config", None)
+    return getattr(config, "max_position_embeddings", None) or getattr(config, "n_positions", None)
+
+def fit_to_context(prompt_length: int, max_new_tokens: int, context: Optional[int]) -> int:
+    """Shrink a token budget so prompt plus new tokens never run past the position embeddings"""
+    if context is None:
+        return max_new_tokens
+    return max(0, min(max_new_tokens, context - prompt_length))
+
+class _StopCriteria(StoppingCriteria):
+    """Lets generate() end a single sequence as soon as a StopSequences matches"""
+    def __init__(self, stop: StopSequences, prompt_length: int):
+        self.stop = stop
+        self.seen = prompt_length
+    
+    def __call__(self, input_ids, scores, **kwargs):
+        for token_id in input_ids[0, self.seen:].tolist():
+            self.stop.push(token_id)
+        self.seen = input_ids.shape[1]
+        return torch.full((input_ids.shape[0],), self.stop.reason is not None, dtype=torch.bool, device=input_ids.device)
+
 class ModelInference:
     def __init__(self, model_path: str):
         self.model_path = model_path
         self.model = None
         self.tokenizer = None
+        # Serializes forward passes and adapter changes on a shared base model
+        self._lock = threading.RLock()
         self.load_model()
         
     def load_model(self):
@@ -24,14 +62,20 @@ class ModelInference:
             self.tokenizer = AutoTokenizer.from_pretrained(self.model_path)
             if self.tokenizer.pad_token is None:
                 self.tokenizer.pad_token = self.tokenizer.eos_token
+            # Batched generation needs prompts aligned on the right
+            self.tokenizer.padding_side = "left"
             
-            # Load model
-            self.model = AutoModelForCausalLM.from_pretrained(
-                self.model_path,
-                torch_dtype=torch.float16,
-                device_map="auto",
-                trust_remote_code=True
-            )
+            if os.path.isfile(os.path.join(self.model_path, QUANTIZED_WEIGHTS_NAME)):
+                # int8 export: rebuild the quantized module layout, then load its weights
+                self.model = load_quantized_model(self.model_path)
+            else:
+                # Load model (fp16 kernels are only worthwhile on GPU)
+                self.model = AutoModelForCausalLM.from_pretrained(
+                    self.model_path,
+                    torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
+                    device_map="auto",
+                    trust_remote_code=True
+                )
             
             self.model.eval()
             logger.info("Model loaded successfully")
@@ -40,70 +84,200 @@ class ModelInference:
             logger.error(f"Failed to load model: {str(e)}")
             raise e
     
-    def generate_response(self, prompt: str, max_length: int = 512, temperature: float = 0.7) -> str:
-        """Generate response for a given prompt"""
+    def load_adapter(self, adapter_name: str, adapter_path: str):
+        """Attach a LoRA adapter to this (base) model under the given name"""
+        with self._lock:
+            if isinstance(self.model, PeftModel):
+                self.model.load_adapter(adapter_path, adapter_name=adapter_name)
+            else:
+                self.model = PeftModel.from_pretrained(self.model, adapter_path, adapter_name=adapter_name)
+            self.model.eval()
+        logger.info(f"Loaded adapter {adapter_name} from {adapter_path}")
+    
+    def unload_adapter(self, adapter_name: str):
+        """Drop a LoRA adapter's weights from this model"""
+        with self._lock:
+            if isinstance(self.model, PeftModel) and adapter_name in self.model.peft_config:
+                self.model.delete_adapter(adapter_name)
+    
+    @contextmanager
+    def activate(self, adapter_name: Optional[str] = None) -> Iterator[None]:
+        """Hold the model with the given adapter (or none) active for a forward pass"""
+        with self._lock:
+            if not isinstance(self.model, PeftModel):
+                yield
+            elif adapter_name is None:
+                with self.model.disable_adapter():
+                    yield
+            else:
+                if self.model.active_adapter != adapter_name:
+                    self.model.set_adapter(adapter_name)
+                yield
+    
+    def generate_response(self, prompt: str, max_length: int = 512, temperature: float = 0.7,
+                          max_new_tokens: int = 256, stop: Iterable[str] = (),
+                          stop_token_ids: Iterable[int] = ()) -> Dict[str, Any]:
+        """Generate a response for a prompt, with usage counts and why generation stopped.
+        
+        max_length truncates the prompt; max_new_tokens bounds the response. Generation
+        ends early at EOS, any of the stop token ids, or any stop string (not included).
+        Failures are logged and re-raised.
+        """
         try:
             # Format prompt
-            formatted_prompt = f"### Instruction:\n{prompt}\n\n### Response:\n"
+            formatted_prompt = format_prompt(prompt)
             
-            # Tokenize input
+            # Tokenize input, leaving room for at least one new token in the context window
+            context = context_window(self.model)
             inputs = self.tokenizer(
                 formatted_prompt,
                 return_tensors="pt",
                 truncation=True,
-                max_length=max_length
+                max_length=min(max_length, context - 1) if context else max_length
             )
             
             # Move to device
             inputs = {k: v.to(self.model.device) for k, v in inputs.items()}
+            prompt_length = inputs["input_ids"].shape[1]
+            max_new_tokens = fit_to_context(prompt_length, max_new_tokens, context)
+            stop_sequences = StopSequences(self.tokenizer, stop, stop_token_ids)
             
             # Generate response
+            started = time.perf_counter()
             with torch.no_grad():
                 outputs = self.model.generate(
                     **inputs,
-                    max_new_tokens=256,
+                    max_new_tokens=max_new_tokens,
                     temperature=temperature,
-                    do_sample=True,
+                    do_sample=temperature > 0,
                     pad_token_id=self.tokenizer.eos_token_id,
                     eos_token_id=self.tokenizer.eos_token_id,
+                    stopping_criteria=StoppingCriteriaList([_StopCriteria(stop_sequences, prompt_length)]),
                 )
             
-            # Decode response
-            response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-            
-            # Extract only the generated part
-            response = response.split("### Response:\n")[-1].strip()
+            # Only the new tokens are decoded, so an echoed template cannot confuse the answer
+            new_tokens = outputs[0, prompt_length:].tolist()
+            stop_reason = stop_sequences.reason
+            if stop_reason is None:
+                if new_tokens and new_tokens[-1] == self.tokenizer.eos_token_id:
+                    new_tokens.pop()
+                    stop_reason = "eos"
+                else:
+                    stop_reason = "length"
+            TOKENS_PER_SECOND.observe(len(new_tokens) / max(time.perf_counter() - started, 1e-9))
             
-            return response
+            return {
+                "text": stop_sequences.text.strip(),
+                "prompt_tokens": prompt_length,
+                "completion_tokens": len(new_tokens),
+                "stop_reason": stop_reason,
+            }
             
         except Exception as e:
+            # Raised rather than returned, so callers never serve or cache the error as a completion
             logger.error(f"Generation failed: {str(e)}")
-            return f"Error generating response: {str(e)}"
+            raise
     
-    def batch_generate(self, prompts: list, max_length: int = 512, temperature: float = 0.7) -> list:
-        """Generate responses for multiple prompts"""
-        responses = []
-        for prompt in prompts:
-            response = self.generate_response(prompt, max_length, temperature)
-            responses.append(response)
-        return responses
+    def batch_generate(self, prompts: list, max_length: int = 512, temperature: float = 0.7,
+                       max_new_tokens: int = 256) -> list:
+        """Generate responses for multiple prompts in a single left-padded generate call"""
+        if not prompts:
+            return []
+        
+        try:
+            inputs = self.tokenizer(
+                [format_prompt(prompt) for prompt in prompts],
+                return_tensors="pt",
+                padding=True,
+                truncation=True,
+                max_length=max_length
+            )
+            inputs = {k: v.to(self.model.device) for k, v in inputs.items()}
+            
+            started = time.perf_counter()
+            with torch.no_grad():
+                outputs = self.model.generate(
+                    **inputs,
+                    max_new_tokens=max_new_tokens,
+                    temperature=temperature,
+                    do_sample=temperature > 0,
+                    pad_token_id=self.tokenizer.pad_token_id,
+                    eos_token_id=self.tokenizer.eos_token_id,
+                )
+            
+            # Left padding keeps every prompt ending at the same column
+            new_tokens = outputs[:, inputs["input_ids"].shape[1]:]
+            elapsed = max(time.perf_counter() - started, 1e-9)
+            for count in (new_tokens != self.tokenizer.pad_token_id).sum(dim=1).tolist():
+                TOKENS_PER_SECOND.observe(count / elapsed)
+            return [
+                text.strip()
+                for text in self.tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+            ]
+            
+        except Exception as e:
+            logger.error(f"Batch generation failed: {str(e)}")
+            return [f"Error generating response: {str(e)}"] * len(prompts)
 
-# Global model cache
-model_cache: Dict[str, ModelInference] = {}
+class AdapterInference:
+    """A LoRA fine-tune served from a shared, resident base model.
 
-def get_model(model_id: str) -> ModelInference:
-    """Get or load model for inference"""
-    if model_id not in model_cache:
-        model_path = f"outputs/{model_id}"
-        if not os.path.exists(model_path):
-            raise ValueError(f"Model not found: {model_id}")
-        
-        model_cache[model_id] = ModelInference(model_path)
+    Exposes the same model/tokenizer surface as ModelInference; every forward
+    pass must run inside activate(), which switches the base to this adapter.
+    """
+    def __init__(self, base: ModelInference, adapter_name: str):
+        self.base = base
+        self.adapter_name = adapter_name
+    
+    @property
+    def model(self):
+        return self.base.model
+    
+    @property
+    def tokenizer(self):
+        return self.base.tokenizer
     
-    return model_cache[model_id]
+    def activate(self):
+        return self.base.activate(self.adapter_name)
+    
+    def generate_response(self, *args, **kwargs) -> Dict[str, Any]:
+        with self.activate():
+            return self.base.generate_response(*args, **kwargs)
+    
+    def batch_generate(self, *args, **kwargs) -> list:
+        with self.activate():
+            return self.base.batch_generate(*args, **kwargs)
+
+Inference = Union[ModelInference, AdapterInference]
+
+def quantize_int8(model):
+    """Dynamic int8 quantization of every nn.Linear, for CPU serving"""
+    return torch.ao.quantization.quantize_dynamic(model.to("cpu"), {torch.nn.Linear}, dtype=torch.qint8)
+
+def load_quantized_model(model_path: str):
+    """Load a model exported with quantize_int8()"""
+    config = AutoConfig.from_pretrained(model_path, trust_remote_code=True)
+    model = quantize_int8(AutoModelForCausalLM.from_config(config, torch_dtype=torch.float32, trust_remote_code=True))
+    # Packed int8 weights are not plain tensors, so this is not a weights-only load
+    state_dict = torch.load(os.path.join(model_path, QUANTIZED_WEIGHTS_NAME), map_location="cpu", weights_only=False)
+    model.load_state_dict(state_dict)
+    return model
 
-def clear_model_cache():
-    """Clear the model cache to free memory"""
-    global model_cache
-    model_cache.clear()
-    torch.cuda.empty_cache() if torch.cuda.is_available() else None
\ No newline at end of file
+def model_nbytes(model) -> int:
+    """Real memory held by a model's parameters and buffers (tied weights counted once)"""
+    seen = set()
+    total = 0
+    for tensor in list(model.parameters()) + list(model.buffers()):
+        key = (tensor.device, tensor.data_ptr())
+        if key in seen:
+            continue
+        seen.add(key)
+        total += tensor.numel() * tensor.element_size()
+    # Dynamically quantized layers keep packed weights outside parameters()
+    for module in model.modules():
+        if isinstance(module, torch.ao.nn.quantized.dynamic.Linear):
+            weight, bias = module._weight_bias()
+            total += weight.numel() * weight.element_size()
+            if bias is not None:
+                total += bias.numel() * bias.element_size()
+    return total
@@ -0,0 +1,347 @@
+import gc
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+from monitoring.metrics import registry
+from storage.models import model_store
+
+if TYPE_CHECKING:
+    from api.inference import AdapterInference, Inference
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Files written by the deployment export pipeline (api/export.py)
+EXPORT_MANIFEST_NAME = "export.json"
+QUANTIZED_WEIGHTS_NAME = "model_int8.pt"
+EXPORT_STORAGE_PATH = os.getenv('EXPORT_STORAGE_PATH', './exports')
+
+WEIGHT_FILE_SUFFIXES = (".safetensors", ".bin", ".pt")
+# Cache keys of shared base models; deployments reference them through their adapters
+BASE_PREFIX = "base:"
+# Cache keys of exported deployment artifacts
+EXPORT_PREFIX = "export:"
+
+def adapter_base(model_path: str) -> Optional[str]:
+    """Base model of a LoRA adapter directory, or None for a standalone model.
+
+    Hub names are mapped to their copy in the local model store when there is one.
+    """
+    config_path = os.path.join(model_path, "adapter_config.json")
+    if not os.path.isfile(config_path):
+        return None
+    with open(config_path) as f:
+        base_name = json.load(f).get("base_model_name_or_path")
+    return model_store.resolve(base_name) if base_name else base_name
+
+def estimate_model_bytes(model_path: str) -> int:
+    """Rough size of a model before loading it, from its weight files on disk"""
+    total = 0
+    for root, _, files in os.walk(model_path):
+        for name in files:
+            if name.endswith(WEIGHT_FILE_SUFFIXES):
+                total += os.path.getsize(os.path.join(root, name))
+    return total
+
+def artifact_version(model_path: str) -> str:
+    """Fingerprint of the weights and configs a model directory was loaded from"""
+    if not os.path.isdir(model_path):
+        # A hub name; its revision is pinned by the name itself
+        return model_path
+    digest = hashlib.blake2b(digest_size=8)
+    for name in sorted(os.listdir(model_path)):
+        path = os.path.join(model_path, name)
+        if os.path.isfile(path) and name.endswith(WEIGHT_FILE_SUFFIXES + (".json",)):
+            stat = os.stat(path)
+            digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()
+
+class _CacheEntry:
+    def __init__(self, inference: "Inference", nbytes: int, base_key: Optional[str] = None):
+        self.inference = inference
+        self.nbytes = nbytes
+        self.refcount = 0
+        # Set for adapters: the cache key of the base model they are attached to
+        self.base_key = base_key
+
+class ModelCache:
+    """LRU cache of loaded models bounded by a byte budget.
+
+    Models with in-flight requests (refcount > 0) are never evicted, and
+    concurrent first requests for the same model share a single load.
+    A budget of 0 means unbounded.
+
+    LoRA fine-tunes are not loaded as standalone models: their base model is
+    cached once under "base:<name>" and each adapter is attached to it. Adapters
+    have their own LRU, at most `max_adapters` per base, and pin their base
+    while they serve requests. Adapters count toward the byte budget, and idle
+    ones are evicted before any base. Evicting a base drops its adapters with it.
+    """
+    def __init__(self, max_bytes: Optional[int] = None, max_adapters: Optional[int] = None):
+        if max_bytes is None:
+            max_bytes = int(float(os.getenv('MODEL_CACHE_MAX_GB', '0')) * 1024 ** 3)
+        self.max_bytes = max_bytes
+        self.max_adapters = max_adapters or int(os.getenv('MAX_ADAPTERS_PER_MODEL', '16'))
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._adapters: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._loading = set()
+        self._lock = threading.Condition()
+        self._evict_callbacks: List[Callable[[str, "Inference"], None]] = []
+        # Artifact version each model was last loaded from; kept across evictions
+        self.versions: Dict[str, str] = {}
+        self.stats = {"hits": 0, "misses": 0, "loads": 0, "evictions": 0, "adapter_loads": 0, "adapter_evictions": 0}
+    
+    @property
+    def total_bytes(self) -> int:
+        return (sum(entry.nbytes for entry in self._entries.values())
+                + sum(entry.nbytes for entry in self._adapters.values()))
+    
+    def add_evict_callback(self, callback: Callable[[str, "Inference"], None]):
+        """Register a hook called with (model_id, inference) after a model or adapter is evicted"""
+        self._evict_callbacks.append(callback)
+    
+    def _model_path(self, model_id: str) -> str:
+        if model_id.startswith(BASE_PREFIX):
+            # A hub name or a local directory, as recorded in the adapter config
+            return model_id[len(BASE_PREFIX):]
+        if model_id.startswith(EXPORT_PREFIX):
+            model_path = os.path.join(EXPORT_STORAGE_PATH, model_id[len(EXPORT_PREFIX):])
+        else:
+            model_path = f"outputs/{model_id}"
+        if not os.path.exists(model_path):
+            raise ValueError(f"Model not found: {model_id}")
+        return model_path
+    
+    def loaded(self, model_id: str) -> bool:
+        """Whether a model or adapter is resident right now"""
+        return model_id in self._entries or model_id in self._adapters
+    
+    def acquire(self, model_id: str) -> "Inference":
+        """Return a loaded model and pin it until the matching release()"""
+        with self._lock:
+            while True:
+                adapter = self._adapters.get(model_id)
+                if adapter is not None:
+                    self._adapters.move_to_end(model_id)
+                    self._entries.move_to_end(adapter.base_key)
+                    self._entries[adapter.base_key].refcount += 1
+                    adapter.refcount += 1
+                    self.stats["hits"] += 1
+                    return adapter.inference
+                entry = self._entries.get(model_id)
+                if entry is not None:
+                    self._entries.move_to_end(model_id)
+                    entry.refcount += 1
+                    self.stats["hits"] += 1
+                    return entry.inference
+                if model_id not in self._loading:
+                    break
+                # Another request is already loading this model
+                self._lock.wait()
+            
+            self._loading.add(model_id)
+            self.stats["misses"] += 1
+        
+        try:
+            model_path = self._model_path(model_id)
+            base_name = None if model_id.startswith(BASE_PREFIX) else adapter_base(model_path)
+            if base_name is not None:
+                return self._load_adapter(model_id, model_path, BASE_PREFIX + base_name)
+            
+            # Make room up front so the new model and the victims never coexist
+            with self._lock:
+                evicted = self._evict(estimate_model_bytes(model_path))
+            self._run_evict_callbacks(evicted)
+            
+            version = artifact_version(model_path)
+            inference, nbytes = self._load_model(model_path)
+            entry = _CacheEntry(inference, nbytes)
+            entry.refcount = 1
+        except Exception:
+            with self._lock:
+                self._loading.discard(model_id)
+                self._lock.notify_all()
+            raise
+        
+        with self._lock:
+            self._entries[model_id] = entry
+            self.versions[model_id] = version
+            self._loading.discard(model_id)
+            self.stats["loads"] += 1
+            evicted = self._evict(0)
+            self._lock.notify_all()
+        self._run_evict_callbacks(evicted)
+        
+        logger.info(f"Cached model {model_id} ({entry.nbytes / 1024 ** 2:.1f} MiB, "
+                    f"{self.total_bytes / 1024 ** 2:.1f} MiB total)")
+        return inference
+    
+    def _load_adapter(self, model_id: str, model_path: str, base_key: str) -> "AdapterInference":
+        """Attach an adapter to its (possibly newly loaded) base; the caller holds the loading slot"""
+        # The base pin taken here becomes this request's pin on the base
+        base = self.acquire(base_key)
+        try:
+            with self._lock:
+                evicted = self._evict_adapters(base_key, self.max_adapters - 1)
+            self._run_evict_callbacks(evicted)
+            
+            version = artifact_version(model_path)
+            entry = _CacheEntry(self._attach_adapter(base, model_id, model_path),
+                                estimate_model_bytes(model_path), base_key)
+            entry.refcount = 1
+        except Exception:
+            self.release(base_key)
+            raise
+        
+        with self._lock:
+            self._adapters[model_id] = entry
+            self.versions[model_id] = version
+            self._loading.discard(model_id)
+            self.stats["adapter_loads"] += 1
+            self._lock.notify_all()
+        
+        logger.info(f"Cached adapter {model_id} on {base_key} ({entry.nbytes / 1024 ** 2:.1f} MiB)")
+        return entry.inference
+    
+    def _load_model(self, model_path: str) -> Tuple["Inference", int]:
+        """Load a standalone model and measure it; the ML stack is only imported here"""
+        from api.inference import ModelInference, model_nbytes
+        inference = ModelInference(model_path)
+        return inference, model_nbytes(inference.model)
+    
+    def _attach_adapter(self, base: "Inference", model_id: str, model_path: str) -> "AdapterInference":
+        from api.inference import AdapterInference
+        base.load_adapter(model_id, model_path)
+        return AdapterInference(base, model_id)
+    
+    def release(self, model_id: str):
+        """Unpin a model acquired with acquire()"""
+        with self._lock:
+            adapter = self._adapters.get(model_id)
+            if adapter is not None:
+                if adapter.refcount > 0:
+                    adapter.refcount -= 1
+                model_id = adapter.base_key
+            entry = self._entries.get(model_id)
+            if entry is not None and entry.refcount > 0:
+                entry.refcount -= 1
+            evicted = self._evict(0)
+        self._run_evict_callbacks(evicted)
+    
+    def preload(self, model_ids: List[str]):
+        """Load models ahead of their first request"""
+        for model_id in model_ids:
+            try:
+                self.acquire(model_id)
+                self.release(model_id)
+            except Exception as e:
+                logger.error(f"Failed to preload model {model_id}: {str(e)}")
+    
+    def clear(self):
+        """Evict every model and adapter that has no in-flight requests"""
+        with self._lock:
+            evicted = self._evict_adapters(None, 0)
+            for model_id, entry in list(self._entries.items()):
+                if entry.refcount == 0:
+                    evicted += self._pop_entry(model_id)
+        self._run_evict_callbacks(evicted)
+    
+    def _pop_entry(self, model_id: str) -> list:
+        """Remove a model and any adapters attached to it; caller holds the lock"""
+        evicted = [
+            (adapter_id, self._adapters.pop(adapter_id))
+            for adapter_id, adapter in list(self._adapters.items())
+            if adapter.base_key == model_id
+        ]
+        self.stats["adapter_evictions"] += len(evicted)
+        evicted.append((model_id, self._entries.pop(model_id)))
+        self.stats["evictions"] += 1
+        return evicted
+    
+    def _evict_adapters(self, base_key: Optional[str], keep: int) -> list:
+        """Pop least-recently-used idle adapters of a base (all bases for None) down to `keep`"""
+        evicted = []
+        candidates = [
+            adapter_id for adapter_id, adapter in self._adapters.items()
+            if base_key is None or adapter.base_key == base_key
+        ]
+        for adapter_id in candidates:
+            if len(candidates) - len(evicted) <= keep:
+                break
+            if self._adapters[adapter_id].refcount == 0:
+                evicted.append((adapter_id, self._adapters.pop(adapter_id)))
+                self.stats["adapter_evictions"] += 1
+        return evicted
+    
+    def _evict(self, incoming: int) -> list:
+        """Pop least-recently-used idle adapters, then idle models, until `incoming` more bytes fit.
+
+        Adapters go first: they are cheap to reattach, and a base pinned by one
+        busy adapter can still shed its idle ones. Caller holds the lock.
+        """
+        evicted = []
+        if not self.max_bytes:
+            return evicted
+        
+        while self.total_bytes + incoming > self.max_bytes:
+            adapter_id = next(
+                (adapter_id for adapter_id, adapter in self._adapters.items() if adapter.refcount == 0),
+                None
+            )
+            if adapter_id is not None:
+                evicted.append((adapter_id, self._adapters.pop(adapter_id)))
+                self.stats["adapter_evictions"] += 1
+                continue
+            victim = next(
+                (model_id for model_id, entry in self._entries.items() if entry.refcount == 0),
+                None
+            )
+            if victim is None:
+                logger.warning(f"Model cache over budget ({self.total_bytes} bytes) with every model in use")
+                break
+            evicted += self._pop_entry(victim)
+        return evicted
+    
+    def _run_evict_callbacks(self, evicted: list):
+        if not evicted:
+            return
+        for model_id, entry in evicted:
+            if entry.base_key is not None:
+                entry.inference.base.unload_adapter(model_id)
+                logger.info(f"Evicted adapter {model_id} from {entry.base_key}")
+            else:
+                logger.info(f"Evicted model {model_id} from cache")
+            for callback in self._evict_callbacks:
+                callback(model_id, entry.inference)
+        entry = None
+        evicted.clear()
+        gc.collect()
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+# Global model cache
+model_cache = ModelCache()
+
+def get_model(model_id: str) -> "Inference":
+    """Get or load model for inference"""
+    inference = model_cache.acquire(model_id)
+    model_cache.release(model_id)
+    return inference
+
+registry.gauge("model_cache_bytes", "Estimated bytes of loaded models",
+               fn=lambda: {(): model_cache.total_bytes})
+registry.gauge("model_cache_models", "Number of loaded models",
+               fn=lambda: {(): len(model_cache._entries)})
+registry.gauge("model_cache_adapters", "Number of LoRA adapters attached to cached base models",
+               fn=lambda: {(): len(model_cache._adapters)})
+
+def clear_model_cache():
+    """Clear the model cache to free memory"""
+    model_cache.clear()
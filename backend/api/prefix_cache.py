@@ -0,0 +1,122 @@
+import hashlib
+import logging
+import os
+from array import array
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, Any, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import torch
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_BLOCK_SIZE = int(os.getenv('PREFIX_CACHE_BLOCK_SIZE', '16'))
+DEFAULT_MAX_MB = float(os.getenv('PREFIX_CACHE_MAX_MB', '256'))
+
+# Legacy past_key_values layout: one (key, value) pair per layer, each [batch, heads, seq, head_dim]
+PastKeyValues = Tuple[Tuple["torch.Tensor", ...], ...]
+
+
+def past_nbytes(past: PastKeyValues) -> int:
+    return sum(tensor.numel() * tensor.element_size() for layer in past for tensor in layer)
+
+
+class PrefixCache:
+    """LRU cache of past key/values for shared token prefixes.
+
+    Prompts are cut into fixed-size token blocks and every block boundary gets a
+    chained hash of all token ids before it, so lookups find the longest cached
+    prefix in a single pass. A prefix is only stored once it has been seen by at
+    least `min_sightings` prompts, which keeps one-off prompts from churning the cache.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None, block_size: Optional[int] = None,
+                 min_sightings: int = 2, max_tracked: int = 4096):
+        self.max_bytes = int(DEFAULT_MAX_MB * 1024 ** 2) if max_bytes is None else max_bytes
+        self.block_size = block_size or DEFAULT_BLOCK_SIZE
+        self.min_sightings = min_sightings
+        self.max_tracked = max_tracked
+
+        self._entries: "OrderedDict[str, Tuple[int, PastKeyValues, int]]" = OrderedDict()
+        self._sightings: "OrderedDict[str, int]" = OrderedDict()
+        self.total_bytes = 0
+
+        self.stats = {
+            "lookups": 0,
+            "hits": 0,
+            "prefill_tokens_total": 0,
+            "prefill_tokens_saved": 0,
+            "stores": 0,
+            "evictions": 0,
+        }
+
+    def block_hashes(self, token_ids: List[int]) -> List[str]:
+        """Chained hashes for every block boundary that leaves at least one token to prefill"""
+        hashes = []
+        digest = b""
+        usable = (len(token_ids) - 1) // self.block_size
+        for block in range(usable):
+            chunk = token_ids[block * self.block_size:(block + 1) * self.block_size]
+            digest = hashlib.blake2b(digest + array("q", chunk).tobytes(), digest_size=16).digest()
+            hashes.append(digest.hex())
+        return hashes
+
+    def match(self, token_ids: List[int], hashes: List[str]) -> Tuple[int, Optional[PastKeyValues]]:
+        """Longest cached prefix as (length in tokens, past key/values)"""
+        self.stats["lookups"] += 1
+        self.stats["prefill_tokens_total"] += len(token_ids)
+
+        for key in reversed(hashes):
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                length, past, _ = entry
+                self.stats["hits"] += 1
+                self.stats["prefill_tokens_saved"] += length
+                return length, past
+        return 0, None
+
+    def observe(self, hashes: List[str], matched: int) -> Optional[Tuple[str, int]]:
+        """Count sightings and return (key, length) of a prefix worth storing, if any"""
+        candidate = None
+        for block, key in enumerate(hashes):
+            count = self._sightings.pop(key, 0) + 1
+            self._sightings[key] = count
+            length = (block + 1) * self.block_size
+            if count >= self.min_sightings and length > matched and key not in self._entries:
+                candidate = (key, length)
+
+        while len(self._sightings) > self.max_tracked:
+            self._sightings.popitem(last=False)
+        return candidate
+
+    def store(self, key: str, length: int, past: PastKeyValues):
+        nbytes = past_nbytes(past)
+        if nbytes > self.max_bytes or key in self._entries:
+            return
+
+        while self._entries and self.total_bytes + nbytes > self.max_bytes:
+            _, (_, _, evicted_bytes) = self._entries.popitem(last=False)
+            self.total_bytes -= evicted_bytes
+            self.stats["evictions"] += 1
+
+        self._entries[key] = (length, past, nbytes)
+        self.total_bytes += nbytes
+        self.stats["stores"] += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._sightings.clear()
+        self.total_bytes = 0
+
+    def metrics(self) -> Dict[str, Any]:
+        lookups = self.stats["lookups"]
+        total = self.stats["prefill_tokens_total"]
+        return {
+            **self.stats,
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+            "prefill_saved_ratio": self.stats["prefill_tokens_saved"] / total if total else 0.0,
+        }
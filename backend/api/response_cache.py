@@ -0,0 +1,129 @@
+import os
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from monitoring.metrics import registry
+
+DEFAULT_MAX_MB = float(os.getenv('RESPONSE_CACHE_MAX_MB', '64'))
+DEFAULT_TTL_SECONDS = float(os.getenv('RESPONSE_CACHE_TTL_SECONDS', '3600'))
+
+# Rough per-entry bookkeeping cost on top of the prompt and response text
+ENTRY_OVERHEAD_BYTES = 256
+
+CacheKey = Tuple[Any, ...]
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Canonical form of a prompt for cache lookups"""
+    return unicodedata.normalize("NFC", prompt.replace("\r\n", "\n")).strip()
+
+
+def is_deterministic(temperature: float, seed: Optional[int]) -> bool:
+    """Greedy decoding and seeded sampling always produce the same completion"""
+    return temperature <= 0 or seed is not None
+
+
+class ResponseCache:
+    """LRU cache of completed responses for deterministic inference requests.
+
+    Entries are keyed by deployment, the artifact version the model was loaded
+    from, the normalized prompt and every generation parameter, and are bounded
+    by `max_bytes` and expire after `ttl` seconds. Only the event loop touches
+    the cache, so a hit is a dict lookup with no lock and no model access.
+    invalidate() retires every entry of a deployment at once by bumping its
+    generation; the orphaned entries age out through the LRU.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None, ttl: Optional[float] = None):
+        self.max_bytes = int(DEFAULT_MAX_MB * 1024 ** 2) if max_bytes is None else max_bytes
+        self.ttl = DEFAULT_TTL_SECONDS if ttl is None else ttl
+
+        self._entries: "OrderedDict[CacheKey, Tuple[float, Dict[str, Any], int]]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        # deployment_id -> [hits, misses]
+        self._counts: Dict[str, list] = {}
+        self.total_bytes = 0
+
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0, "invalidations": 0}
+
+    def key(self, deployment_id: str, version: str, prompt: str, params: Dict[str, Any]) -> CacheKey:
+        return (
+            deployment_id,
+            self._generations.get(deployment_id, 0),
+            version,
+            normalize_prompt(prompt),
+            tuple(sorted(params.items())),
+        )
+
+    def get(self, key: CacheKey) -> Optional[Dict[str, Any]]:
+        counts = self._counts.setdefault(key[0], [0, 0])
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] < time.monotonic():
+            self._pop(key)
+            self.stats["expired"] += 1
+            entry = None
+
+        if entry is None:
+            counts[1] += 1
+            self.stats["misses"] += 1
+            return None
+
+        self._entries.move_to_end(key)
+        counts[0] += 1
+        self.stats["hits"] += 1
+        return entry[1]
+
+    def put(self, key: CacheKey, response: Dict[str, Any]):
+        nbytes = ENTRY_OVERHEAD_BYTES + len(key[3].encode()) + len(str(response.get("text", "")).encode())
+        if nbytes > self.max_bytes:
+            return
+        if key in self._entries:
+            self._pop(key)
+
+        while self._entries and self.total_bytes + nbytes > self.max_bytes:
+            self._pop(next(iter(self._entries)))
+            self.stats["evictions"] += 1
+
+        self._entries[key] = (time.monotonic() + self.ttl, response, nbytes)
+        self.total_bytes += nbytes
+        self.stats["stores"] += 1
+
+    def invalidate(self, deployment_id: str):
+        """Drop every cached response of a deployment, e.g. after it is redeployed"""
+        self._generations[deployment_id] = self._generations.get(deployment_id, 0) + 1
+        self.stats["invalidations"] += 1
+
+    def _pop(self, key: CacheKey):
+        _, _, nbytes = self._entries.pop(key)
+        self.total_bytes -= nbytes
+
+    def clear(self):
+        self._entries.clear()
+        self.total_bytes = 0
+
+    def metrics(self, deployment_id: Optional[str] = None) -> Dict[str, Any]:
+        if deployment_id is not None:
+            hits, misses = self._counts.get(deployment_id, [0, 0])
+        else:
+            hits, misses = self.stats["hits"], self.stats["misses"]
+        lookups = hits + misses
+        return {
+            **self.stats,
+            "hits": hits,
+            "misses": misses,
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+
+response_cache = ResponseCache()
+
+registry.gauge("response_cache_hits", "Inference requests served from the response cache", ("deployment",),
+               fn=lambda: {(d,): c[0] for d, c in list(response_cache._counts.items())})
+registry.gauge("response_cache_misses", "Cacheable inference requests that ran the model", ("deployment",),
+               fn=lambda: {(d,): c[1] for d, c in list(response_cache._counts.items())})
+registry.gauge("response_cache_bytes", "Estimated bytes held by the response cache",
+               fn=lambda: {(): response_cache.total_bytes})
@@ -0,0 +1,245 @@
+import logging
+import os
+import queue
+import time
+from typing import Dict, Any, Iterator, List, Optional
+
+import torch
+
+from api.batching import ContinuousBatchScheduler, _Sequence, _to_legacy_cache
+from api.inference import Inference
+from monitoring.metrics import PREFILL_SECONDS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_NUM_DRAFT_TOKENS = int(os.getenv('SPECULATIVE_DRAFT_TOKENS', '4'))
+
+
+def check_compatible(target: Inference, draft: Inference):
+    """A draft model is only usable if its token ids mean the same text as the target's"""
+    if draft.tokenizer.get_vocab() != target.tokenizer.get_vocab():
+        raise ValueError("Draft model does not share the deployment model's tokenizer")
+
+
+class _KVState:
+    """One model's KV cache over a prefix of the committed tokens"""
+
+    def __init__(self, inference: Inference):
+        self.inference = inference
+        self.past = None
+        self.length = 0
+
+    def forward(self, token_ids: List[int]) -> torch.Tensor:
+        """Feed tokens after the cached ones and return the logits at each of them"""
+        device = self.inference.model.device
+        position_ids = torch.arange(self.length, self.length + len(token_ids), device=device).unsqueeze(0)
+        with self.inference.activate():
+            outputs = self.inference.model(
+                input_ids=torch.tensor([token_ids], device=device),
+                position_ids=position_ids,
+                past_key_values=self.past,
+                use_cache=True,
+            )
+        self.past = _to_legacy_cache(outputs.past_key_values)
+        self.length += len(token_ids)
+        return outputs.logits[0]
+
+    def rewind(self, length: int):
+        """Forget cached positions from `length` on, e.g. rejected draft tokens"""
+        if length < self.length:
+            self.past = tuple(
+                tuple(tensor[..., :length, :] for tensor in layer)
+                for layer in self.past
+            )
+            self.length = length
+
+
+class SpeculativeDecoder:
+    """Draft-model assisted decoding of a single sequence.
+
+    Every round the draft proposes up to `num_draft_tokens` tokens one at a time,
+    and the target scores all of them in one forward pass. Proposals are kept
+    while the target agrees: exact argmax match when greedy, the min(1, p/q)
+    rejection rule with a resample from the residual when sampling. Output
+    therefore follows the target's own distribution (greedy output is identical
+    to plain greedy decoding), at one target pass per 1..num_draft_tokens+1 tokens.
+    Without a draft, or with num_draft_tokens=0, this is plain decoding.
+    """
+
+    def __init__(self, target: Inference, draft: Optional[Inference] = None,
+                 num_draft_tokens: Optional[int] = None):
+        if draft is not None:
+            check_compatible(target, draft)
+        self.target = target
+        self.draft = draft
+        self.num_draft_tokens = DEFAULT_NUM_DRAFT_TOKENS if num_draft_tokens is None else num_draft_tokens
+        # Embedding matrices are sometimes padded past the real vocabulary
+        self.vocab_size = min(
+            len(target.tokenizer),
+            target.model.config.vocab_size,
+            draft.model.config.vocab_size if draft is not None else target.model.config.vocab_size,
+        )
+        self.stats = {
+            "rounds": 0,
+            "target_passes": 0,
+            "draft_tokens": 0,
+            "accepted_tokens": 0,
+            "tokens": 0,
+        }
+
+    def metrics(self) -> Dict[str, Any]:
+        proposed = self.stats["draft_tokens"]
+        passes = self.stats["target_passes"]
+        return {
+            **self.stats,
+            "acceptance_rate": self.stats["accepted_tokens"] / proposed if proposed else 0.0,
+            "tokens_per_target_pass": self.stats["tokens"] / passes if passes else 0.0,
+        }
+
+    def _pick(self, logits: torch.Tensor, temperature: float,
+              generator: Optional[torch.Generator]) -> int:
+        if temperature <= 0:
+            return int(logits.argmax())
+        probs = torch.softmax(logits.float() / temperature, dim=-1)
+        return int(torch.multinomial(probs, 1, generator=generator)[0])
+
+    @torch.no_grad()
+    def generate(self, prompt_ids: List[int], max_new_tokens: int, temperature: float = 0.0,
+                 generator: Optional[torch.Generator] = None) -> Iterator[int]:
+        """Yield new token ids as rounds complete, EOS included; close the iterator to stop early"""
+        vocab = self.vocab_size
+        greedy = temperature <= 0
+        target = _KVState(self.target)
+        draft = _KVState(self.draft) if self.draft is not None and self.num_draft_tokens > 0 else None
+
+        # Caches hold everything but the last committed token, which every round starts from
+        started = time.perf_counter()
+        if len(prompt_ids) > 1:
+            target.forward(prompt_ids[:-1])
+            self.stats["target_passes"] += 1
+            if draft is not None:
+                draft.forward(prompt_ids[:-1])
+        PREFILL_SECONDS.observe(time.perf_counter() - started)
+
+        tokens = list(prompt_ids)
+        produced = 0
+        while produced < max_new_tokens:
+            committed = len(tokens)
+            # Never propose past the token budget: the round always adds one target token
+            k = min(self.num_draft_tokens, max_new_tokens - produced - 1) if draft is not None else 0
+
+            proposed: List[int] = []
+            draft_probs: List[torch.Tensor] = []
+            feed = tokens[draft.length:] if k > 0 else []
+            for _ in range(k):
+                logits = draft.forward(feed)[-1, :vocab]
+                if greedy:
+                    token = int(logits.argmax())
+                else:
+                    probs = torch.softmax(logits.float() / temperature, dim=-1)
+                    token = int(torch.multinomial(probs, 1, generator=generator)[0])
+                    draft_probs.append(probs)
+                proposed.append(token)
+                feed = [token]
+
+            logits = target.forward([tokens[-1]] + proposed)[:, :vocab]
+            accepted = 0
+            correction = None
+            for i, token in enumerate(proposed):
+                if greedy:
+                    best = int(logits[i].argmax())
+                    if best != token:
+                        correction = best
+                        break
+                else:
+                    p = torch.softmax(logits[i].float() / temperature, dim=-1)
+                    q = draft_probs[i]
+                    u = float(torch.rand(1, generator=generator, device=p.device)[0])
+                    if u * float(q[token]) > float(p[token]):
+                        residual = (p - q).clamp(min=0)
+                        total = residual.sum()
+                        correction = int(torch.multinomial(residual / total if total > 0 else p, 1,
+                                                           generator=generator)[0])
+                        break
+                accepted += 1
+            if correction is None:
+                # Every proposal held: the target's prediction after the last one comes for free
+                correction = self._pick(logits[len(proposed)], temperature, generator)
+
+            new_tokens = proposed[:accepted] + [correction]
+            tokens.extend(new_tokens)
+            produced += len(new_tokens)
+            # Drop the cache entries of rejected proposals; the correction is fed next round
+            target.rewind(committed + accepted)
+            if draft is not None:
+                draft.rewind(min(draft.length, committed + accepted))
+
+            self.stats["rounds"] += 1
+            self.stats["target_passes"] += 1
+            self.stats["draft_tokens"] += k
+            self.stats["accepted_tokens"] += accepted
+            self.stats["tokens"] += len(new_tokens)
+            yield from new_tokens
+
+
+class SpeculativeScheduler(ContinuousBatchScheduler):
+    """Serves a deployment one request at a time with draft-model speculative decoding.
+
+    Speculation cuts the number of sequential target passes per request, which is
+    what bounds latency on CPU nodes, at the cost of batching: requests run in
+    arrival order. submit() and stream() behave as on the batch scheduler.
+    """
+
+    def __init__(self, inference: Inference, draft: Inference, num_draft_tokens: Optional[int] = None):
+        super().__init__(inference, max_batch_size=1)
+        self.draft = draft
+        self.decoder = SpeculativeDecoder(inference, draft, num_draft_tokens)
+        self.stats.update({"num_draft_tokens": self.decoder.num_draft_tokens, "speculative": self.decoder.metrics()})
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                seq = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if seq.cancelled:
+                continue
+
+            self._active = [seq]
+            try:
+                self._decode(seq)
+            except Exception as e:
+                logger.error(f"Speculative decoding failed: {str(e)}")
+                seq.resolve(error=e)
+            finally:
+                self._active = []
+
+    def _decode(self, seq: _Sequence):
+        self.stats["requests"] += 1
+        self.stats["prefill_batches"] += 1
+        self.stats["max_batch_size_seen"] = 1
+        if seq.seed is not None and seq.temperature > 0:
+            seq.generator = torch.Generator(device=self.device).manual_seed(seq.seed)
+
+        eos_id = self.inference.tokenizer.eos_token_id
+        stop_reason = "length"
+        tokens = self.decoder.generate(seq.prompt_ids, seq.max_new_tokens, seq.temperature, seq.generator)
+        try:
+            for token in tokens:
+                if seq.cancelled or self._stop.is_set():
+                    # Settle the request so its caller returns and releases the models
+                    seq.resolve(error=RuntimeError(
+                        "Inference request cancelled" if seq.cancelled else "Inference scheduler stopped"
+                    ))
+                    return
+                reason = self._record(seq, token, eos_id)
+                if reason is not None:
+                    stop_reason = reason
+                    break
+        finally:
+            tokens.close()
+            self.stats["decode_steps"] = self.decoder.stats["rounds"]
+            self.stats["speculative"] = self.decoder.metrics()
+
+        self._finish(seq, stop_reason)
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from db.database import db
+from webhooks.notifications import notification_service
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# (deployment_id, endpoint) -> [requests, errors]
+Counts = Dict[Tuple[str, str], List[int]]
+
+
+class UsageTracker:
+    """Per-deployment, per-endpoint request counters with a sliding window.
+
+    record() runs on the event loop and only bumps a dict entry; no lock or
+    database write on the request path. A background task rotates the current
+    bucket every `bucket_seconds`, keeps the last `window_seconds` of buckets
+    for live counts, upserts per-minute totals into api_usage and sends at most
+    one digest alert per `alert_interval` covering every hot endpoint.
+    """
+
+    def __init__(self, db, window_seconds: Optional[int] = None, bucket_seconds: int = 5,
+                 flush_interval: Optional[float] = None, alert_threshold: Optional[int] = None,
+                 alert_interval: Optional[float] = None):
+        self.db = db
+        self.window_seconds = window_seconds or int(os.getenv('USAGE_WINDOW_SECONDS', '60'))
+        self.bucket_seconds = bucket_seconds
+        self.flush_interval = flush_interval or float(os.getenv('USAGE_FLUSH_SECONDS', '30'))
+        self.alert_threshold = alert_threshold or int(os.getenv('USAGE_ALERT_THRESHOLD', '1000'))
+        self.alert_interval = alert_interval or float(os.getenv('USAGE_ALERT_INTERVAL_SECONDS', '900'))
+
+        self._current: Counts = {}
+        self._current_start = time.time()
+        self._window: "deque[Tuple[float, Counts]]" = deque(
+            maxlen=max(1, self.window_seconds // self.bucket_seconds)
+        )
+        self._unflushed: List[Tuple[float, Counts]] = []
+        self._last_flush = time.monotonic()
+        self._last_alert: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.stats = {"alerts_sent": 0, "alerts_suppressed": 0, "flushes": 0}
+
+    def record(self, deployment_id: str, endpoint: str):
+        """Count one request; must be called from the event loop"""
+        counts = self._current.get((deployment_id, endpoint))
+        if counts is None:
+            counts = self._current[(deployment_id, endpoint)] = [0, 0]
+        counts[0] += 1
+
+    def record_error(self, deployment_id: str, endpoint: str):
+        """Count a failure of a request already passed to record()"""
+        counts = self._current.get((deployment_id, endpoint))
+        if counts is None:
+            counts = self._current[(deployment_id, endpoint)] = [0, 0]
+        counts[1] += 1
+
+    def window_counts(self, deployment_id: Optional[str] = None) -> Dict[str, Dict[str, int]]:
+        """Requests and errors per endpoint over the sliding window"""
+        totals: Dict[str, Dict[str, int]] = {}
+        for key, (requests, errors) in self._window_totals().items():
+            if deployment_id is not None and key[0] != deployment_id:
+                continue
+            name = key[1] if deployment_id is not None else f"{key[0]}:{key[1]}"
+            totals[name] = {"requests": requests, "errors": errors}
+        return totals
+
+    def _window_totals(self) -> Counts:
+        cutoff = time.time() - self.window_seconds
+        totals: Counts = {}
+        buckets = [counts for start, counts in self._window if start >= cutoff]
+        for counts in buckets + [self._current]:
+            for key, (requests, errors) in counts.items():
+                total = totals.setdefault(key, [0, 0])
+                total[0] += requests
+                total[1] += errors
+        return totals
+
+    async def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._rotate()
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.bucket_seconds)
+            try:
+                self._rotate()
+                self._check_alerts()
+                if time.monotonic() - self._last_flush >= self.flush_interval:
+                    await self.flush()
+            except Exception as e:
+                logger.error(f"Usage accounting failed: {str(e)}")
+
+    def _rotate(self):
+        # Swapping the dict is atomic on the event loop, so record() never waits
+        bucket, self._current = self._current, {}
+        start, self._current_start = self._current_start, time.time()
+        if bucket:
+            self._window.append((start, bucket))
+            self._unflushed.append((start, bucket))
+
+    async def flush(self):
+        """Write accumulated counts as per-minute totals"""
+        self._last_flush = time.monotonic()
+        pending, self._unflushed = self._unflushed, []
+        if not pending:
+            return
+
+        rows: Dict[Tuple[str, str, int], List[int]] = {}
+        for start, counts in pending:
+            minute = int(start // 60 * 60)
+            for (deployment_id, endpoint), (requests, errors) in counts.items():
+                total = rows.setdefault((deployment_id, endpoint, minute), [0, 0])
+                total[0] += requests
+                total[1] += errors
+
+        try:
+            await self.db.run(lambda conn: conn.executemany('''
+                INSERT INTO api_usage (deployment_id, endpoint, minute, request_count, error_count)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (deployment_id, endpoint, minute) DO UPDATE SET
+                    request_count = request_count + excluded.request_count,
+                    error_count = error_count + excluded.error_count
+            ''', [(*key, requests, errors) for key, (requests, errors) in rows.items()]))
+            self.stats["flushes"] += 1
+        except Exception:
+            # Keep the counts for the next flush rather than losing them
+            self._unflushed = pending + self._unflushed
+            raise
+
+    def _check_alerts(self):
+        hot = sorted(
+            ((f"{deployment_id}:{endpoint}", counts[0])
+             for (deployment_id, endpoint), counts in self._window_totals().items()
+             if counts[0] >= self.alert_threshold),
+            key=lambda item: item[1],
+            reverse=True
+        )
+        if not hot:
+            return
+
+        now = time.monotonic()
+        if self._last_alert is not None and now - self._last_alert < self.alert_interval:
+            self.stats["alerts_suppressed"] += 1
+            return
+
+        notification_service.notify_api_usage_digest(hot, self.alert_threshold, self.window_seconds)
+        self._last_alert = now
+        self.stats["alerts_sent"] += 1
+
+
+usage_tracker = UsageTracker(db)
@@ -0,0 +1,180 @@
+"""HTTP load against the FastAPI app in-process: dashboard, job listing, upload and inference.
+
+Runs offline in a scratch directory with its own SQLite database and a tiny local model:
+
+    cd backend && python -m benchmarks.bench_api --concurrency 1 8 32
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+import httpx
+
+from benchmarks.harness import metric, percentile, seed_everything
+from benchmarks.tiny_model import build_tiny_model, write_synthetic_dataset
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEPLOYMENT_ID = "bench"
+MODEL_ID = "bench-model"
+
+# The API process must not import these until a model is actually needed
+ML_MODULES = ("torch", "transformers", "peft", "datasets", "accelerate")
+
+
+def measure_import_seconds(workdir: str, repeats: int) -> float:
+    """Median time for a fresh interpreter to import the API module.
+
+    Fails outright if importing it pulls in the ML stack.
+    """
+    code = (
+        "import json, sys, time; sys.path.insert(0, sys.argv[1]); started = time.perf_counter(); "
+        "import main; elapsed = time.perf_counter() - started; "
+        "print(json.dumps({'seconds': elapsed, 'modules': sorted(sys.modules)}))"
+    )
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'import.db')}"}
+    timings = []
+    for _ in range(repeats):
+        output = subprocess.run(
+            [sys.executable, "-c", code, BACKEND_DIR],
+            cwd=workdir, env=env, capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        loaded = [name for name in ML_MODULES if name in result["modules"]]
+        if loaded:
+            raise RuntimeError(f"Importing main loaded the ML stack: {', '.join(loaded)}")
+        timings.append(result["seconds"])
+    return statistics.median(timings)
+
+
+def seed_database(db, jobs: int, datasets: int):
+    """Rows for the listing and dashboard queries, plus an active deployment of the tiny model"""
+    with db.connection() as conn:
+        conn.executemany(
+            "INSERT INTO datasets (id, name, file_path, size, status) VALUES (?, ?, ?, ?, 'validated')",
+            [(f"ds-{i}", f"dataset-{i}.jsonl", f"uploads/dataset-{i}.jsonl", 1024 * i) for i in range(datasets)]
+        )
+        conn.executemany(
+            "INSERT INTO training_jobs (id, model_id, dataset_id, status, start_time) "
+            "VALUES (?, 'llama-7b', ?, ?, CURRENT_TIMESTAMP)",
+            [(f"job-{i}", f"ds-{i % max(datasets, 1)}", ("completed", "failed", "running")[i % 3])
+             for i in range(jobs)]
+        )
+        conn.execute(
+            "INSERT INTO api_deployments (id, model_id, endpoint_url, status) VALUES (?, ?, ?, 'active')",
+            (DEPLOYMENT_ID, MODEL_ID, f"http://localhost:8000/api/inference/{DEPLOYMENT_ID}")
+        )
+
+
+async def load(send: Callable[[httpx.AsyncClient, int], Awaitable[httpx.Response]], client: httpx.AsyncClient,
+               concurrency: int, total: int) -> Dict[str, float]:
+    """Issue `total` requests from `concurrency` workers; returns throughput and latency percentiles"""
+    latencies: List[float] = []
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            started = time.perf_counter()
+            response = await send(client, i)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{response.request.url} returned {response.status_code}: {response.text}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    return {
+        "rps": total / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+    }
+
+
+def run(concurrency: List[int], requests: int, inference_requests: int, upload_rows: int,
+        import_repeats: int = 3, seed: int = 0, threads: int = 1) -> Dict[str, Dict[str, Any]]:
+    seed_everything(seed, threads)
+    results = {}
+    cwd = os.getcwd()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results["api.import.seconds"] = metric(measure_import_seconds(workdir, import_repeats), "s", False)
+
+        # The app creates its directories and database relative to the working directory at start-up
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        os.chdir(workdir)
+        try:
+            sys.path.insert(0, BACKEND_DIR)
+            from main import app
+            from db.database import db
+
+            build_tiny_model(os.path.join("outputs", MODEL_ID), seed=seed)
+
+            etags = {}
+            payloads = []
+            for i in range(4):
+                path = write_synthetic_dataset(os.path.join(workdir, f"upload-{i}.jsonl"), upload_rows, seed=seed + i)
+                with open(path, "rb") as f:
+                    payloads.append(f.read())
+
+            scenarios = {
+                "dashboard": (requests, lambda client, i: client.get("/api/dashboard/stats")),
+                "jobs": (requests, lambda client, i: client.get("/api/training/jobs")),
+                # A poll of an unchanged listing, answered with 304
+                "jobs_unchanged": (requests, lambda client, i: client.get(
+                    "/api/training/jobs", headers={"If-None-Match": etags["jobs"]}
+                )),
+                "upload": (max(requests // 4, 1), lambda client, i: client.put(
+                    f"/api/upload/dataset/bench-{i}.jsonl", content=payloads[i % len(payloads)]
+                )),
+                "inference": (inference_requests, lambda client, i: client.post(
+                    f"/api/inference/{DEPLOYMENT_ID}",
+                    json={"prompt": f"explain how the model will learn {i % 4}", "temperature": 0, "cache": False}
+                )),
+            }
+
+            async def run_all():
+                transport = httpx.ASGITransport(app=app)
+                # ASGITransport does not send lifespan events, so run start-up (migrations etc.) here
+                async with app.router.lifespan_context(app):
+                    seed_database(db, jobs=500, datasets=100)
+                    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+                        etags["jobs"] = (await client.get("/api/training/jobs")).headers["etag"]
+                        await run_scenarios(client)
+
+            async def run_scenarios(client: httpx.AsyncClient):
+                for name, (total, send) in scenarios.items():
+                    # Warm up: first model load, SQLite page cache, lazy imports
+                    await load(send, client, 1, 2)
+                    for level in concurrency:
+                        stats = await load(send, client, level, max(total, level))
+                        results[f"api.{name}.c{level}.rps"] = metric(stats["rps"], "req/s", True)
+                        results[f"api.{name}.c{level}.p95_ms"] = metric(stats["p95_ms"], "ms", False)
+
+            asyncio.run(run_all())
+        finally:
+            os.chdir(cwd)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--inference-requests", type=int, default=16)
+    parser.add_argument("--upload-rows", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+
+    results = run(args.concurrency, args.requests, args.inference_requests, args.upload_rows, threads=args.threads)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
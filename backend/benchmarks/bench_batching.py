@@ -0,0 +1,91 @@
+"""Tokens/sec of the continuous batching scheduler versus one-prompt-at-a-time generation.
+
+Runs fully offline on CPU against a tiny locally built causal LM:
+
+    cd backend && python -m benchmarks.bench_batching --concurrency 1 8 32 128
+"""
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+
+import torch
+
+from api.batching import ContinuousBatchScheduler
+from api.inference import ModelInference
+from benchmarks.tiny_model import build_tiny_model
+
+PROMPT = "explain how the model will learn to answer a question"
+
+
+async def run_batched(scheduler: ContinuousBatchScheduler, concurrency: int,
+                      requests_per_client: int, max_new_tokens: int) -> dict:
+    async def client():
+        tokens = 0
+        for _ in range(requests_per_client):
+            result = await scheduler.submit(PROMPT, max_new_tokens=max_new_tokens, temperature=0)
+            tokens += result["completion_tokens"]
+        return tokens
+
+    start = time.perf_counter()
+    tokens = sum(await asyncio.gather(*[client() for _ in range(concurrency)]))
+    elapsed = time.perf_counter() - start
+    return {"tokens": tokens, "seconds": elapsed, "tokens_per_sec": tokens / elapsed}
+
+
+def run_unbatched(inference: ModelInference, concurrency: int, requests_per_client: int,
+                  max_new_tokens: int) -> dict:
+    inputs = inference.tokenizer(f"### Instruction:\n{PROMPT}\n\n### Response:\n", return_tensors="pt")
+    tokens = 0
+    start = time.perf_counter()
+    for _ in range(concurrency * requests_per_client):
+        with torch.no_grad():
+            outputs = inference.model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                do_sample=False,
+                pad_token_id=inference.tokenizer.pad_token_id,
+                eos_token_id=inference.tokenizer.eos_token_id,
+            )
+        tokens += outputs.shape[1] - inputs["input_ids"].shape[1]
+    elapsed = time.perf_counter() - start
+    return {"tokens": tokens, "seconds": elapsed, "tokens_per_sec": tokens / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--requests-per-client", type=int, default=2)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--skip-unbatched", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        inference = ModelInference(build_tiny_model(model_dir))
+        scheduler = ContinuousBatchScheduler(
+            inference, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms
+        )
+
+        results = []
+        for concurrency in args.concurrency:
+            row = {
+                "concurrency": concurrency,
+                "batched": asyncio.run(run_batched(
+                    scheduler, concurrency, args.requests_per_client, args.max_new_tokens
+                )),
+            }
+            if not args.skip_unbatched:
+                row["unbatched"] = run_unbatched(
+                    inference, concurrency, args.requests_per_client, args.max_new_tokens
+                )
+            results.append(row)
+
+        scheduler.stop()
+        print(json.dumps({"results": results, "scheduler_stats": scheduler.stats}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Model store downloads from a local hub stand-in: cold, deduplicated, flaky and resumed.
+
+    cd backend && python -m benchmarks.bench_download --shard-mb 32
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from typing import Any, Dict
+
+from benchmarks.harness import metric, seed_everything
+from benchmarks.local_hub import LocalHub
+from storage.models import DownloadError, ModelStore
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def write_repos(root: str, shard_bytes: int, seed: int = 0):
+    """Two repos that share their first shard, plus a .bin copy of the weights the store should skip"""
+    rng = random.Random(seed)
+    shared = rng.randbytes(shard_bytes)
+    for name in ("bench/model-a", "bench/model-b"):
+        repo = os.path.join(root, name)
+        os.makedirs(repo, exist_ok=True)
+        shards = [shared, rng.randbytes(shard_bytes)]
+        for i, data in enumerate(shards, start=1):
+            with open(os.path.join(repo, f"model-{i:05d}-of-00002.safetensors"), "wb") as f:
+                f.write(data)
+        with open(os.path.join(repo, "pytorch_model.bin"), "wb") as f:
+            f.write(b"".join(shards))
+        with open(os.path.join(repo, "config.json"), "w") as f:
+            json.dump({"model_type": "gpt2", "name": name}, f)
+
+
+def download(store: ModelStore, model_id: str, repo: str) -> Dict[str, Any]:
+    """Run one download to completion and return its final progress and wall time"""
+    started = time.perf_counter()
+    store.download(model_id, repo).result()
+    progress = store.progress(model_id)
+    progress["seconds"] = time.perf_counter() - started
+    return progress
+
+
+def run(shard_mb: int, drop_rate: float = 0.3, seed: int = 0, threads: int = 1) -> Dict[str, Dict[str, Any]]:
+    seed_everything(seed, threads)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        write_repos(os.path.join(workdir, "hub"), shard_mb * 1024 * 1024, seed=seed)
+        hub = LocalHub(os.path.join(workdir, "hub"), seed=seed).start()
+        try:
+            def new_store(name: str, **kwargs) -> ModelStore:
+                return ModelStore(os.path.join(workdir, name), hub.url, token="",
+                                  chunk_size=CHUNK_SIZE, backoff=0.01, **kwargs)
+
+            store = new_store("store")
+            cold = download(store, "model-a", "bench/model-a")
+            results["download.cold.mb_per_sec"] = metric(
+                cold["total_bytes"] / cold["seconds"] / 1e6, "MB/s", True
+            )
+
+            # The second model shares a shard with the first, so only the rest crosses the network
+            hub.reset_counters()
+            shared = download(store, "model-b", "bench/model-b")
+            if shared["reused_bytes"] != shard_mb * 1024 * 1024:
+                raise RuntimeError(f"Shared shard was not deduplicated: {shared}")
+            results["download.dedup.fetched_ratio"] = metric(
+                hub.bytes_sent / shared["total_bytes"], "ratio", False
+            )
+            store.shutdown()
+
+            # A link that drops a share of responses mid-transfer still finishes, without starting over
+            hub.drop_rate = drop_rate
+            hub.reset_counters()
+            store = new_store("flaky")
+            flaky = download(store, "model-a", "bench/model-a")
+            results["download.flaky.mb_per_sec"] = metric(
+                flaky["total_bytes"] / flaky["seconds"] / 1e6, "MB/s", True
+            )
+            results["download.flaky.overhead_ratio"] = metric(
+                hub.bytes_sent / flaky["total_bytes"] - 1, "ratio", False
+            )
+            store.shutdown()
+
+            # A download that gives up when the link goes down continues from its partial files next time
+            hub.drop_rate = 0.0
+            hub.link_budget = flaky["total_bytes"] // 2
+            hub.reset_counters()
+            store = new_store("resume", retries=0)
+            try:
+                download(store, "model-a", "bench/model-a")
+                raise RuntimeError("Download should have failed when the link went down")
+            except DownloadError:
+                failed = store.progress("model-a")
+            hub.link_budget = None
+            resumed = download(store, "model-a", "bench/model-a")
+            if resumed["resumed_bytes"] == 0:
+                raise RuntimeError(f"Nothing was resumed: {resumed}")
+            # Share of the model received twice because progress was lost between the attempts
+            results["download.resume.refetched_ratio"] = metric(
+                (failed["downloaded_bytes"] + resumed["downloaded_bytes"]) / resumed["total_bytes"] - 1, "ratio", False
+            )
+            store.shutdown()
+        finally:
+            hub.stop()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shard-mb", type=int, default=32)
+    parser.add_argument("--drop-rate", type=float, default=0.3)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.shard_mb, args.drop_rate), indent=2))
+
+
+if __name__ == "__main__":
+    main()
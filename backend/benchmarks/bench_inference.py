@@ -0,0 +1,81 @@
+"""Prefill and decode latency of ModelInference on a tiny local model.
+
+    cd backend && python -m benchmarks.bench_inference --prompt-lengths 32 128 512
+"""
+import argparse
+import json
+import tempfile
+from typing import Any, Dict, List
+
+import torch
+
+from api.inference import ModelInference, format_prompt
+from benchmarks.harness import median_seconds, metric, seed_everything
+from benchmarks.tiny_model import build_tiny_model
+
+
+def run(prompt_lengths: List[int], batch_sizes: List[int], decode_steps: int, repeats: int,
+        seed: int = 0, threads: int = 1) -> Dict[str, Dict[str, Any]]:
+    seed_everything(seed, threads)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        inference = ModelInference(build_tiny_model(model_dir, seed=seed))
+        model = inference.model
+        vocab_size = model.config.vocab_size
+        generator = torch.Generator().manual_seed(seed)
+
+        def random_ids(batch: int, length: int) -> torch.Tensor:
+            return torch.randint(0, vocab_size, (batch, length), generator=generator).to(model.device)
+
+        with torch.no_grad():
+            for length in prompt_lengths:
+                input_ids = random_ids(1, length)
+                seconds = median_seconds(lambda: model(input_ids=input_ids, use_cache=True), repeats)
+                results[f"inference.prefill.t{length}.ms"] = metric(seconds * 1000, "ms", False)
+
+            # Per-step decode cost with a realistic KV cache behind it
+            context = max(prompt_lengths)
+            for batch in batch_sizes:
+                past = model(input_ids=random_ids(batch, context), use_cache=True).past_key_values
+                next_ids = random_ids(batch, 1)
+
+                def decode():
+                    step_past = past
+                    for _ in range(decode_steps):
+                        step_past = model(input_ids=next_ids, past_key_values=step_past, use_cache=True).past_key_values
+
+                seconds = median_seconds(decode, repeats) / decode_steps
+                results[f"inference.decode.b{batch}.ms_per_step"] = metric(seconds * 1000, "ms", False)
+                results[f"inference.decode.b{batch}.tokens_per_sec"] = metric(batch / seconds, "tokens/s", True)
+
+            # Whole generate() loop with a fixed number of new tokens
+            inputs = inference.tokenizer(format_prompt("explain how the model will learn"), return_tensors="pt")
+            inputs = {k: v.to(model.device) for k, v in inputs.items()}
+            seconds = median_seconds(lambda: model.generate(
+                **inputs,
+                max_new_tokens=decode_steps,
+                min_new_tokens=decode_steps,
+                do_sample=False,
+                pad_token_id=inference.tokenizer.pad_token_id,
+            ), repeats)
+            results["inference.generate.tokens_per_sec"] = metric(decode_steps / seconds, "tokens/s", True)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--prompt-lengths", type=int, nargs="+", default=[32, 128, 512])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--decode-steps", type=int, default=32)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+
+    results = run(args.prompt_lengths, args.batch_sizes, args.decode_steps, args.repeats, threads=args.threads)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Draft-model speculative decoding vs plain decoding on two tiny local models sharing a tokenizer.
+
+    cd backend && python -m benchmarks.bench_speculative --draft-tokens 2 4 --max-new-tokens 64
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from api.inference import ModelInference, format_prompt
+from api.speculative import SpeculativeDecoder
+from benchmarks.harness import metric, seed_everything
+from benchmarks.tiny_model import WORDS, build_draft_model, build_tiny_model
+
+
+def decode_all(decoder: SpeculativeDecoder, prompts: List[List[int]], max_new_tokens: int):
+    """Greedy generations for every prompt (EOS does not stop them, so runs compare equal work) and the wall time"""
+    started = time.perf_counter()
+    outputs = [list(decoder.generate(ids, max_new_tokens)) for ids in prompts]
+    return outputs, time.perf_counter() - started
+
+
+def run(draft_tokens: List[int], max_new_tokens: int, num_prompts: int = 8, seed: int = 0,
+        threads: int = 1) -> Dict[str, Dict[str, Any]]:
+    seed_everything(seed, threads)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # The draft is the target's first block, so the two agree often without any training
+        target_path = build_tiny_model(os.path.join(workdir, "target"), n_layer=8, n_embd=256, seed=seed)
+        target = ModelInference(target_path)
+        draft = ModelInference(build_draft_model(target_path, os.path.join(workdir, "draft"), n_layer=1))
+
+        rng = random.Random(seed)
+        prompts = [
+            target.tokenizer(format_prompt(" ".join(rng.choice(WORDS) for _ in range(12))))["input_ids"]
+            for _ in range(num_prompts)
+        ]
+
+        plain = SpeculativeDecoder(target)
+        decode_all(plain, prompts[:1], max_new_tokens)
+        reference, plain_seconds = decode_all(plain, prompts, max_new_tokens)
+        results["speculative.plain.tokens_per_sec"] = metric(
+            num_prompts * max_new_tokens / plain_seconds, "tokens/s", True
+        )
+
+        for k in draft_tokens:
+            decoder = SpeculativeDecoder(target, draft, num_draft_tokens=k)
+            decode_all(decoder, prompts[:1], max_new_tokens)
+            outputs, seconds = decode_all(decoder, prompts, max_new_tokens)
+            # Greedy speculation must reproduce plain greedy decoding token for token
+            if outputs != reference:
+                raise RuntimeError(f"Speculative decoding with {k} draft tokens changed the greedy output")
+
+            metrics = decoder.metrics()
+            results[f"speculative.k{k}.tokens_per_sec"] = metric(
+                num_prompts * max_new_tokens / seconds, "tokens/s", True
+            )
+            results[f"speculative.k{k}.speedup"] = metric(plain_seconds / seconds, "ratio", True)
+            results[f"speculative.k{k}.acceptance_rate"] = metric(metrics["acceptance_rate"], "ratio", True)
+            results[f"speculative.k{k}.tokens_per_target_pass"] = metric(
+                metrics["tokens_per_target_pass"], "tokens", True
+            )
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--draft-tokens", type=int, nargs="+", default=[2, 4])
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--prompts", type=int, default=8)
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+
+    results = run(args.draft_tokens, args.max_new_tokens, args.prompts, threads=args.threads)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""AITrainer tokenization and training throughput on a tiny local model and synthetic data.
+
+    cd backend && python -m benchmarks.bench_training --rows 4000 --train-steps 20
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from typing import Any, Dict
+
+from benchmarks.harness import metric, seed_everything
+from benchmarks.tiny_model import build_tiny_model, write_synthetic_dataset
+
+# Small enough for CPU: no PEFT (the tiny GPT-2 has no q/k/v/o projections), fp32, no checkpointing
+BENCH_TRAINING_CONFIG = {
+    "learning_rate": 2e-4,
+    "batch_size": 8,
+    "epochs": 1,
+    "max_length": 128,
+    "warmup_steps": 0,
+    "save_steps": 100000,
+    "eval_steps": 100000,
+    "gradient_accumulation_steps": 1,
+    "use_peft": False,
+    "fp16": False,
+    "gradient_checkpointing": False,
+    "packing": False,
+    "group_by_length": True,
+    "use_tokenized_cache": False,
+}
+
+
+def run(rows: int, train_steps: int, seed: int = 0, threads: int = 1) -> Dict[str, Dict[str, Any]]:
+    seed_everything(seed, threads)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # Read at import time, so it has to be set before the trainer module loads
+        os.environ["TOKENIZED_CACHE_PATH"] = os.path.join(workdir, "tokenized")
+        from training.trainer import AITrainer
+
+        model_dir = build_tiny_model(os.path.join(workdir, "model"), seed=seed)
+        dataset_path = write_synthetic_dataset(os.path.join(workdir, "data.jsonl"), rows, seed=seed)
+
+        for packing in (False, True):
+            trainer = AITrainer({**BENCH_TRAINING_CONFIG, "packing": packing, "max_steps": train_steps})
+            trainer.load_model(model_dir)
+
+            started = time.perf_counter()
+            trainer.load_dataset(dataset_path)
+            elapsed = time.perf_counter() - started
+            mode = "packed" if packing else "padded"
+            if not packing:
+                results["training.tokenize.rows_per_sec"] = metric(rows / elapsed, "rows/s", True)
+
+            started = time.perf_counter()
+            trainer.train(os.path.join(workdir, f"output-{mode}"))
+            elapsed = time.perf_counter() - started
+            samples = train_steps * BENCH_TRAINING_CONFIG["batch_size"]
+            results[f"training.{mode}.samples_per_sec"] = metric(samples / elapsed, "samples/s", True)
+            results[f"training.{mode}.tokens_per_sec"] = metric(
+                trainer.token_stats.real_tokens / elapsed, "tokens/s", True
+            )
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=4000)
+    parser.add_argument("--train-steps", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.rows, args.train_steps, threads=args.threads), indent=2))
+
+
+if __name__ == "__main__":
+    main()
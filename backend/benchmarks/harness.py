@@ -0,0 +1,42 @@
+"""Shared helpers for the benchmark suite: metric records, timing and seeding."""
+import math
+import os
+import random
+import statistics
+import time
+from typing import Any, Callable, Dict, List
+
+import torch
+
+
+def metric(value: float, unit: str, higher_is_better: bool) -> Dict[str, Any]:
+    """One machine-readable result; the direction tells the baseline check what a regression is"""
+    return {"value": round(float(value), 4), "unit": unit, "higher_is_better": higher_is_better}
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile, q in [0, 100]"""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def median_seconds(fn: Callable[[], Any], repeats: int, warmup: int = 1) -> float:
+    """Median wall time of `fn` over `repeats` runs after `warmup` untimed runs"""
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def seed_everything(seed: int, threads: int):
+    """Fix RNGs and the intra-op thread count so runs are comparable"""
+    random.seed(seed)
+    torch.manual_seed(seed)
+    torch.set_num_threads(threads)
+    # Keep experiment trackers from starting during Trainer benchmarks
+    os.environ.setdefault("WANDB_MODE", "disabled")
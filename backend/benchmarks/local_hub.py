@@ -0,0 +1,198 @@
+"""A local stand-in for the model hub, serving repositories from a directory.
+
+Implements the parts of the Hugging Face hub protocol the model store uses: the
+revision listing with file sizes and checksums, and file downloads with HTTP
+range requests. It can cut responses short to simulate a flaky link, or go down
+for good after a number of bytes:
+
+    cd backend && python -m benchmarks.local_hub --root ./hub --port 8900 --drop-rate 0.2
+    MODEL_HUB_URL=http://localhost:8900 uvicorn main:app
+
+Repositories are directories two levels below the root (<root>/<org>/<name>).
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import unquote, urlsplit
+
+# Files at least this large are listed like Git LFS files, with a sha256
+LFS_THRESHOLD = 1024 * 1024
+COMMIT = "0" * 40
+SEND_SIZE = 64 * 1024
+
+LISTING_PATH = re.compile(r"/api/models/([^/]+/[^/]+)/revision/([^/]+)")
+RESOLVE_PATH = re.compile(r"/([^/]+/[^/]+)/resolve/([^/]+)/(.+)")
+RANGE_HEADER = re.compile(r"bytes=(\d+)-(\d*)")
+
+
+def repo_listing(repo_dir: str) -> List[Dict[str, Any]]:
+    """Hub-style siblings: git blob ids for every file, sha256 and size for large ones"""
+    siblings = []
+    for root, _, names in os.walk(repo_dir):
+        for filename in sorted(names):
+            path = os.path.join(root, filename)
+            with open(path, "rb") as f:
+                data = f.read()
+            sibling = {
+                "rfilename": os.path.relpath(path, repo_dir).replace(os.sep, "/"),
+                "size": len(data),
+                "blobId": hashlib.sha1(f"blob {len(data)}\0".encode() + data).hexdigest(),
+            }
+            if len(data) >= LFS_THRESHOLD:
+                sibling["lfs"] = {"sha256": hashlib.sha256(data).hexdigest(), "size": len(data)}
+            siblings.append(sibling)
+    return sorted(siblings, key=lambda s: s["rfilename"])
+
+
+class LocalHub:
+    """Serves <root>/<org>/<name> repositories over HTTP from a daemon thread"""
+
+    def __init__(self, root: str, port: int = 0, drop_rate: float = 0.0, seed: int = 0):
+        self.root = root
+        self.drop_rate = drop_rate
+        # Once this many bytes have been sent, every download is cut off (None: no limit)
+        self.link_budget: Optional[int] = None
+        self.bytes_sent = 0
+        self.requests = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._listings: Dict[str, List[Dict[str, Any]]] = {}
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.server.daemon_threads = True
+        # Clients hanging up on a cut response are expected, not errors
+        self.server.handle_error = lambda request, client_address: None
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self) -> "LocalHub":
+        threading.Thread(target=self.server.serve_forever, name="local-hub", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_counters(self):
+        with self._lock:
+            self.bytes_sent = 0
+            self.requests = 0
+
+    def listing(self, repo: str) -> Optional[List[Dict[str, Any]]]:
+        repo_dir = os.path.join(self.root, repo)
+        if not os.path.isdir(repo_dir):
+            return None
+        with self._lock:
+            if repo not in self._listings:
+                self._listings[repo] = repo_listing(repo_dir)
+            return self._listings[repo]
+
+    def _cut_at(self, length: int) -> Optional[int]:
+        """Where to drop this response, if it is one of the unlucky ones"""
+        with self._lock:
+            self.requests += 1
+            if self.link_budget is not None and self.bytes_sent + length > self.link_budget:
+                return max(self.link_budget - self.bytes_sent, 0)
+            if length and self._rng.random() < self.drop_rate:
+                return self._rng.randrange(length)
+            return None
+
+    def _count(self, nbytes: int):
+        with self._lock:
+            self.bytes_sent += nbytes
+
+    def _handler(self):
+        hub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                self._serve(send_body=True)
+
+            def do_HEAD(self):
+                self._serve(send_body=False)
+
+            def _serve(self, send_body: bool):
+                path = unquote(urlsplit(self.path).path)
+                listing = LISTING_PATH.fullmatch(path)
+                if listing:
+                    siblings = hub.listing(listing.group(1))
+                    if siblings is None:
+                        return self._error(404)
+                    body = json.dumps({"id": listing.group(1), "sha": COMMIT, "siblings": siblings}).encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    if send_body:
+                        self.wfile.write(body)
+                    return
+
+                resolve = RESOLVE_PATH.fullmatch(path)
+                file_path = resolve and os.path.join(hub.root, resolve.group(1), resolve.group(3))
+                if not file_path or ".." in resolve.group(3).split("/") or not os.path.isfile(file_path):
+                    return self._error(404)
+                size = os.path.getsize(file_path)
+                start, end = 0, size - 1
+                requested = RANGE_HEADER.fullmatch(self.headers.get("Range", ""))
+                if requested:
+                    start = int(requested.group(1))
+                    end = min(int(requested.group(2)), size - 1) if requested.group(2) else size - 1
+                    if start >= size or start > end:
+                        return self._error(416)
+                length = end - start + 1
+                self.send_response(206 if requested else 200)
+                self.send_header("Accept-Ranges", "bytes")
+                self.send_header("Content-Length", str(length))
+                if requested:
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+                self.end_headers()
+                if not send_body:
+                    return
+
+                cut_at = hub._cut_at(length)
+                with open(file_path, "rb") as f:
+                    f.seek(start)
+                    sent = 0
+                    while sent < length:
+                        data = f.read(min(SEND_SIZE, length - sent))
+                        if cut_at is not None and sent + len(data) > cut_at:
+                            # Simulate the link dropping mid-transfer
+                            self.wfile.write(data[:cut_at - sent])
+                            hub._count(cut_at - sent)
+                            self.close_connection = True
+                            return
+                        self.wfile.write(data)
+                        hub._count(len(data))
+                        sent += len(data)
+
+            def _error(self, status: int):
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--root", required=True, help="Directory of <org>/<name> repositories")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Share of downloads cut short")
+    args = parser.parse_args()
+
+    hub = LocalHub(args.root, args.port, args.drop_rate)
+    print(f"Serving {args.root} as a model hub on {hub.url}")
+    hub.server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Run the benchmark suite and compare it against stored baselines.
+
+Everything runs offline on CPU with tiny locally built models and synthetic data.
+Results are written as JSON; any metric that moves the wrong way by more than
+--threshold (relative) versus the baseline fails the run with exit code 1:
+
+    cd backend && python -m benchmarks.suite                    # run and check
+    cd backend && python -m benchmarks.suite --update-baseline  # record this machine's baseline
+    cd backend && python -m benchmarks.suite --only inference --threshold 0.2
+
+The api group also enforces an absolute budget on importing the API module
+(--import-budget seconds), and fails if that import loads torch or transformers.
+Baselines are only meaningful on the machine that recorded them, so the suite
+warns when the recorded environment differs from the current one.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+from typing import Any, Dict, List
+
+import torch
+
+from benchmarks import bench_api, bench_download, bench_inference, bench_speculative, bench_training
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+SUITES = {
+    "api": lambda args: bench_api.run(
+        args.concurrency, args.requests, args.inference_requests, upload_rows=500,
+        seed=args.seed, threads=args.threads
+    ),
+    "download": lambda args: bench_download.run(
+        shard_mb=32, drop_rate=0.3, seed=args.seed, threads=args.threads
+    ),
+    "inference": lambda args: bench_inference.run(
+        [32, 128, 512], [1, 8], decode_steps=32, repeats=args.repeats, seed=args.seed, threads=args.threads
+    ),
+    "speculative": lambda args: bench_speculative.run(
+        [2, 4], max_new_tokens=64, seed=args.seed, threads=args.threads
+    ),
+    "training": lambda args: bench_training.run(
+        rows=4000, train_steps=20, seed=args.seed, threads=args.threads
+    ),
+}
+
+
+def environment(args) -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "threads": args.threads,
+        "seed": args.seed,
+    }
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]],
+            threshold: float) -> List[Dict[str, Any]]:
+    """Relative change of every metric that has a baseline, flagged when it regressed past the threshold"""
+    rows = []
+    for name, current in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None or not base["value"]:
+            continue
+        change = current["value"] / base["value"] - 1
+        # A drop is bad for throughput, a rise is bad for latency
+        worse = -change if current["higher_is_better"] else change
+        rows.append({
+            "metric": name,
+            "baseline": base["value"],
+            "current": current["value"],
+            "unit": current["unit"],
+            "change": round(change, 4),
+            "regressed": worse > threshold,
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", nargs="+", choices=sorted(SUITES), default=sorted(SUITES))
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--output", help="Write results JSON here instead of stdout")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Allowed relative regression")
+    parser.add_argument("--import-budget", type=float, default=1.0, help="Max seconds to import the API module")
+    parser.add_argument("--update-baseline", action="store_true", help="Merge these results into the baseline")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--inference-requests", type=int, default=16)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.only:
+        print(f"Running {name} benchmarks...", file=sys.stderr)
+        results.update(SUITES[name](args))
+
+    report = {"environment": environment(args), "results": results}
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    if args.update_baseline:
+        merged = {"environment": report["environment"], "results": {**(baseline or {}).get("results", {}), **results}}
+        with open(args.baseline, "w") as f:
+            json.dump(merged, f, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.baseline}", file=sys.stderr)
+        baseline = None
+
+    comparison = []
+    if baseline is not None:
+        if baseline.get("environment") != report["environment"]:
+            print("Warning: baseline was recorded in a different environment", file=sys.stderr)
+        comparison = compare(results, baseline["results"], args.threshold)
+        report["comparison"] = comparison
+        for row in comparison:
+            flag = "REGRESSED" if row["regressed"] else "ok"
+            print(f"{flag:>9}  {row['metric']:<45} {row['baseline']:>12} -> {row['current']:>12} {row['unit']:<9} "
+                  f"({row['change']:+.1%})", file=sys.stderr)
+    elif not args.update_baseline:
+        print(f"No baseline at {args.baseline}; run with --update-baseline to record one", file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    failed = False
+    import_seconds = results.get("api.import.seconds", {}).get("value")
+    if import_seconds is not None and import_seconds > args.import_budget:
+        print(f"Importing the API took {import_seconds:.3f}s, over the {args.import_budget}s budget", file=sys.stderr)
+        failed = True
+
+    regressions = [row["metric"] for row in comparison if row["regressed"]]
+    if regressions:
+        print(f"{len(regressions)} metric(s) regressed by more than {args.threshold:.0%}", file=sys.stderr)
+        failed = True
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import json
+import os
+import random
+from typing import List
+
+import torch
+from tokenizers import Tokenizer, models, pre_tokenizers, decoders, trainers
+from transformers import GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast
+
+EOS_TOKEN = "<|endoftext|>"
+
+WORDS = [
+    "model", "train", "data", "token", "batch", "learn", "rate", "loss", "answer",
+    "question", "python", "server", "request", "deploy", "weights", "layer", "the",
+    "a", "is", "of", "to", "and", "in", "for", "with", "on", "fast", "slow", "small",
+]
+
+
+def synthetic_corpus(num_lines: int = 200, seed: int = 0) -> List[str]:
+    """Deterministic instruction-style text used to train the tiny tokenizer"""
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(num_lines):
+        instruction = " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 16)))
+        output = " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 32)))
+        lines.append(f"### Instruction:\n{instruction}\n\n### Response:\n{output}")
+    return lines
+
+
+def build_tiny_model(path: str, n_layer: int = 2, n_embd: int = 128, n_head: int = 4,
+                     seed: int = 0) -> str:
+    """Build and save a randomly initialized GPT-2 style causal LM plus tokenizer, fully offline"""
+    os.makedirs(path, exist_ok=True)
+    torch.manual_seed(seed)
+
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=512,
+        special_tokens=[EOS_TOKEN],
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet()
+    )
+    tokenizer.train_from_iterator(synthetic_corpus(seed=seed), trainer=trainer)
+
+    hf_tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer,
+        eos_token=EOS_TOKEN,
+        bos_token=EOS_TOKEN,
+        pad_token=EOS_TOKEN
+    )
+    hf_tokenizer.save_pretrained(path)
+
+    config = GPT2Config(
+        vocab_size=len(hf_tokenizer),
+        n_positions=1024,
+        n_embd=n_embd,
+        n_layer=n_layer,
+        n_head=n_head,
+        bos_token_id=hf_tokenizer.eos_token_id,
+        eos_token_id=hf_tokenizer.eos_token_id,
+    )
+    GPT2LMHeadModel(config).save_pretrained(path)
+
+    return path
+
+
+def build_draft_model(target_path: str, path: str, n_layer: int = 1) -> str:
+    """Save the first `n_layer` blocks of a tiny model as its draft model, with the same tokenizer"""
+    os.makedirs(path, exist_ok=True)
+    PreTrainedTokenizerFast.from_pretrained(target_path).save_pretrained(path)
+
+    model = GPT2LMHeadModel.from_pretrained(target_path)
+    model.transformer.h = model.transformer.h[:n_layer]
+    model.config.n_layer = n_layer
+    model.save_pretrained(path)
+
+    return path
+
+
+def write_synthetic_dataset(path: str, num_rows: int, seed: int = 0) -> str:
+    """Write an instruction/output JSONL dataset in the upload format"""
+    rng = random.Random(seed)
+    with open(path, "w") as f:
+        for _ in range(num_rows):
+            row = {
+                "instruction": " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 16))),
+                "output": " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 48))),
+            }
+            f.write(json.dumps(row) + "\n")
+    return path
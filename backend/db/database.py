@@ -0,0 +1,436 @@
+import asyncio
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, List, Optional, Sequence
+
+from monitoring.metrics import DB_QUERY_SECONDS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+]
+
+# Ordered schema migrations; the applied version is tracked in PRAGMA user_version
+MIGRATIONS = [
+    (1, "initial schema", [
+        '''
+        CREATE TABLE IF NOT EXISTS datasets (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            file_path TEXT NOT NULL,
+            size INTEGER,
+            upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            status TEXT DEFAULT 'uploaded'
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS models (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            type TEXT,
+            size TEXT,
+            parameters TEXT,
+            download_url TEXT,
+            is_downloaded BOOLEAN DEFAULT FALSE,
+            download_date TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS training_jobs (
+            id TEXT PRIMARY KEY,
+            model_id TEXT,
+            dataset_id TEXT,
+            config TEXT,
+            status TEXT DEFAULT 'pending',
+            start_time TIMESTAMP,
+            end_time TIMESTAMP,
+            output_path TEXT,
+            logs TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS api_deployments (
+            id TEXT PRIMARY KEY,
+            model_id TEXT,
+            endpoint_url TEXT,
+            status TEXT DEFAULT 'inactive',
+            created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (2, "listing and dashboard indexes", [
+        "CREATE INDEX IF NOT EXISTS idx_training_jobs_status_start ON training_jobs(status, start_time)",
+        "CREATE INDEX IF NOT EXISTS idx_api_deployments_status_created ON api_deployments(status, created_date)",
+        "CREATE INDEX IF NOT EXISTS idx_models_is_downloaded ON models(is_downloaded)",
+    ]),
+    (3, "content-addressed datasets", [
+        "ALTER TABLE datasets ADD COLUMN content_hash TEXT",
+        "ALTER TABLE datasets ADD COLUMN row_count INTEGER",
+        "CREATE INDEX IF NOT EXISTS idx_datasets_content_hash ON datasets(content_hash)",
+    ]),
+    (4, "training job queue", [
+        "ALTER TABLE training_jobs ADD COLUMN priority INTEGER DEFAULT 0",
+        "ALTER TABLE training_jobs ADD COLUMN queued_time TIMESTAMP",
+        "ALTER TABLE training_jobs ADD COLUMN dataset_path TEXT",
+        "CREATE INDEX IF NOT EXISTS idx_training_jobs_queue ON training_jobs(status, priority, queued_time)",
+    ]),
+    (5, "notification outbox", [
+        '''
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            target TEXT NOT NULL,
+            url TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            next_attempt_at REAL,
+            last_error TEXT,
+            created_at REAL,
+            updated_at REAL
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_notification_outbox_due ON notification_outbox(status, next_attempt_at)",
+    ]),
+    (6, "per-minute API usage", [
+        '''
+        CREATE TABLE IF NOT EXISTS api_usage (
+            deployment_id TEXT NOT NULL,
+            endpoint TEXT NOT NULL,
+            minute INTEGER NOT NULL,
+            request_count INTEGER DEFAULT 0,
+            error_count INTEGER DEFAULT 0,
+            PRIMARY KEY (deployment_id, endpoint, minute)
+        )
+        ''',
+    ]),
+    (7, "streaming datasets", [
+        "ALTER TABLE datasets ADD COLUMN streaming BOOLEAN DEFAULT FALSE",
+    ]),
+    (8, "deployment export artifacts", [
+        "ALTER TABLE api_deployments ADD COLUMN artifact_path TEXT",
+        "ALTER TABLE api_deployments ADD COLUMN export_report TEXT",
+    ]),
+    (9, "per-deployment response cache", [
+        "ALTER TABLE api_deployments ADD COLUMN response_cache BOOLEAN DEFAULT FALSE",
+    ]),
+    (10, "local model store", [
+        "ALTER TABLE models ADD COLUMN local_path TEXT",
+        "ALTER TABLE models ADD COLUMN revision TEXT",
+        "ALTER TABLE models ADD COLUMN size_bytes INTEGER",
+    ]),
+    (11, "listing pagination and change versions", [
+        '''
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        "INSERT OR IGNORE INTO table_versions (name) VALUES ('training_jobs'), ('api_deployments')",
+        '''
+        CREATE TRIGGER IF NOT EXISTS training_jobs_version_insert AFTER INSERT ON training_jobs
+        BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'training_jobs';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS training_jobs_version_update AFTER UPDATE ON training_jobs
+        BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'training_jobs';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS training_jobs_version_delete AFTER DELETE ON training_jobs
+        BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'training_jobs';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS api_deployments_version_insert AFTER INSERT ON api_deployments
+        BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'api_deployments';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS api_deployments_version_update AFTER UPDATE ON api_deployments
+        BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'api_deployments';
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS api_deployments_version_delete AFTER DELETE ON api_deployments
+        BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'api_deployments';
+        END
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_training_jobs_start_id ON training_jobs(start_time, id)",
+        "CREATE INDEX IF NOT EXISTS idx_training_jobs_model_start ON training_jobs(model_id, start_time)",
+        "CREATE INDEX IF NOT EXISTS idx_api_deployments_created_id ON api_deployments(created_date, id)",
+        "CREATE INDEX IF NOT EXISTS idx_api_deployments_model_created ON api_deployments(model_id, created_date)",
+    ]),
+    (12, "incremental dashboard counters", [
+        '''
+        CREATE TABLE IF NOT EXISTS dashboard_counters (
+            name TEXT PRIMARY KEY,
+            value REAL NOT NULL DEFAULT 0
+        )
+        ''',
+        # GPUs visible to a job's worker, reported when it starts; NULL or 0 means CPU
+        "ALTER TABLE training_jobs ADD COLUMN gpu_count INTEGER",
+        '''
+        CREATE TRIGGER IF NOT EXISTS datasets_counters_insert AFTER INSERT ON datasets
+        BEGIN
+            INSERT INTO dashboard_counters (name, value) VALUES ('datasets.count', 1)
+            ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;
+            INSERT INTO dashboard_counters (name, value) VALUES ('datasets.bytes', COALESCE(NEW.size, 0))
+            ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS datasets_counters_update AFTER UPDATE OF size ON datasets
+        BEGIN
+            INSERT INTO dashboard_counters (name, value)
+            VALUES ('datasets.bytes', COALESCE(NEW.size, 0) - COALESCE(OLD.size, 0))
+            ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS datasets_counters_delete AFTER DELETE ON datasets
+        BEGIN
+            INSERT INTO dashboard_counters (name, value) VALUES ('datasets.count', -1)
+            ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;
+            INSERT INTO dashboard_counters (name, value) VALUES ('datasets.bytes', -COALESCE(OLD.size, 0))
+            ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS models_counters_insert AFTER INSERT ON models
+        WHEN COALESCE(NEW.is_downloaded, 0)
+        BEGIN
+            INSERT INTO dashboard_counters (name, value) VALUES ('models.downloaded', 1)
+            ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS models_counters_update AFTER UPDATE OF is_downloaded ON models
+        WHEN COALESCE(NEW.is_downloaded, 0) != COALESCE(OLD.is_downloaded, 0)
+        BEGIN
+            INSERT INTO dashboard_counters (name, value)
+            VALUES ('models.downloaded', CASE WHEN COALESCE(NEW.is_downloaded, 0) THEN 1 ELSE -1 END)
+            ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS models_counters_delete AFTER DELETE ON models
+        WHEN COALESCE(OLD.is_downloaded, 0)
+        BEGIN
+            INSERT INTO dashboard_counters (name, value) VALUES ('models.downloaded', -1)
+            ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS training_jobs_counters_insert AFTER INSERT ON training_jobs
+        BEGIN
+            INSERT INTO dashboard_counters (name, value) VALUES ('jobs:' || COALESCE(NEW.status, 'unknown'), 1)
+            ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS training_jobs_counters_status AFTER UPDATE OF status ON training_jobs
+        WHEN NEW.status IS NOT OLD.status
+        BEGIN
+            INSERT INTO dashboard_counters (name, value) VALUES ('jobs:' || COALESCE(OLD.status, 'unknown'), -1)
+            ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;
+            INSERT INTO dashboard_counters (name, value) VALUES ('jobs:' || COALESCE(NEW.status, 'unknown'), 1)
+            ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;
+        END
+        ''',
+        # A run ends when a running job gets its end_time; its wall time is charged per GPU, or as CPU time
+        '''
+        CREATE TRIGGER IF NOT EXISTS training_jobs_counters_hours AFTER UPDATE OF end_time ON training_jobs
+        WHEN OLD.status = 'running' AND OLD.end_time IS NULL
+            AND NEW.end_time IS NOT NULL AND NEW.start_time IS NOT NULL
+        BEGIN
+            INSERT INTO dashboard_counters (name, value)
+            VALUES (
+                CASE WHEN COALESCE(NEW.gpu_count, 0) > 0 THEN 'training.gpu_hours' ELSE 'training.cpu_hours' END,
+                MAX(julianday(NEW.end_time) - julianday(NEW.start_time), 0) * 24 * MAX(COALESCE(NEW.gpu_count, 0), 1)
+            )
+            ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS training_jobs_counters_delete AFTER DELETE ON training_jobs
+        BEGIN
+            INSERT INTO dashboard_counters (name, value) VALUES ('jobs:' || COALESCE(OLD.status, 'unknown'), -1)
+            ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS api_deployments_counters_insert AFTER INSERT ON api_deployments
+        BEGIN
+            INSERT INTO dashboard_counters (name, value) VALUES ('deployments:' || COALESCE(NEW.status, 'unknown'), 1)
+            ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS api_deployments_counters_status AFTER UPDATE OF status ON api_deployments
+        WHEN NEW.status IS NOT OLD.status
+        BEGIN
+            INSERT INTO dashboard_counters (name, value) VALUES ('deployments:' || COALESCE(OLD.status, 'unknown'), -1)
+            ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;
+            INSERT INTO dashboard_counters (name, value) VALUES ('deployments:' || COALESCE(NEW.status, 'unknown'), 1)
+            ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS api_deployments_counters_delete AFTER DELETE ON api_deployments
+        BEGIN
+            INSERT INTO dashboard_counters (name, value) VALUES ('deployments:' || COALESCE(OLD.status, 'unknown'), -1)
+            ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;
+        END
+        ''',
+        # Backfill from the rows that existed before the triggers; earlier runs have no GPU count
+        '''
+        INSERT OR REPLACE INTO dashboard_counters (name, value)
+        SELECT 'datasets.count', COUNT(*) FROM datasets
+        UNION ALL SELECT 'datasets.bytes', COALESCE(SUM(size), 0) FROM datasets
+        UNION ALL SELECT 'models.downloaded', COUNT(*) FROM models WHERE COALESCE(is_downloaded, 0)
+        UNION ALL SELECT 'training.cpu_hours', COALESCE(SUM(MAX(julianday(end_time) - julianday(start_time), 0) * 24), 0)
+            FROM training_jobs WHERE start_time IS NOT NULL AND end_time IS NOT NULL
+        UNION ALL SELECT 'jobs:' || COALESCE(status, 'unknown'), COUNT(*) FROM training_jobs GROUP BY status
+        UNION ALL SELECT 'deployments:' || COALESCE(status, 'unknown'), COUNT(*) FROM api_deployments GROUP BY status
+        ''',
+    ]),
+    (13, "speculative decoding deployments", [
+        "ALTER TABLE api_deployments ADD COLUMN draft_model_id TEXT",
+        "ALTER TABLE api_deployments ADD COLUMN num_draft_tokens INTEGER",
+        "ALTER TABLE api_deployments ADD COLUMN speculative_report TEXT",
+    ]),
+    (14, "notification delivery leases", [
+        "ALTER TABLE notification_outbox ADD COLUMN locked_until REAL",
+    ]),
+]
+
+
+def database_path_from_url(url: str) -> str:
+    """Extract the file path from a sqlite:/// DATABASE_URL"""
+    prefix = "sqlite:///"
+    if not url.startswith(prefix):
+        raise ValueError(f"Unsupported DATABASE_URL: {url}")
+    return url[len(prefix):]
+
+
+class Database:
+    """Pooled SQLite access that keeps blocking queries off the event loop.
+
+    Connections are opened once with WAL and the pragmas above, borrowed from a
+    pool per query, and every async helper runs on a small dedicated thread pool.
+    """
+
+    def __init__(self, path: str, pool_size: Optional[int] = None):
+        self.path = path
+        self.pool_size = pool_size or int(os.getenv('DB_POOL_SIZE', '4'))
+        self._pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        self._created = 0
+        self._created_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="db")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5.0)
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a pooled connection, committing on success and rolling back on error"""
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            with self._created_lock:
+                grow = self._created < self.pool_size
+                if grow:
+                    self._created += 1
+            conn = self._connect() if grow else self._pool.get()
+
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._pool.put(conn)
+
+    def migrate(self):
+        """Apply pending schema migrations, each one atomically with its version bump"""
+        conn = self._connect()
+        # Manage transactions explicitly: the sqlite3 module leaves DDL in autocommit mode
+        conn.isolation_level = None
+        try:
+            for target, description, statements in MIGRATIONS:
+                # IMMEDIATE takes the write lock, so concurrent starters apply each step once
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    if conn.execute("PRAGMA user_version").fetchone()[0] >= target:
+                        conn.execute("ROLLBACK")
+                        continue
+                    logger.info(f"Applying database migration {target}: {description}")
+                    for statement in statements:
+                        conn.execute(statement)
+                    # PRAGMA does not accept bound parameters
+                    conn.execute(f"PRAGMA user_version = {int(target)}")
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+        finally:
+            conn.close()
+
+    async def run(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Run fn(conn) on the database thread pool inside a single transaction"""
+        def _call():
+            started = time.perf_counter()
+            try:
+                with self.connection() as conn:
+                    return fn(conn)
+            finally:
+                DB_QUERY_SECONDS.observe(time.perf_counter() - started)
+
+        return await asyncio.get_running_loop().run_in_executor(self._executor, _call)
+
+    async def fetchone(self, sql: str, params: Sequence[Any] = ()) -> Optional[sqlite3.Row]:
+        return await self.run(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql: str, params: Sequence[Any] = ()) -> List[sqlite3.Row]:
+        return await self.run(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def execute(self, sql: str, params: Sequence[Any] = ()) -> int:
+        """Run a write statement and return the number of affected rows"""
+        return await self.run(lambda conn: conn.execute(sql, params).rowcount)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+        self._created = 0
+
+
+db = Database(database_path_from_url(os.getenv('DATABASE_URL', 'sqlite:///training_system.db')))
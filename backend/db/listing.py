@@ -0,0 +1,154 @@
+"""Keyset-paginated, filtered listings with version-based ETags.
+
+Pages are ordered newest first on (sort column, id), and the cursor carries
+the last row's pair, so every page costs an index range scan regardless of
+how deep it is. ETags come from the per-table counters that triggers keep in
+table_versions (migration 11): a conditional request whose listing has not
+changed is answered without running the query at all.
+"""
+import base64
+import hashlib
+import json
+import os
+import sqlite3
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+DEFAULT_PAGE_SIZE = int(os.getenv('LISTING_PAGE_SIZE', '50'))
+MAX_PAGE_SIZE = 500
+
+
+class ListingError(ValueError):
+    """A malformed cursor, filter or field selection"""
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> List[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise ListingError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != 2:
+        raise ListingError("Invalid cursor")
+    return values
+
+
+def parse_timestamp(value: str) -> str:
+    """ISO 8601 time as the UTC 'YYYY-MM-DD HH:MM:SS' text that CURRENT_TIMESTAMP stores"""
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise ListingError(f"Invalid timestamp: {value}")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison against an If-None-Match header"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag.removeprefix("W/") for tag in candidates)
+
+
+class Page:
+    """Rows of one page and the cursor after them; rows is None for a 304"""
+
+    def __init__(self, etag: str, rows: Optional[List[Dict[str, Any]]] = None,
+                 next_cursor: Optional[str] = None):
+        self.etag = etag
+        self.rows = rows
+        self.next_cursor = next_cursor
+
+    @property
+    def not_modified(self) -> bool:
+        return self.rows is None
+
+
+class Listing:
+    """One table listed newest first, with equality, status and time-range filters.
+
+    `fields` maps response field names to SQL expressions; `decoders` post-process
+    selected fields (e.g. JSON columns) and only run for fields that were asked for.
+    """
+
+    def __init__(self, table: str, fields: Dict[str, str], sort: str,
+                 filters: Dict[str, str], decoders: Optional[Dict[str, Callable[[Any], Any]]] = None):
+        self.table = table
+        self.fields = fields
+        self.sort = sort
+        self.filters = filters
+        self.decoders = decoders or {}
+
+    def select_fields(self, fields: Optional[str]) -> List[str]:
+        if not fields:
+            return list(self.fields)
+        selected = [name.strip() for name in fields.split(",") if name.strip()]
+        unknown = [name for name in selected if name not in self.fields]
+        if unknown:
+            raise ListingError(f"Unknown fields: {', '.join(unknown)}; available: {', '.join(self.fields)}")
+        return selected
+
+    def page(self, conn: sqlite3.Connection, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None,
+             fields: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None,
+             if_none_match: Optional[str] = None, **filters: Optional[str]) -> Page:
+        """One page of the listing, or an empty Page when if_none_match still holds"""
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        selected = self.select_fields(fields)
+        after = decode_cursor(cursor) if cursor else None
+
+        clauses, params = [], []
+        for name, value in filters.items():
+            if value is None:
+                continue
+            values = [v.strip() for v in value.split(",") if v.strip()]
+            clauses.append(f"{self.filters[name]} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+        if since:
+            clauses.append(f"{self.sort} >= ?")
+            params.append(parse_timestamp(since))
+        if until:
+            clauses.append(f"{self.sort} < ?")
+            params.append(parse_timestamp(until))
+
+        # Read the version first: rows read afterwards are at least as new as the ETag says
+        version = conn.execute("SELECT version FROM table_versions WHERE name = ?", (self.table,)).fetchone()[0]
+        query = json.dumps([selected, limit, cursor, since, until, sorted(filters.items())], default=str)
+        etag = f'W/"{version}-{hashlib.sha1(query.encode()).hexdigest()[:16]}"'
+        if etag_matches(if_none_match, etag):
+            return Page(etag)
+
+        columns = ", ".join(self.fields[name] for name in selected)
+
+        def fetch(extra: List[str], extra_params: Sequence[Any], count: int) -> List[sqlite3.Row]:
+            where = " AND ".join(clauses + extra)
+            return conn.execute(f'''
+                SELECT {self.sort}, id, {columns} FROM {self.table}
+                WHERE {where}
+                ORDER BY {self.sort} DESC, id DESC
+                LIMIT ?
+            ''', (*params, *extra_params, count)).fetchall()
+
+        # Newest first, then rows without a sort value (as SQLite orders NULLs in DESC). Each part
+        # is a separate range so the cursor seeks in the index instead of scanning up to it.
+        if after is None or after[0] is not None:
+            keyset = [f"({self.sort}, id) < (?, ?)"] if after else []
+            rows = fetch([f"{self.sort} IS NOT NULL", *keyset], after or (), limit + 1)
+            if len(rows) <= limit:
+                rows += fetch([f"{self.sort} IS NULL"], (), limit + 1 - len(rows))
+        else:
+            rows = fetch([f"{self.sort} IS NULL", "id < ?"], (after[1],), limit + 1)
+
+        next_cursor = encode_cursor(tuple(rows[limit - 1])[:2]) if len(rows) > limit else None
+        decoders = [self.decoders.get(name) for name in selected]
+        items = []
+        for row in rows[:limit]:
+            item = {}
+            for name, decode, value in zip(selected, decoders, tuple(row)[2:]):
+                item[name] = decode(value) if decode and value is not None else value
+            items.append(item)
+        return Page(etag, items, next_cursor)
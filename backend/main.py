@@ -1,19 +1,73 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 import uvicorn
 import os
 import json
-import sqlite3
+import math
 from datetime import datetime
 from typing import Optional, Dict, Any, List
 import asyncio
 import subprocess
 import shutil
+import sys
+from contextlib import asynccontextmanager
 from pathlib import Path
 
+# Only torch-free modules here: the ML stack is imported by the first model load,
+# the export worker and training worker processes, never at API start-up
+from api.export import benchmark_speculative, export_model, get_export_executor, shutdown_export_executor
+from api.model_cache import EXPORT_PREFIX, model_cache
+from api.response_cache import is_deterministic, response_cache
+from api.usage import usage_tracker
+from db.database import db
+from db.listing import DEFAULT_PAGE_SIZE, Listing, ListingError
+from monitoring.metrics import CONTENT_TYPE, ENABLE_METRICS, MetricsMiddleware, registry, start_metrics_server
+from storage.datasets import DatasetValidationError, ingest_stream, read_upload
+from storage.models import MODEL_STORAGE_PATH, model_store
+from training.scheduler import TrainingScheduler, latest_checkpoint
+from webhooks.notifications import notify_training_event, webhook_dispatcher
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start-up and shutdown work, kept out of module import so the API boots fast"""
+    # Create necessary directories
+    os.makedirs("uploads", exist_ok=True)
+    os.makedirs(MODEL_STORAGE_PATH, exist_ok=True)
+    os.makedirs("outputs", exist_ok=True)
+    os.makedirs("logs", exist_ok=True)
+    
+    # Initialize database (applies pending schema migrations)
+    await asyncio.to_thread(db.migrate)
+    
+    await training_scheduler.start()
+    await webhook_dispatcher.start()
+    await usage_tracker.start()
+    
+    # Also serve /metrics on METRICS_PORT so scrapes stay off the API port
+    port = int(os.getenv('METRICS_PORT', '0'))
+    if ENABLE_METRICS and port:
+        start_metrics_server(port)
+    
+    # Models for PRELOAD_DEPLOYMENTS load in the background; GET /warmup reports readiness
+    preload = [d.strip() for d in os.getenv('PRELOAD_DEPLOYMENTS', '').split(',') if d.strip()]
+    if preload:
+        await start_warmup(preload)
+    
+    yield
+    
+    # Nothing to stop if no inference request ever imported the batching module
+    if "api.batching" in sys.modules:
+        sys.modules["api.batching"].shutdown_schedulers()
+    shutdown_export_executor()
+    model_store.shutdown()
+    await training_scheduler.shutdown()
+    await usage_tracker.stop()
+    await webhook_dispatcher.stop()
+    db.close()
+
 # Initialize FastAPI app
-app = FastAPI(title="AI Training System", version="1.0.0")
+app = FastAPI(title="AI Training System", version="1.0.0", lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -24,229 +78,258 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Create necessary directories
-os.makedirs("uploads", exist_ok=True)
-os.makedirs("models", exist_ok=True)
-os.makedirs("outputs", exist_ok=True)
-os.makedirs("logs", exist_ok=True)
-
-# Initialize SQLite database
-def init_db():
-    conn = sqlite3.connect('training_system.db')
-    cursor = conn.cursor()
-    
-    # Create tables
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS datasets (
-            id TEXT PRIMARY KEY,
-            name TEXT NOT NULL,
-            file_path TEXT NOT NULL,
-            size INTEGER,
-            upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            status TEXT DEFAULT 'uploaded'
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS models (
-            id TEXT PRIMARY KEY,
-            name TEXT NOT NULL,
-            type TEXT,
-            size TEXT,
-            parameters TEXT,
-            download_url TEXT,
-            is_downloaded BOOLEAN DEFAULT FALSE,
-            download_date TIMESTAMP
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS training_jobs (
-            id TEXT PRIMARY KEY,
-            model_id TEXT,
-            dataset_id TEXT,
-            config TEXT,
-            status TEXT DEFAULT 'pending',
-            start_time TIMESTAMP,
-            end_time TIMESTAMP,
-            output_path TEXT,
-            logs TEXT
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS api_deployments (
-            id TEXT PRIMARY KEY,
-            model_id TEXT,
-            endpoint_url TEXT,
-            status TEXT DEFAULT 'inactive',
-            created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+if ENABLE_METRICS:
+    app.add_middleware(MetricsMiddleware)
+
+# Training jobs run in isolated worker processes, at most MAX_CONCURRENT_JOBS at a time
+training_scheduler = TrainingScheduler(db)
+
+# Datasets at least this large train in streaming mode unless a job says otherwise
+STREAMING_DATASET_THRESHOLD = int(float(os.getenv('STREAMING_DATASET_THRESHOLD_MB', '1024')) * 1024 ** 2)
 
-# Initialize database on startup
-init_db()
+registry.gauge("training_active_jobs", "Training jobs running in worker processes",
+               fn=lambda: {(): len(training_scheduler.running_jobs())})
+registry.gauge("training_queued_jobs", "Training jobs waiting for a worker slot",
+               fn=lambda: {(): training_scheduler.queued})
 
-# Global training status
-training_status = {
-    "is_training": False,
-    "current_job": None,
-    "progress": 0,
-    "logs": []
+DEFAULT_TRAINING_CONFIG = {
+    "learning_rate": 2e-4,
+    "batch_size": 4,
+    "epochs": 3,
+    "max_length": 512,
+    "warmup_steps": 100,
+    "save_steps": 500,
+    "eval_steps": 500,
+    "gradient_accumulation_steps": 4,
+    "use_peft": True,
+    "peft_config": {
+        "r": 16,
+        "lora_alpha": 32,
+        "lora_dropout": 0.1,
+        "target_modules": ["q_proj", "v_proj", "k_proj", "o_proj"]
+    },
+    "optimizer": "adamw_torch",
+    "scheduler": "cosine",
+    "fp16": True,
+    "gradient_checkpointing": True,
+    "packing": False,
+    "group_by_length": True,
+    "shuffle_buffer_size": 10000
 }
 
+# Base models offered for fine-tuning; downloadUrl is the hub repository they are fetched from
+AVAILABLE_MODELS = [
+    {
+        "id": "llama-7b",
+        "name": "Llama 2 7B",
+        "description": "Meta's Llama 2 model with 7 billion parameters. Great for general text generation and fine-tuning.",
+        "size": "13.5 GB",
+        "parameters": "7B",
+        "type": "text",
+        "popularity": 95,
+        "downloadUrl": "meta-llama/Llama-2-7b-hf"
+    },
+    {
+        "id": "mistral-7b",
+        "name": "Mistral 7B",
+        "description": "High-performance language model with excellent instruction following capabilities.",
+        "size": "14.2 GB",
+        "parameters": "7B",
+        "type": "text",
+        "popularity": 88,
+        "downloadUrl": "mistralai/Mistral-7B-v0.1"
+    },
+    {
+        "id": "phi-3-mini",
+        "name": "Phi-3 Mini",
+        "description": "Microsoft's compact yet powerful model, optimized for efficiency.",
+        "size": "7.6 GB",
+        "parameters": "3.8B",
+        "type": "text",
+        "popularity": 82,
+        "downloadUrl": "microsoft/Phi-3-mini-4k-instruct"
+    },
+    {
+        "id": "gemma-7b",
+        "name": "Gemma 7B",
+        "description": "Google's open-source model based on Gemini research and technology.",
+        "size": "16.9 GB",
+        "parameters": "7B",
+        "type": "text",
+        "popularity": 79,
+        "downloadUrl": "google/gemma-7b"
+    }
+]
+
 @app.get("/")
 async def root():
     return {"message": "AI Training System API", "status": "running"}
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition"""
+    if not ENABLE_METRICS:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return Response(content=registry.render(), media_type=CONTENT_TYPE)
+
 @app.get("/api/dashboard/stats")
 async def get_dashboard_stats():
-    conn = sqlite3.connect('training_system.db')
-    cursor = conn.cursor()
-    
-    # Get counts
-    cursor.execute("SELECT COUNT(*) FROM datasets")
-    total_datasets = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM models WHERE is_downloaded = TRUE")
-    trained_models = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM training_jobs WHERE status = 'running'")
-    active_training = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM api_deployments WHERE status = 'active'")
-    deployed_apis = cursor.fetchone()[0]
+    # Triggers keep these counters current as rows change (migration 12), so this
+    # reads a few dozen rows at most, however large the tables are
+    counters = {row[0]: row[1] for row in await db.fetchall("SELECT name, value FROM dashboard_counters")}
+    jobs_by_status = {
+        name[len("jobs:"):]: int(value)
+        for name, value in counters.items()
+        if name.startswith("jobs:") and value
+    }
     
-    conn.close()
+    return {
+        "totalDatasets": int(counters.get("datasets.count", 0)),
+        "trainedModels": int(counters.get("models.downloaded", 0)),
+        "activeTraining": jobs_by_status.get("running", 0),
+        "deployedAPIs": int(counters.get("deployments:active", 0)),
+        "totalDatasetBytes": int(counters.get("datasets.bytes", 0)),
+        "gpuHours": round(counters.get("training.gpu_hours", 0.0), 3),
+        "cpuHours": round(counters.get("training.cpu_hours", 0.0), 3),
+        "jobsByStatus": jobs_by_status
+    }
+
+async def store_dataset(name: str, chunks) -> Dict[str, Any]:
+    """Stream, validate and register an uploaded dataset"""
+    try:
+        stored = await ingest_stream(chunks, name)
+    except DatasetValidationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # Identical bytes share one blob; each upload still gets its own dataset record
+    dataset_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+    streaming = stored["size"] >= STREAMING_DATASET_THRESHOLD
+    await db.execute('''
+        INSERT INTO datasets (id, name, file_path, size, status, content_hash, row_count, streaming)
+        VALUES (?, ?, ?, ?, 'validated', ?, ?, ?)
+    ''', (dataset_id, name, stored["file_path"], stored["size"], stored["sha256"], stored["rows"], streaming))
     
     return {
-        "totalDatasets": total_datasets,
-        "trainedModels": trained_models,
-        "activeTraining": active_training,
-        "deployedAPIs": deployed_apis
+        "message": "Dataset uploaded successfully",
+        "file_id": dataset_id,
+        "sha256": stored["sha256"],
+        "rows": stored["rows"],
+        "streaming": streaming,
+        "deduplicated": stored["deduplicated"]
     }
 
 @app.post("/api/upload/dataset")
 async def upload_dataset(file: UploadFile = File(...)):
     try:
-        # Generate unique filename
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{timestamp}_{file.filename}"
-        file_path = f"uploads/{filename}"
-        
-        # Save file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Get file size
-        file_size = os.path.getsize(file_path)
-        
-        # Save to database
-        conn = sqlite3.connect('training_system.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO datasets (id, name, file_path, size)
-            VALUES (?, ?, ?, ?)
-        ''', (timestamp, file.filename, file_path, file_size))
-        conn.commit()
-        conn.close()
-        
-        return {"message": "Dataset uploaded successfully", "file_id": timestamp}
+        return await store_dataset(file.filename, read_upload(file))
     
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.put("/api/upload/dataset/{filename}")
+async def upload_dataset_stream(filename: str, request: Request):
+    """Raw-body upload that is validated while it streams, so bad files fail fast"""
+    try:
+        return await store_dataset(filename, request.stream())
+    
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/models/available")
 async def get_available_models():
-    # Return predefined models (in real implementation, this could fetch from HuggingFace)
-    models = [
-        {
-            "id": "llama-7b",
-            "name": "Llama 2 7B",
-            "description": "Meta's Llama 2 model with 7 billion parameters. Great for general text generation and fine-tuning.",
-            "size": "13.5 GB",
-            "parameters": "7B",
-            "type": "text",
-            "popularity": 95,
-            "downloadUrl": "meta-llama/Llama-2-7b-hf",
-            "isDownloaded": False,
-            "isDownloading": False
-        },
-        {
-            "id": "mistral-7b",
-            "name": "Mistral 7B",
-            "description": "High-performance language model with excellent instruction following capabilities.",
-            "size": "14.2 GB",
-            "parameters": "7B",
-            "type": "text",
-            "popularity": 88,
-            "downloadUrl": "mistralai/Mistral-7B-v0.1",
-            "isDownloaded": True,
-            "isDownloading": False
-        }
-    ]
-    
-    # Check database for download status
-    conn = sqlite3.connect('training_system.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, is_downloaded FROM models")
-    db_models = dict(cursor.fetchall())
-    conn.close()
-    
-    # Update download status from database
-    for model in models:
-        if model["id"] in db_models:
-            model["isDownloaded"] = db_models[model["id"]]
+    models = []
+    for model in AVAILABLE_MODELS:
+        # Download state comes from the local model store
+        progress = model_store.progress(model["id"])
+        downloading = model_store.is_downloading(model["id"])
+        models.append({
+            **model,
+            "isDownloaded": model_store.is_downloaded(model["id"]),
+            "isDownloading": downloading,
+            "downloadProgress": progress["progress"] if progress and downloading else None
+        })
     
     return models
 
-@app.post("/api/models/download")
+async def record_download(model_id: str, download):
+    """Mark a model downloaded once every file of it is verified in the store"""
+    try:
+        manifest = await asyncio.wrap_future(download)
+    except Exception:
+        # The error stays in the download's progress (GET /api/models/{model_id}/download)
+        return
+    
+    await db.execute('''
+        UPDATE models SET is_downloaded = TRUE, download_date = CURRENT_TIMESTAMP,
+            local_path = ?, revision = ?, size_bytes = ?
+        WHERE id = ?
+    ''', (model_store.snapshot_path(model_id), manifest["commit"], manifest["total_bytes"], model_id))
+
+@app.post("/api/models/download", status_code=202)
 async def download_model(request: Dict[str, str]):
     model_id = request.get("model_id")
+    model = next((m for m in AVAILABLE_MODELS if m["id"] == model_id), None)
+    # Models outside the catalog can be fetched by naming their hub repository
+    repo = request.get("repo") or (model["downloadUrl"] if model else None)
+    if not model_id or not repo:
+        raise HTTPException(status_code=404, detail=f"Unknown model: {model_id}")
     
-    # Simulate model download (in real implementation, use huggingface_hub)
-    await asyncio.sleep(2)  # Simulate download time
-    
-    # Update database
-    conn = sqlite3.connect('training_system.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT OR REPLACE INTO models (id, is_downloaded, download_date)
-        VALUES (?, TRUE, CURRENT_TIMESTAMP)
-    ''', (model_id,))
-    conn.commit()
-    conn.close()
-    
-    return {"message": "Model downloaded successfully"}
+    # Runs in the background; a download already in progress is joined rather than restarted
+    try:
+        joined = model_store.is_downloading(model_id)
+        download = model_store.download(model_id, repo, request.get("revision", "main"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    await db.execute('''
+        INSERT INTO models (id, name, type, size, parameters, download_url, is_downloaded)
+        VALUES (?, ?, ?, ?, ?, ?, FALSE)
+        ON CONFLICT (id) DO UPDATE SET download_url = excluded.download_url
+    ''', (
+        model_id,
+        model["name"] if model else request.get("name", model_id),
+        model["type"] if model else None,
+        model["size"] if model else None,
+        model["parameters"] if model else None,
+        repo
+    ))
+    
+    if not joined:
+        asyncio.create_task(record_download(model_id, download))
+    
+    return {"message": "Model download started", "model_id": model_id, "progress": model_store.progress(model_id)}
+
+@app.get("/api/models/{model_id}/download")
+async def get_download_progress(model_id: str):
+    """Byte-level progress of a model download"""
+    progress = model_store.progress(model_id)
+    if progress is not None:
+        return progress
+    
+    # Downloaded before this process started
+    manifest = await asyncio.to_thread(model_store.manifest, model_id)
+    if manifest is None:
+        raise HTTPException(status_code=404, detail=f"No download for model: {model_id}")
+    return {
+        "model_id": model_id,
+        "repo": manifest["repo"],
+        "revision": manifest["revision"],
+        "status": "completed",
+        "error": None,
+        "total_bytes": manifest["total_bytes"],
+        "completed_bytes": manifest["total_bytes"],
+        "progress": 1.0
+    }
 
 @app.get("/api/training/config")
 async def get_training_config():
     # Return saved configuration (implement file-based or database storage)
     default_config = {
-        "config": {
-            "learning_rate": 2e-4,
-            "batch_size": 4,
-            "epochs": 3,
-            "max_length": 512,
-            "warmup_steps": 100,
-            "save_steps": 500,
-            "eval_steps": 500,
-            "gradient_accumulation_steps": 4,
-            "use_peft": True,
-            "peft_config": {
-                "r": 16,
-                "lora_alpha": 32,
-                "lora_dropout": 0.1,
-                "target_modules": ["q_proj", "v_proj", "k_proj", "o_proj"]
-            },
-            "optimizer": "adamw_torch",
-            "scheduler": "cosine",
-            "fp16": True,
-            "gradient_checkpointing": True
-        },
+        "config": DEFAULT_TRAINING_CONFIG,
         "selected_model": "",
         "selected_dataset": ""
     }
@@ -269,157 +352,343 @@ async def save_training_config(config_data: Dict[str, Any]):
     return {"message": "Configuration saved successfully"}
 
 @app.post("/api/training/start")
-async def start_training(background_tasks: BackgroundTasks, request: Dict[str, Any]):
-    global training_status
-    
-    if training_status["is_training"]:
-        raise HTTPException(status_code=400, detail="Training already in progress")
+async def start_training(request: Dict[str, Any]):
+    dataset_id = request.get("dataset_id")
+    try:
+        priority = int(request.get("priority", 0))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="priority must be an integer")
+    
+    # Accept either a dataset id or the name it was uploaded under
+    dataset = await db.fetchone('''
+        SELECT file_path, streaming, row_count FROM datasets
+        WHERE id = ? OR name = ?
+        ORDER BY upload_date DESC
+        LIMIT 1
+    ''', (dataset_id, dataset_id))
+    if not dataset:
+        raise HTTPException(status_code=404, detail=f"Dataset not found: {dataset_id}")
+    
+    # Training loads base weights from the local model store only
+    model_id = request.get("model_id")
+    if not model_store.is_downloaded(model_id or ""):
+        raise HTTPException(status_code=400, detail=f"Model not downloaded: {model_id}")
     
     # Create training job
-    job_id = datetime.now().strftime("%Y%m%d_%H%M%S")
-    
-    # Save job to database
-    conn = sqlite3.connect('training_system.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO training_jobs (id, model_id, dataset_id, config, status, start_time)
-        VALUES (?, ?, ?, ?, 'running', CURRENT_TIMESTAMP)
-    ''', (job_id, request.get("model_id"), request.get("dataset_id"), json.dumps(request.get("config"))))
-    conn.commit()
-    conn.close()
-    
-    # Start training in background
-    background_tasks.add_task(run_training, job_id, request)
-    
-    training_status["is_training"] = True
-    training_status["current_job"] = job_id
-    training_status["progress"] = 0
-    training_status["logs"] = []
+    job_id = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    # Large datasets stream unless the request decides explicitly
+    config = {
+        **DEFAULT_TRAINING_CONFIG,
+        "streaming": bool(dataset[1]),
+        "dataset_rows": dataset[2],
+        **(request.get("config") or {})
+    }
     
-    return {"message": "Training started", "job_id": job_id}
-
-async def run_training(job_id: str, config: Dict[str, Any]):
-    """Simulate training process"""
-    global training_status
-    
-    try:
-        # Simulate training steps
-        total_steps = 100
-        for step in range(total_steps):
-            await asyncio.sleep(0.1)  # Simulate training time
-            
-            progress = (step + 1) / total_steps * 100
-            training_status["progress"] = progress
-            
-            # Add log entry
-            if step % 10 == 0:
-                log_entry = {
-                    "timestamp": datetime.now().isoformat(),
-                    "step": step,
-                    "loss": 2.5 - (step * 0.02),
-                    "learning_rate": 2e-4 * (1 - step / total_steps)
-                }
-                training_status["logs"].append(log_entry)
-        
-        # Update job status
-        conn = sqlite3.connect('training_system.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE training_jobs 
-            SET status = 'completed', end_time = CURRENT_TIMESTAMP, output_path = ?
-            WHERE id = ?
-        ''', (f"outputs/{job_id}", job_id))
-        conn.commit()
-        conn.close()
-        
-        training_status["is_training"] = False
-        training_status["current_job"] = None
-        
-    except Exception as e:
-        # Handle training error
-        conn = sqlite3.connect('training_system.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE training_jobs 
-            SET status = 'failed', end_time = CURRENT_TIMESTAMP, logs = ?
-            WHERE id = ?
-        ''', (str(e), job_id))
-        conn.commit()
-        conn.close()
-        
-        training_status["is_training"] = False
-        training_status["current_job"] = None
+    # Queue the job; the scheduler starts it when a worker slot is free
+    await training_scheduler.submit(
+        job_id,
+        model_id,
+        dataset_id,
+        dataset[0],
+        config,
+        priority=priority
+    )
+    
+    return {"message": "Training queued", "job_id": job_id}
 
 @app.get("/api/training/status")
-async def get_training_status():
-    return training_status
+async def get_training_status(after_step: int = -1, include_logs: bool = True):
+    # Summary of the oldest running job, in the shape the monitor page expects.
+    # Logs are bounded and can be limited to steps after a client's cursor.
+    running = training_scheduler.running_jobs()
+    current_job = running[0] if running else None
+    buffer = training_scheduler.telemetry.get(current_job)
+    logs = buffer.since(after_step)[0] if buffer and include_logs else []
+    
+    return {
+        "is_training": bool(running),
+        "current_job": current_job,
+        "running_jobs": running,
+        "progress": training_scheduler.progress.get(current_job, 0),
+        "logs": logs
+    }
 
 @app.post("/api/training/stop")
-async def stop_training():
-    global training_status
+async def stop_training(request: Optional[Dict[str, Any]] = None):
+    # Stop one job when a job_id is given, otherwise every running job
+    job_id = (request or {}).get("job_id")
+    job_ids = [job_id] if job_id else training_scheduler.running_jobs()
     
-    if not training_status["is_training"]:
+    if not job_ids:
         raise HTTPException(status_code=400, detail="No training in progress")
     
-    # Update job status
-    if training_status["current_job"]:
-        conn = sqlite3.connect('training_system.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE training_jobs 
-            SET status = 'stopped', end_time = CURRENT_TIMESTAMP
-            WHERE id = ?
-        ''', (training_status["current_job"],))
-        conn.commit()
-        conn.close()
+    stopped = [j for j in job_ids if await training_scheduler.cancel(j)]
+    if not stopped:
+        raise HTTPException(status_code=404, detail="Training job not found or already finished")
     
-    training_status["is_training"] = False
-    training_status["current_job"] = None
+    return {"message": "Training stopped", "job_ids": stopped}
+
+@app.get("/api/training/jobs/{job_id}")
+async def get_training_job(job_id: str):
+    row = await db.fetchone('''
+        SELECT id, model_id, dataset_id, status, priority, queued_time, start_time, end_time, output_path, logs
+        FROM training_jobs
+        WHERE id = ?
+    ''', (job_id,))
+    if not row:
+        raise HTTPException(status_code=404, detail="Training job not found")
+    
+    job = dict(row)
+    job["progress"] = training_scheduler.progress.get(job_id, 100.0 if row["status"] == "completed" else 0)
+    return job
+
+@app.get("/api/training/jobs/{job_id}/metrics")
+async def get_training_metrics(job_id: str, after_step: int = -1):
+    """Step metrics newer than `after_step`, for clients that cannot hold a stream open"""
+    buffer = training_scheduler.telemetry.get(job_id)
+    if buffer is None:
+        raise HTTPException(status_code=404, detail="No telemetry for this training job")
+    
+    entries, truncated = buffer.since(after_step)
+    return {
+        "job_id": job_id,
+        "progress": training_scheduler.progress.get(job_id, 0),
+        "status": buffer.status or "running",
+        "cursor": entries[-1]["step"] if entries else after_step,
+        "truncated": truncated,
+        "entries": entries
+    }
+
+@app.get("/api/training/jobs/{job_id}/stream")
+async def stream_training_metrics(job_id: str, http_request: Request, after_step: int = -1):
+    """Server-Sent Events with each new step entry; resumes from Last-Event-ID"""
+    buffer = training_scheduler.telemetry.get(job_id)
+    if buffer is None:
+        raise HTTPException(status_code=404, detail="No telemetry for this training job")
+    
+    last_event_id = http_request.headers.get("last-event-id")
+    cursor = int(last_event_id) if last_event_id and last_event_id.lstrip("-").isdigit() else after_step
+    
+    async def event_stream():
+        nonlocal cursor
+        while True:
+            # Read together with the entries, so anything appended while this
+            # generator is suspended makes the wait below return at once
+            version = buffer.version
+            entries, _ = buffer.since(cursor)
+            for entry in entries:
+                cursor = entry["step"]
+                yield f"id: {cursor}\nevent: step\ndata: {json.dumps(entry)}\n\n"
+            
+            if buffer.closed:
+                yield f"event: done\ndata: {json.dumps({'job_id': job_id, 'status': buffer.status})}\n\n"
+                break
+            if await http_request.is_disconnected():
+                break
+            if not await buffer.wait(version, timeout=15):
+                # Comment line keeps proxies from closing an idle stream
+                yield ": keepalive\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/api/training/jobs/{job_id}/cancel")
+async def cancel_training_job(job_id: str):
+    status = await training_scheduler.cancel(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Training job is not queued or running")
+    
+    return {"message": f"Training job {status}", "job_id": job_id, "status": status}
+
+@app.post("/api/training/jobs/{job_id}/resume")
+async def resume_training_job(job_id: str):
+    """Re-queue a stopped or failed job to continue from its latest checkpoint"""
+    row = await db.fetchone("SELECT status FROM training_jobs WHERE id = ?", (job_id,))
+    if not row:
+        raise HTTPException(status_code=404, detail="Training job not found")
+    if not await training_scheduler.resume(job_id):
+        raise HTTPException(status_code=409, detail=f"Training job is {row[0]} and cannot be resumed")
+    
+    checkpoint = latest_checkpoint(job_id)
+    return {
+        "message": "Training job queued to resume" if checkpoint else "No checkpoint found, training job queued to restart",
+        "job_id": job_id,
+        "checkpoint": checkpoint
+    }
+
+TRAINING_JOBS_LISTING = Listing(
+    "training_jobs",
+    fields={
+        "id": "id",
+        "model_id": "model_id",
+        "dataset_id": "dataset_id",
+        "status": "status",
+        "start_time": "start_time",
+        "end_time": "end_time",
+        "output_path": "output_path"
+    },
+    sort="start_time",
+    filters={"status": "status", "model_id": "model_id"}
+)
+
+DEPLOYMENTS_LISTING = Listing(
+    "api_deployments",
+    fields={
+        "id": "id",
+        "model_id": "model_id",
+        "endpoint_url": "endpoint_url",
+        "status": "status",
+        "created_date": "created_date",
+        "artifact_path": "artifact_path",
+        "export_report": "export_report",
+        "draft_model_id": "draft_model_id",
+        "speculative_report": "speculative_report"
+    },
+    sort="created_date",
+    filters={"status": "status", "model_id": "model_id"},
+    decoders={"export_report": json.loads, "speculative_report": json.loads}
+)
+
+async def listing_response(listing: Listing, request: Request, **params) -> Response:
+    """A page of a listing as a JSON array; the next page's cursor is in X-Next-Cursor and Link.
     
-    return {"message": "Training stopped"}
+    Unchanged listings answer If-None-Match with 304 before any rows are read.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    try:
+        page = await db.run(lambda conn: listing.page(conn, if_none_match=if_none_match, **params))
+    except ListingError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # Clients may keep the page but must revalidate it, which is what makes the 304 path useful
+    headers = {"ETag": page.etag, "Cache-Control": "no-cache"}
+    if page.not_modified:
+        return Response(status_code=304, headers=headers)
+    if page.next_cursor:
+        headers["X-Next-Cursor"] = page.next_cursor
+        headers["Link"] = f'<{request.url.include_query_params(cursor=page.next_cursor)}>; rel="next"'
+    return Response(content=json.dumps(page.rows), media_type="application/json", headers=headers)
 
 @app.get("/api/training/jobs")
-async def get_training_jobs():
-    conn = sqlite3.connect('training_system.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT id, model_id, dataset_id, status, start_time, end_time, output_path
-        FROM training_jobs
-        ORDER BY start_time DESC
-    ''')
-    
-    jobs = []
-    for row in cursor.fetchall():
-        jobs.append({
-            "id": row[0],
-            "model_id": row[1],
-            "dataset_id": row[2],
-            "status": row[3],
-            "start_time": row[4],
-            "end_time": row[5],
-            "output_path": row[6]
-        })
+async def get_training_jobs(request: Request, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None,
+                            status: Optional[str] = None, model_id: Optional[str] = None,
+                            since: Optional[str] = None, until: Optional[str] = None,
+                            fields: Optional[str] = None):
+    """Jobs newest first. status and model_id take comma-separated values; since/until bound start_time"""
+    return await listing_response(
+        TRAINING_JOBS_LISTING, request, limit=limit, cursor=cursor, fields=fields,
+        since=since, until=until, status=status, model_id=model_id
+    )
+
+async def run_export(deployment_id: str, model_id: str, endpoint_url: str, options: Dict[str, Any]):
+    """Build and benchmark a deployment's artifact in the export worker, then activate it"""
+    try:
+        report = await asyncio.get_running_loop().run_in_executor(
+            get_export_executor(), export_model, deployment_id, model_id, options
+        )
+    except Exception as e:
+        await db.execute('''
+            UPDATE api_deployments SET status = 'failed', export_report = ?
+            WHERE id = ?
+        ''', (json.dumps({"error": str(e)}), deployment_id))
+        return
+    
+    await db.execute('''
+        UPDATE api_deployments SET status = 'active', artifact_path = ?, export_report = ?
+        WHERE id = ?
+    ''', (report["artifact_path"], json.dumps(report), deployment_id))
+    # Responses cached before the export came from a different artifact
+    response_cache.invalidate(deployment_id)
+    asyncio.create_task(run_speculative_benchmark(deployment_id))
+    
+    notify_training_event("model_deployed", {
+        "model_name": model_id,
+        "endpoint_url": endpoint_url
+    })
+
+async def run_speculative_benchmark(deployment_id: str):
+    """Measure a speculative deployment's acceptance rate and speedup in the export worker"""
+    row = await db.fetchone('''
+        SELECT model_id, artifact_path, draft_model_id, num_draft_tokens FROM api_deployments
+        WHERE id = ?
+    ''', (deployment_id,))
+    if not row or not row[2]:
+        return
+    # Benchmark the artifact the deployment actually serves
+    model_id = f"{EXPORT_PREFIX}{deployment_id}" if row[1] else row[0]
+    
+    try:
+        report = await asyncio.get_running_loop().run_in_executor(
+            get_export_executor(), benchmark_speculative, model_id, row[2], row[3]
+        )
+    except Exception as e:
+        report = {"error": str(e)}
     
-    conn.close()
-    return jobs
+    await db.execute(
+        "UPDATE api_deployments SET speculative_report = ? WHERE id = ?",
+        (json.dumps(report), deployment_id)
+    )
 
 @app.post("/api/deploy/model")
-async def deploy_model(request: Dict[str, str]):
+async def deploy_model(request: Dict[str, Any]):
     model_id = request.get("model_id")
     endpoint_name = request.get("endpoint_name", f"api-{model_id}")
+    # true or {"merge_lora", "quantize", "benchmark_max_new_tokens"}: build a CPU artifact first
+    export = request.get("export")
+    # Serve repeated deterministic requests from memory
+    cache_responses = bool(request.get("response_cache", False))
+    # {"draft_model_id", "num_draft_tokens"}: a small model sharing the tokenizer drafts tokens
+    speculative = request.get("speculative") or {}
+    draft_model_id = speculative.get("draft_model_id")
+    # None leaves it to SPECULATIVE_DRAFT_TOKENS on the serving side
+    num_draft_tokens = int(speculative["num_draft_tokens"]) if speculative.get("num_draft_tokens") is not None else None
+    if speculative and not draft_model_id:
+        raise HTTPException(status_code=400, detail="speculative requires a draft_model_id")
+    if draft_model_id and not os.path.exists(f"outputs/{draft_model_id}"):
+        raise HTTPException(status_code=404, detail=f"Draft model not found: {draft_model_id}")
+    if num_draft_tokens is not None and not 1 <= num_draft_tokens <= 16:
+        raise HTTPException(status_code=400, detail="num_draft_tokens must be between 1 and 16")
     
     # Create deployment record
     deployment_id = datetime.now().strftime("%Y%m%d_%H%M%S")
     endpoint_url = f"http://localhost:8000/api/inference/{deployment_id}"
     
-    conn = sqlite3.connect('training_system.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO api_deployments (id, model_id, endpoint_url, status)
-        VALUES (?, ?, ?, 'active')
-    ''', (deployment_id, model_id, endpoint_url))
-    conn.commit()
-    conn.close()
+    if export:
+        if not os.path.exists(f"outputs/{model_id}"):
+            raise HTTPException(status_code=404, detail=f"Model not found: {model_id}")
+    
+        await db.execute('''
+            INSERT INTO api_deployments (id, model_id, endpoint_url, status, response_cache,
+                                         draft_model_id, num_draft_tokens)
+            VALUES (?, ?, ?, 'exporting', ?, ?, ?)
+        ''', (deployment_id, model_id, endpoint_url, cache_responses, draft_model_id, num_draft_tokens))
+    
+        # The deployment starts serving once its artifact is built and benchmarked
+        options = export if isinstance(export, dict) else {}
+        asyncio.create_task(run_export(deployment_id, model_id, endpoint_url, options))
+    
+        return {
+            "message": "Model export started",
+            "deployment_id": deployment_id,
+            "endpoint_url": endpoint_url,
+            "status": "exporting"
+        }
+    
+    await db.execute('''
+        INSERT INTO api_deployments (id, model_id, endpoint_url, status, response_cache,
+                                     draft_model_id, num_draft_tokens)
+        VALUES (?, ?, ?, 'active', ?, ?, ?)
+    ''', (deployment_id, model_id, endpoint_url, cache_responses, draft_model_id, num_draft_tokens))
+    # The deployment serves right away; acceptance rate and speedup land in speculative_report
+    asyncio.create_task(run_speculative_benchmark(deployment_id))
+    
+    notify_training_event("model_deployed", {
+        "model_name": model_id,
+        "endpoint_url": endpoint_url
+    })
     
     return {
         "message": "Model deployed successfully",
@@ -428,41 +697,298 @@ async def deploy_model(request: Dict[str, str]):
     }
 
 @app.get("/api/deployments")
-async def get_deployments():
-    conn = sqlite3.connect('training_system.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT id, model_id, endpoint_url, status, created_date
-        FROM api_deployments
-        ORDER BY created_date DESC
-    ''')
-    
-    deployments = []
-    for row in cursor.fetchall():
-        deployments.append({
-            "id": row[0],
-            "model_id": row[1],
-            "endpoint_url": row[2],
-            "status": row[3],
-            "created_date": row[4]
-        })
+async def get_deployments(request: Request, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None,
+                          status: Optional[str] = None, model_id: Optional[str] = None,
+                          since: Optional[str] = None, until: Optional[str] = None,
+                          fields: Optional[str] = None):
+    """Deployments newest first, filtered like /api/training/jobs; since/until bound created_date"""
+    return await listing_response(
+        DEPLOYMENTS_LISTING, request, limit=limit, cursor=cursor, fields=fields,
+        since=since, until=until, status=status, model_id=model_id
+    )
+
+@app.get("/api/deployments/{deployment_id}/export")
+async def get_deployment_export(deployment_id: str):
+    """Export status and benchmark report of a deployment"""
+    row = await db.fetchone('''
+        SELECT status, artifact_path, export_report FROM api_deployments
+        WHERE id = ?
+    ''', (deployment_id,))
+    if not row:
+        raise HTTPException(status_code=404, detail="Deployment not found")
     
-    conn.close()
-    return deployments
+    return {
+        "deployment_id": deployment_id,
+        "status": row[0],
+        "artifact_path": row[1],
+        "report": json.loads(row[2]) if row[2] else None
+    }
+
+# Upper bound on a request's max_new_tokens
+MAX_NEW_TOKENS_LIMIT = int(os.getenv('INFERENCE_MAX_NEW_TOKENS', '2048'))
+MAX_STOP_SEQUENCES = 8
+# How often a stream waiting on its next token checks that the client is still there
+DISCONNECT_POLL_SECONDS = 1.0
+
+def generation_options(request: Dict[str, Any]) -> Dict[str, Any]:
+    """Validated max_new_tokens, stop strings and stop token ids of an inference request"""
+    try:
+        max_new_tokens = int(request.get("max_new_tokens", 256))
+        stop = request.get("stop") or []
+        stop = [stop] if isinstance(stop, str) else [str(s) for s in stop]
+        stop_token_ids = [int(t) for t in request.get("stop_token_ids") or []]
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid max_new_tokens, stop or stop_token_ids")
+    if not 1 <= max_new_tokens <= MAX_NEW_TOKENS_LIMIT:
+        raise HTTPException(status_code=400, detail=f"max_new_tokens must be between 1 and {MAX_NEW_TOKENS_LIMIT}")
+    if len(stop) > MAX_STOP_SEQUENCES or not all(stop):
+        raise HTTPException(status_code=400, detail=f"stop takes up to {MAX_STOP_SEQUENCES} non-empty strings")
+    # Tuples keep the options hashable for response cache keys
+    return {"max_new_tokens": max_new_tokens, "stop": tuple(stop), "stop_token_ids": tuple(sorted(set(stop_token_ids)))}
 
 @app.post("/api/inference/{deployment_id}")
-async def model_inference(deployment_id: str, request: Dict[str, str]):
-    """Handle model inference requests"""
+async def model_inference(deployment_id: str, request: Dict[str, Any], http_request: Request):
+    """Handle model inference requests, optionally streamed as Server-Sent Events"""
     prompt = request.get("prompt", "")
     
-    # Simulate model inference
-    response = f"This is a simulated response to: {prompt}"
+    row = await db.fetchone('''
+        SELECT model_id, status, artifact_path, response_cache, draft_model_id, num_draft_tokens FROM api_deployments
+        WHERE id = ?
+    ''', (deployment_id,))
+    
+    if row and row[1] == 'exporting':
+        raise HTTPException(status_code=503, detail="Deployment is still being exported")
+    if not row or row[1] != 'active':
+        raise HTTPException(status_code=404, detail="Deployment not found")
+    # Exported deployments serve their own artifact rather than the training output
+    model_id = f"{EXPORT_PREFIX}{deployment_id}" if row[2] else row[0]
+    usage_tracker.record(deployment_id, "inference")
     
+    try:
+        temperature = float(request.get("temperature", 0.7))
+        seed = int(request["seed"]) if request.get("seed") is not None else None
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid temperature or seed")
+    if not math.isfinite(temperature):
+        raise HTTPException(status_code=400, detail="temperature must be a finite number")
+    options = generation_options(request)
+    
+    # Deterministic requests can be answered from the response cache without the model
+    cacheable = (bool(row[3]) and request.get("cache", True) and not request.get("stream")
+                 and is_deterministic(temperature, seed))
+    # Every temperature <= 0 is greedy, and greedy decoding ignores the seed
+    params = {"temperature": temperature, "seed": seed} if temperature > 0 else {"temperature": 0.0, "seed": None}
+    params.update(options)
+    cache_key = None
+    if cacheable and model_id in model_cache.versions:
+        cache_key = response_cache.key(deployment_id, model_cache.versions[model_id], prompt, params)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return cached_inference_response(deployment_id, cached)
+    
+    try:
+        # Loading a model is slow, keep it off the event loop. The model stays
+        # pinned in the cache until the request releases it.
+        inference = await asyncio.to_thread(model_cache.acquire, model_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    
+    if cacheable and cache_key is None:
+        # First request since start-up: the artifact version is known once loaded
+        cache_key = response_cache.key(deployment_id, model_cache.versions[model_id], prompt, params)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            model_cache.release(model_id)
+            return cached_inference_response(deployment_id, cached)
+    
+    # Speculative deployments pin their draft model alongside the served one
+    draft_id = row[4]
+    draft = None
+    if draft_id:
+        try:
+            draft = await asyncio.to_thread(model_cache.acquire, draft_id)
+        except ValueError as e:
+            model_cache.release(model_id)
+            raise HTTPException(status_code=404, detail=str(e))
+    
+    def release_models():
+        model_cache.release(model_id)
+        if draft_id:
+            model_cache.release(draft_id)
+    
+    # The model is loaded by now, so importing the batching module is cheap
+    from api.batching import get_scheduler
+    try:
+        scheduler = get_scheduler(deployment_id, inference, draft, row[5])
+    except ValueError as e:
+        # A draft whose tokenizer does not match the deployment's
+        release_models()
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if request.get("stream"):
+        async def event_stream():
+            events = scheduler.stream(prompt, temperature=temperature, seed=seed, **options)
+            pending = None
+            try:
+                while True:
+                    pending = pending or asyncio.ensure_future(events.__anext__())
+                    done, _ = await asyncio.wait({pending}, timeout=DISCONNECT_POLL_SECONDS)
+                    # Stop generating for clients that have gone away, even mid-prefill
+                    if await http_request.is_disconnected():
+                        break
+                    if not done:
+                        continue
+                    try:
+                        event = pending.result()
+                    except StopAsyncIteration:
+                        break
+                    pending = None
+                    yield f"data: {json.dumps(event)}\n\n"
+            except Exception:
+                usage_tracker.record_error(deployment_id, "inference")
+                raise
+            finally:
+                if pending is not None and not pending.done():
+                    pending.cancel()
+                    await asyncio.gather(pending, return_exceptions=True)
+                await events.aclose()
+                release_models()
+        
+        return StreamingResponse(
+            event_stream(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    
+    try:
+        # Concurrent requests for this deployment share forward passes
+        result = await scheduler.submit(prompt, temperature=temperature, seed=seed, **options)
+    except Exception:
+        usage_tracker.record_error(deployment_id, "inference")
+        raise
+    finally:
+        release_models()
+    
+    if cache_key is not None:
+        response_cache.put(cache_key, result)
+    
+    return {
+        "response": result["text"],
+        "model_id": deployment_id,
+        "usage": inference_usage(result),
+        "stop_reason": result["stop_reason"],
+        "time_to_first_token": result["time_to_first_token"],
+        "timestamp": datetime.now().isoformat()
+    }
+
+def inference_usage(result: Dict[str, Any]) -> Dict[str, int]:
     return {
-        "response": response,
+        "prompt_tokens": result["prompt_tokens"],
+        "completion_tokens": result["completion_tokens"],
+        "total_tokens": result["prompt_tokens"] + result["completion_tokens"]
+    }
+
+def cached_inference_response(deployment_id: str, result: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "response": result["text"],
         "model_id": deployment_id,
+        # What generating the response took when it was first served
+        "usage": inference_usage(result),
+        "stop_reason": result["stop_reason"],
+        "time_to_first_token": 0.0,
+        "cached": True,
         "timestamp": datetime.now().isoformat()
     }
 
+@app.get("/api/inference/{deployment_id}/stats")
+async def get_inference_stats(deployment_id: str):
+    """Batching (or speculative decoding) and cache counters for a deployment"""
+    batching = sys.modules.get("api.batching")
+    scheduler = batching.schedulers.get(deployment_id) if batching else None
+    if scheduler is None:
+        raise HTTPException(status_code=404, detail="Deployment has not served any requests")
+    
+    return {
+        "scheduler": scheduler.stats,
+        "usage": usage_tracker.window_counts(deployment_id),
+        "prefix_cache": scheduler.prefix_cache.metrics(),
+        "response_cache": response_cache.metrics(deployment_id)
+    }
+
+# Background model preloading: deployment_id -> {"model_id", "status", "error"}
+warmup_state: Dict[str, Dict[str, Any]] = {}
+
+def warm_models(models: Dict[str, str], drafts: Dict[str, Any]):
+    """Load models (and drafts) and start their schedulers; runs in a worker thread"""
+    # Importing the batching module pulls in the ML stack, once, off the event loop
+    from api.batching import get_scheduler
+    
+    for deployment_id, model_id in models.items():
+        draft_id, num_draft_tokens = drafts.get(deployment_id, (None, None))
+        try:
+            inference = model_cache.acquire(model_id)
+            try:
+                draft = model_cache.acquire(draft_id) if draft_id else None
+                try:
+                    get_scheduler(deployment_id, inference, draft, num_draft_tokens)
+                finally:
+                    if draft_id:
+                        model_cache.release(draft_id)
+            finally:
+                model_cache.release(model_id)
+            warmup_state[deployment_id]["status"] = "ready"
+        except Exception as e:
+            warmup_state[deployment_id].update({"status": "failed", "error": str(e)})
+
+async def start_warmup(deployment_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Queue the models behind the given deployments for loading in the background"""
+    rows = await db.fetchall(
+        f"SELECT id, model_id, artifact_path, draft_model_id, num_draft_tokens FROM api_deployments "
+        f"WHERE id IN ({','.join('?' * len(deployment_ids))})",
+        deployment_ids
+    )
+    models = {row[0]: f"{EXPORT_PREFIX}{row[0]}" if row[2] else row[1] for row in rows}
+    drafts = {row[0]: (row[3], row[4]) for row in rows if row[3]}
+    
+    pending = {}
+    for deployment_id in deployment_ids:
+        if deployment_id not in models:
+            warmup_state[deployment_id] = {"model_id": None, "status": "not_found", "error": None}
+        elif warmup_state.get(deployment_id, {}).get("status") != "loading":
+            warmup_state[deployment_id] = {"model_id": models[deployment_id], "status": "loading", "error": None}
+            pending[deployment_id] = models[deployment_id]
+    
+    if pending:
+        asyncio.get_running_loop().run_in_executor(None, warm_models, pending, drafts)
+    return {deployment_id: warmup_state[deployment_id] for deployment_id in deployment_ids}
+
+@app.post("/warmup", status_code=202)
+async def warmup(request: Optional[Dict[str, Any]] = None):
+    """Preload the models of the given deployments (default PRELOAD_DEPLOYMENTS) in the background"""
+    deployment_ids = (request or {}).get("deployment_ids") or [
+        d.strip() for d in os.getenv('PRELOAD_DEPLOYMENTS', '').split(',') if d.strip()
+    ]
+    if not deployment_ids:
+        raise HTTPException(status_code=400, detail="No deployments to warm up")
+    
+    return {"deployments": await start_warmup(deployment_ids)}
+
+@app.get("/warmup")
+async def warmup_status():
+    """Readiness: 200 once every requested warmup has its model loaded, 503 before that"""
+    deployments = {}
+    for deployment_id, state in list(warmup_state.items()):
+        state = dict(state)
+        # A warmed model can still be evicted later to make room for others
+        if state["status"] == "ready" and not model_cache.loaded(state["model_id"]):
+            state["status"] = "evicted"
+        deployments[deployment_id] = state
+    
+    ready = all(state["status"] in ("ready", "evicted") for state in deployments.values())
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"ready": ready, "ml_stack_loaded": "torch" in sys.modules, "deployments": deployments}
+    )
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,269 @@
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ENABLE_METRICS = os.getenv('ENABLE_METRICS', 'true').lower() == 'true'
+# Distinct label sets a labelled metric may hold before new ones are folded together
+MAX_LABEL_SETS = int(os.getenv('METRICS_MAX_LABEL_SETS', '200'))
+OVERFLOW_LABEL = "other"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+THROUGHPUT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _escape_label_value(value: str) -> str:
+    return _escape_help(value).replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape_label_value(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _HistogramChild:
+    """Bucket counts for one label set; observe() only bumps preallocated slots"""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # One slot per bound plus +Inf
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, counts: List[int], total: float, count: int):
+        for i, n in enumerate(counts):
+            self.counts[i] += n
+        self.sum += total
+        self.count += count
+
+    def drain(self) -> Tuple[List[int], float, int]:
+        """Return and reset the state accumulated since the last drain"""
+        snapshot = (self.counts, self.sum, self.count)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        return snapshot
+
+
+class Histogram:
+    """Prometheus histogram with fixed buckets.
+
+    Children are created once per label set and cached, so a hot path can hold
+    on to `labels(...)` and observe with no allocation per sample. Label sets
+    past `max_label_sets` share one child labelled "other", so values taken
+    from requests cannot grow the series count without bound.
+    """
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS,
+                 labelnames: Sequence[str] = (), max_label_sets: Optional[int] = None):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self.max_label_sets = MAX_LABEL_SETS if max_label_sets is None else max_label_sets
+        self._children: Dict[Tuple[str, ...], _HistogramChild] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = _HistogramChild(self.buckets)
+
+    def labels(self, *values: str) -> _HistogramChild:
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+            with self._lock:
+                if values not in self._children and len(self._children) >= self.max_label_sets:
+                    if len(self._children) == self.max_label_sets:
+                        logger.warning(f"{self.name} reached {self.max_label_sets} label sets, "
+                                       f"folding new ones into \"{OVERFLOW_LABEL}\"")
+                    values = (OVERFLOW_LABEL,) * len(self.labelnames)
+                child = self._children.setdefault(values, _HistogramChild(self.buckets))
+        return child
+
+    def observe(self, value: float):
+        self._children[()].observe(value)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {_escape_help(self.help)}", f"# TYPE {self.name} histogram"]
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                labels = _format_labels(self.labelnames, values, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {child.sum}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Gauge:
+    """Gauge set directly or sampled from a callback at scrape time"""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 fn: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.fn = fn
+
+    def set(self, value: float, *labels: str):
+        self.values[labels] = value
+
+    def inc(self, amount: float = 1.0, *labels: str):
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {_escape_help(self.help)}", f"# TYPE {self.name} gauge"]
+        values = self.values
+        if self.fn is not None:
+            try:
+                values = self.fn()
+            except Exception as e:
+                logger.warning(f"Could not sample gauge {self.name}: {str(e)}")
+                values = {}
+        for labels, value in list(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS,
+                  labelnames: Sequence[str] = (), max_label_sets: Optional[int] = None) -> Histogram:
+        return self.register(Histogram(name, help, buckets, labelnames, max_label_sets))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = (),
+              fn: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None) -> Gauge:
+        return self.register(Gauge(name, help, labelnames, fn))
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# API
+REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", labelnames=("route", "method"))
+DB_QUERY_SECONDS = registry.histogram(
+    "db_query_duration_seconds", "Time spent running SQLite queries", FAST_BUCKETS)
+
+# Inference
+PREFILL_SECONDS = registry.histogram(
+    "inference_prefill_seconds", "Prefill forward pass time per admitted batch")
+DECODE_STEP_SECONDS = registry.histogram(
+    "inference_decode_step_seconds", "Decode forward pass time per step", FAST_BUCKETS)
+TIME_TO_FIRST_TOKEN_SECONDS = registry.histogram(
+    "inference_time_to_first_token_seconds", "Time from submission to the first generated token")
+TOKENS_PER_SECOND = registry.histogram(
+    "inference_tokens_per_second", "Generation throughput per request", THROUGHPUT_BUCKETS)
+
+# Training
+TRAINING_STEP_SECONDS = registry.histogram(
+    "training_step_seconds", "Optimizer step time",
+    (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+DATALOADER_WAIT_SECONDS = registry.histogram(
+    "training_dataloader_wait_seconds", "Time between steps spent waiting for the next batch", FAST_BUCKETS)
+
+# Anything else a client sends is reported as "other"
+HTTP_METHODS = frozenset({"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"})
+
+# Histograms observed in training worker processes and forwarded to the API process
+TRAINING_HISTOGRAMS = (TRAINING_STEP_SECONDS, DATALOADER_WAIT_SECONDS)
+
+
+def drain_histograms(histograms: Sequence[Histogram]) -> Dict[str, Tuple[List[int], float, int]]:
+    """Snapshot and reset unlabelled histograms so their deltas can be shipped elsewhere"""
+    return {h.name: h.labels().drain() for h in histograms if h.labels().count}
+
+
+def merge_histograms(snapshots: Dict[str, Tuple[List[int], float, int]]):
+    """Fold deltas produced by drain_histograms() in another process into this one"""
+    for name, (counts, total, count) in snapshots.items():
+        metric = registry.metrics.get(name)
+        if isinstance(metric, Histogram):
+            metric.labels().merge(counts, total, count)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int) -> ThreadingHTTPServer:
+    """Serve /metrics on a separate port from a daemon thread"""
+    server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"Serving metrics on port {port}")
+    return server
+
+
+class MetricsMiddleware:
+    """ASGI middleware observing request latency per route template.
+
+    Plain ASGI rather than BaseHTTPMiddleware so streaming responses are not
+    buffered; the route is read back from the scope once routing has run.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            endpoint = scope.get("endpoint")
+            route = getattr(endpoint, "__name__", "unmatched")
+            method = scope["method"] if scope["method"] in HTTP_METHODS else OVERFLOW_LABEL
+            REQUEST_SECONDS.labels(route, method).observe(time.perf_counter() - started)
@@ -0,0 +1,218 @@
+import asyncio
+import codecs
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+REQUIRED_COLUMNS = ("instruction", "output")
+SUPPORTED_EXTENSIONS = (".jsonl", ".csv")
+
+
+class DatasetValidationError(ValueError):
+    """Raised as soon as an uploaded dataset is found to be malformed"""
+
+    def __init__(self, message: str, line: Optional[int] = None):
+        self.line = line
+        super().__init__(f"Line {line}: {message}" if line else message)
+
+
+class RowValidator:
+    """Validates JSONL/CSV rows incrementally as bytes arrive"""
+
+    def __init__(self, extension: str):
+        self.extension = extension
+        self.rows = 0
+        self.line = 0
+        # Spreadsheet exports often start with a BOM, which would corrupt the first column name
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self._buffer = ""
+        self._record: List[str] = []
+        self._header: Optional[List[str]] = None
+
+    def feed(self, data: bytes):
+        try:
+            self._buffer += self._decoder.decode(data)
+        except UnicodeDecodeError:
+            raise DatasetValidationError("File is not valid UTF-8", self.line + 1)
+
+        *lines, self._buffer = self._buffer.split("\n")
+        for line in lines:
+            self._feed_line(line)
+
+    def finish(self):
+        try:
+            self._buffer += self._decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            raise DatasetValidationError("File is not valid UTF-8", self.line + 1)
+        if self._buffer:
+            self._feed_line(self._buffer)
+            self._buffer = ""
+        if self._record:
+            raise DatasetValidationError("Unterminated quoted CSV field", self.line)
+        if self.rows == 0:
+            raise DatasetValidationError("Dataset contains no rows")
+
+    def _feed_line(self, line: str):
+        self.line += 1
+        if self.extension == ".jsonl":
+            self._validate_json(line)
+        else:
+            self._validate_csv(line)
+
+    def _validate_json(self, line: str):
+        if not line.strip():
+            return
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise DatasetValidationError(f"Invalid JSON ({e.msg})", self.line)
+        if not isinstance(row, dict):
+            raise DatasetValidationError("Each line must be a JSON object", self.line)
+        missing = [column for column in REQUIRED_COLUMNS if column not in row]
+        if missing:
+            raise DatasetValidationError(f"Missing field(s): {', '.join(missing)}", self.line)
+        self.rows += 1
+
+    def _validate_csv(self, line: str):
+        # A record is complete once its quotes are balanced; quoted fields may span lines
+        self._record.append(line)
+        record = "\n".join(self._record)
+        if record.count('"') % 2:
+            return
+        self._record = []
+        if not record.strip():
+            return
+
+        try:
+            fields = next(csv.reader(io.StringIO(record)))
+        except csv.Error as e:
+            raise DatasetValidationError(f"Invalid CSV ({e})", self.line)
+
+        if self._header is None:
+            self._header = [field.strip() for field in fields]
+            missing = [column for column in REQUIRED_COLUMNS if column not in self._header]
+            if missing:
+                raise DatasetValidationError(f"Missing column(s): {', '.join(missing)}", self.line)
+            return
+
+        if len(fields) != len(self._header):
+            raise DatasetValidationError(
+                f"Expected {len(self._header)} fields, found {len(fields)}", self.line
+            )
+        self.rows += 1
+
+
+class DatasetIngest:
+    """Streams one upload to disk while hashing and validating it.
+
+    Datasets are stored once per content digest under `<storage_dir>/blobs`, so
+    re-uploading identical bytes only adds a reference to the existing file. A
+    leading BOM is dropped before hashing and storing, since the training loader
+    reads blobs as plain UTF-8.
+    """
+
+    def __init__(self, filename: str, storage_dir: str = "uploads"):
+        self.extension = os.path.splitext(filename or "")[1].lower()
+        if self.extension not in SUPPORTED_EXTENSIONS:
+            raise DatasetValidationError(
+                f"Unsupported file format '{self.extension or filename}', expected one of: "
+                f"{', '.join(SUPPORTED_EXTENSIONS)}"
+            )
+
+        self.blob_dir = os.path.join(storage_dir, "blobs")
+        tmp_dir = os.path.join(storage_dir, "tmp")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        self.tmp_path = os.path.join(tmp_dir, f"{uuid.uuid4().hex}{self.extension}")
+        self._file = open(self.tmp_path, "wb")
+        self._hash = hashlib.sha256()
+        self.validator = RowValidator(self.extension)
+        self.size = 0
+        # The first bytes are held back until it is clear whether they are a BOM
+        self._head: Optional[bytes] = b""
+
+    def write(self, chunk: bytes):
+        if self._head is not None:
+            head = self._head + chunk
+            if len(head) < len(codecs.BOM_UTF8) and codecs.BOM_UTF8.startswith(head):
+                self._head = head
+                return
+            self._head = None
+            chunk = head[len(codecs.BOM_UTF8):] if head.startswith(codecs.BOM_UTF8) else head
+        self._store(chunk)
+
+    def _store(self, chunk: bytes):
+        self._hash.update(chunk)
+        self.validator.feed(chunk)
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self) -> Dict[str, Any]:
+        """Finish validation and move the file to its content address"""
+        if self._head:
+            # An upload shorter than a BOM
+            self._store(self._head)
+        self._head = None
+        self.validator.finish()
+        self._file.close()
+
+        digest = self._hash.hexdigest()
+        blob_path = os.path.join(self.blob_dir, f"{digest}{self.extension}")
+        deduplicated = os.path.exists(blob_path)
+        if deduplicated:
+            os.remove(self.tmp_path)
+        else:
+            os.replace(self.tmp_path, blob_path)
+
+        return {
+            "sha256": digest,
+            "file_path": blob_path,
+            "size": self.size,
+            "rows": self.validator.rows,
+            "deduplicated": deduplicated,
+        }
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+async def ingest_stream(chunks: AsyncIterator[bytes], filename: str,
+                        storage_dir: str = "uploads") -> Dict[str, Any]:
+    """Hash, validate and store an async byte stream without blocking the event loop"""
+    ingest = DatasetIngest(filename, storage_dir)
+    pending = bytearray()
+
+    try:
+        async for chunk in chunks:
+            pending += chunk
+            # Coalesce small network chunks so each thread hop does real work
+            if len(pending) >= CHUNK_SIZE:
+                await asyncio.to_thread(ingest.write, bytes(pending))
+                pending.clear()
+        if pending:
+            await asyncio.to_thread(ingest.write, bytes(pending))
+        return await asyncio.to_thread(ingest.commit)
+    except BaseException:
+        ingest.abort()
+        raise
+
+
+async def read_upload(file, chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Async chunk iterator over a FastAPI UploadFile"""
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
@@ -0,0 +1,539 @@
+"""Local model store fed by a parallel, resumable downloader.
+
+Files come from a Hugging Face-compatible hub (MODEL_HUB_URL) as chunked HTTP
+range requests, are verified against the hub's checksums and are kept once per
+distinct content under MODEL_STORAGE_PATH:
+
+    blobs/<sha256>              every distinct file, stored once
+    partial/<key>.part          a file being downloaded
+    partial/<key>.json          bytes already written to each chunk of it
+
+Files whose size the hub does not report cannot be split into ranges; they are
+fetched in a single request and start over after an interruption.
+    snapshots/<model_id>/       the model's files, hard-linked to their blobs
+    snapshots/<model_id>.json   manifest, written once every file is verified
+"""
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import FIRST_EXCEPTION, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+import httpx
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MODEL_STORAGE_PATH = os.getenv('MODEL_STORAGE_PATH', './models')
+MODEL_HUB_URL = os.getenv('MODEL_HUB_URL', 'https://huggingface.co')
+DOWNLOAD_WORKERS = int(os.getenv('DOWNLOAD_WORKERS', '8'))
+DOWNLOAD_CHUNK_SIZE = int(os.getenv('DOWNLOAD_CHUNK_MB', '64')) * 1024 * 1024
+DOWNLOAD_RETRIES = int(os.getenv('DOWNLOAD_RETRIES', '5'))
+
+READ_SIZE = 1024 * 1024
+# Chunk progress is written to disk after this many new bytes; at most this much is refetched on resume
+CHECKPOINT_BYTES = 16 * 1024 * 1024
+# Other serializations of the same weights, skipped when the repo has safetensors
+ALTERNATIVE_WEIGHT_SUFFIXES = (".bin", ".pt", ".pth", ".ckpt", ".h5", ".msgpack", ".ot", ".onnx", ".gguf")
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+MODEL_ID_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9._-]*")
+
+
+class DownloadError(RuntimeError):
+    """A model file could not be fetched or failed verification"""
+
+
+class _TransferInterrupted(DownloadError):
+    """A transfer that stopped early and can continue from where it got to"""
+
+
+class _TransferStopped(DownloadError):
+    """A transfer abandoned because another part of the download failed or the store shut down"""
+
+
+def select_files(siblings: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Files worth fetching from a hub listing: one weight format and no original/ checkpoints"""
+    has_safetensors = any(s["rfilename"].endswith(".safetensors") for s in siblings)
+    files = []
+    for sibling in siblings:
+        name = sibling["rfilename"]
+        if name.startswith("original/") or (has_safetensors and name.endswith(ALTERNATIVE_WEIGHT_SUFFIXES)):
+            continue
+        if os.path.isabs(name) or ".." in name.split("/"):
+            raise DownloadError(f"Refusing to store file outside the snapshot: {name}")
+        lfs = sibling.get("lfs") or {}
+        files.append({
+            "name": name,
+            "size": lfs.get("size", sibling.get("size")),
+            "sha256": lfs.get("sha256"),
+            "blob_id": sibling.get("blobId"),
+        })
+    return files
+
+
+def file_digests(path: str, git_blob: bool = False) -> Tuple[str, Optional[str]]:
+    """sha256 of a file and, if asked, its git blob id (sha1 over a "blob <size>" header)"""
+    sha256 = hashlib.sha256()
+    git = hashlib.sha1(f"blob {os.path.getsize(path)}\0".encode()) if git_blob else None
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(READ_SIZE), b""):
+            sha256.update(data)
+            if git is not None:
+                git.update(data)
+    return sha256.hexdigest(), git.hexdigest() if git is not None else None
+
+
+def _write_json(path: str, payload: Dict[str, Any]):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(payload, f)
+    os.replace(tmp_path, path)
+
+
+def _remove_files(*paths: Optional[str]):
+    for path in paths:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+def _wait_all(futures, job: "DownloadJob"):
+    """Wait for every transfer, aborting the rest of the job as soon as one fails, then raise the cause"""
+    done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+    if pending:
+        job.aborted.set()
+        wait(pending)
+    errors = [future.exception() for future in futures if future.exception() is not None]
+    if errors:
+        raise next((e for e in errors if not isinstance(e, _TransferStopped)), errors[0])
+
+
+class _PartialFile:
+    """A preallocated .part file and how many bytes of each chunk are already in it"""
+
+    def __init__(self, prefix: str, size: int, chunk_size: int):
+        self.path = f"{prefix}.part"
+        self.state_path = f"{prefix}.json"
+        self.size = size
+        self.chunk_size = chunk_size
+        self.done: Dict[int, int] = {}
+        self._unsaved = 0
+        self._lock = threading.Lock()
+
+        state = None
+        if os.path.isfile(self.state_path) and os.path.isfile(self.path):
+            with open(self.state_path) as f:
+                state = json.load(f)
+        if state and state["size"] == size and state["chunk_size"] == chunk_size:
+            self.done = {int(index): done for index, done in state["done"].items()}
+        else:
+            with open(self.path, "wb") as f:
+                f.truncate(size)
+        self._fd = os.open(self.path, os.O_RDWR)
+
+    def chunks(self) -> List[Tuple[int, int, int]]:
+        """(index, first byte, last byte) of every chunk that still has bytes missing"""
+        pending = []
+        for index, start in enumerate(range(0, self.size, self.chunk_size)):
+            end = min(start + self.chunk_size, self.size) - 1
+            if start + self.done.get(index, 0) <= end:
+                pending.append((index, start, end))
+        return pending
+
+    def resumed_bytes(self) -> int:
+        return sum(self.done.values())
+
+    def write(self, index: int, start: int, position: int, data: bytes):
+        os.pwrite(self._fd, data, position)
+        with self._lock:
+            self.done[index] = position + len(data) - start
+            self._unsaved += len(data)
+            if self._unsaved >= CHECKPOINT_BYTES:
+                self._save()
+
+    def _save(self):
+        # Written bytes sit in the page cache, so they survive the process even before an fsync;
+        # anything lost to a machine crash fails verification and is fetched again
+        _write_json(self.state_path, {"size": self.size, "chunk_size": self.chunk_size, "done": self.done})
+        self._unsaved = 0
+
+    def close(self):
+        with self._lock:
+            self._save()
+        os.close(self._fd)
+
+    def discard(self):
+        _remove_files(self.path, self.state_path)
+
+
+class DownloadJob:
+    """Byte-level progress of one model download"""
+
+    def __init__(self, model_id: str, repo: str, revision: str):
+        self.model_id = model_id
+        self.repo = repo
+        self.revision = revision
+        self.status = "pending"
+        self.error: Optional[str] = None
+        self.files: Dict[str, Dict[str, Any]] = {}
+        # Bytes fetched over the network by this run, picked up from partial files, or already in the store
+        self.downloaded_bytes = 0
+        self.resumed_bytes = 0
+        self.reused_bytes = 0
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        # Set on the first failure so the remaining transfers stop early
+        self.aborted = threading.Event()
+        self._lock = threading.Lock()
+
+    def begin(self, files: List[Dict[str, Any]]):
+        with self._lock:
+            self.files = {f["name"]: {"size": f["size"], "completed_bytes": 0, "status": "pending"} for f in files}
+            self.status = "downloading"
+
+    def add(self, name: str, nbytes: int, kind: str = "downloaded"):
+        with self._lock:
+            setattr(self, f"{kind}_bytes", getattr(self, f"{kind}_bytes") + nbytes)
+            self.files[name]["completed_bytes"] += nbytes
+            self.files[name]["status"] = "reused" if kind == "reused" else "downloading"
+
+    def set_size(self, name: str, size: int):
+        with self._lock:
+            self.files[name]["size"] = size
+
+    def file_done(self, name: str):
+        with self._lock:
+            if self.files[name]["status"] != "reused":
+                self.files[name]["status"] = "completed"
+
+    def finish(self, error: Optional[str] = None):
+        with self._lock:
+            self.status = "failed" if error else "completed"
+            self.error = error
+            self.finished_at = time.time()
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            # Files of unknown size count once they have been fetched
+            total = sum(f["size"] or 0 for f in self.files.values())
+            completed = self.downloaded_bytes + self.resumed_bytes + self.reused_bytes
+            elapsed = (self.finished_at or time.time()) - self.started_at
+            return {
+                "model_id": self.model_id,
+                "repo": self.repo,
+                "revision": self.revision,
+                "status": self.status,
+                "error": self.error,
+                "total_bytes": total,
+                "completed_bytes": completed,
+                "downloaded_bytes": self.downloaded_bytes,
+                "resumed_bytes": self.resumed_bytes,
+                "reused_bytes": self.reused_bytes,
+                "progress": completed / total if total else float(self.status == "completed"),
+                "bytes_per_second": self.downloaded_bytes / elapsed if elapsed > 0 else 0.0,
+                "files": {name: dict(f) for name, f in self.files.items()},
+            }
+
+
+class ModelStore:
+    """Content-addressed local copies of hub models and the downloads that fill it.
+
+    Chunks of every file are fetched in parallel on one shared pool. Progress is
+    checkpointed next to each partial file, so an interrupted download continues
+    where it stopped, and a file whose checksum is already in the store is never
+    fetched again, whichever model it belongs to.
+    """
+
+    def __init__(self, root: str = MODEL_STORAGE_PATH, hub_url: str = MODEL_HUB_URL,
+                 token: Optional[str] = None, workers: int = DOWNLOAD_WORKERS,
+                 chunk_size: int = DOWNLOAD_CHUNK_SIZE, retries: int = DOWNLOAD_RETRIES, backoff: float = 1.0):
+        # Absolute, so adapter configs written by training point at the same files from any directory
+        self.root = os.path.abspath(root)
+        self.hub_url = hub_url.rstrip("/")
+        self.token = token if token is not None else os.getenv('HUGGINGFACE_TOKEN')
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.backoff = backoff
+        self._jobs: Dict[str, DownloadJob] = {}
+        self._futures: Dict[str, Future] = {}
+        self._file_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._client: Optional[httpx.Client] = None
+        # Jobs wait on files and files wait on chunks, so each level gets its own pool
+        self._job_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="download-job")
+        self._file_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="download-file")
+        self._chunk_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="download")
+
+    def snapshot_path(self, model_id: str) -> str:
+        return os.path.join(self.root, "snapshots", model_id)
+
+    def _blob_path(self, sha256: str) -> str:
+        return os.path.join(self.root, "blobs", sha256)
+
+    def manifest(self, model_id: str) -> Optional[Dict[str, Any]]:
+        """What the store holds for a model, or None until a download of it has completed"""
+        path = f"{self.snapshot_path(model_id)}.json"
+        if not MODEL_ID_PATTERN.fullmatch(model_id) or not os.path.isfile(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def is_downloaded(self, model_id: str) -> bool:
+        return bool(MODEL_ID_PATTERN.fullmatch(model_id)) and os.path.isfile(f"{self.snapshot_path(model_id)}.json")
+
+    def path(self, model_id: str) -> str:
+        """Local directory of a downloaded model"""
+        if not self.is_downloaded(model_id):
+            raise ValueError(f"Model not downloaded: {model_id}")
+        return self.snapshot_path(model_id)
+
+    def resolve(self, name: str) -> str:
+        """Local directory for a model id, hub repo or path; the name itself when the store has no copy"""
+        if os.path.isdir(name):
+            return name
+        if self.is_downloaded(name):
+            return self.snapshot_path(name)
+        snapshots = os.path.join(self.root, "snapshots")
+        if os.path.isdir(snapshots):
+            for entry in sorted(os.listdir(snapshots)):
+                if entry.endswith(".json"):
+                    manifest = self.manifest(entry[:-len(".json")])
+                    if manifest and manifest["repo"] == name:
+                        return self.snapshot_path(manifest["model_id"])
+        return name
+
+    def is_downloading(self, model_id: str) -> bool:
+        with self._lock:
+            future = self._futures.get(model_id)
+            return future is not None and not future.done()
+
+    def progress(self, model_id: str) -> Optional[Dict[str, Any]]:
+        """Progress of the latest download of a model in this process"""
+        job = self._jobs.get(model_id)
+        return job.to_dict() if job else None
+
+    def download(self, model_id: str, repo: str, revision: str = "main") -> Future:
+        """Start, or join, the download of a hub repo; the future resolves to the stored manifest"""
+        if not MODEL_ID_PATTERN.fullmatch(model_id):
+            raise ValueError(f"Invalid model id: {model_id}")
+        with self._lock:
+            future = self._futures.get(model_id)
+            if future is not None and not future.done():
+                return future
+            job = DownloadJob(model_id, repo, revision)
+            self._jobs[model_id] = job
+            future = self._job_executor.submit(self._run, job)
+            self._futures[model_id] = future
+        return future
+
+    def shutdown(self):
+        """Stop transfers; partial files keep their progress for the next download"""
+        self._stopping.set()
+        for executor in (self._job_executor, self._file_executor, self._chunk_executor):
+            executor.shutdown(wait=False, cancel_futures=True)
+        if self._client is not None:
+            self._client.close()
+
+    def _http(self) -> httpx.Client:
+        with self._lock:
+            if self._client is None:
+                headers = {"Authorization": f"Bearer {self.token}"} if self.token else {}
+                self._client = httpx.Client(
+                    headers=headers,
+                    follow_redirects=True,
+                    timeout=httpx.Timeout(30.0, read=60.0),
+                    limits=httpx.Limits(max_connections=self.workers * 2, max_keepalive_connections=self.workers),
+                )
+            return self._client
+
+    def _file_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._file_locks.setdefault(key, threading.Lock())
+
+    def _run(self, job: DownloadJob) -> Dict[str, Any]:
+        try:
+            manifest = self._download(job)
+        except Exception as e:
+            logger.error(f"Download of {job.model_id} from {job.repo} failed: {e}")
+            job.finish(str(e))
+            raise
+        job.finish()
+        logger.info(f"Downloaded {job.model_id} from {job.repo}@{manifest['commit']}")
+        return manifest
+
+    def _download(self, job: DownloadJob) -> Dict[str, Any]:
+        client = self._http()
+        response = client.get(f"{self.hub_url}/api/models/{job.repo}/revision/{quote(job.revision, safe='')}",
+                              params={"blobs": "true"})
+        response.raise_for_status()
+        listing = response.json()
+        # Pin the commit so every chunk, including resumed ones, comes from the same revision
+        commit = listing.get("sha") or job.revision
+        files = select_files(listing.get("siblings", []))
+        for f in files:
+            f["url"] = f"{self.hub_url}/{job.repo}/resolve/{commit}/{quote(f['name'])}"
+            if f["size"] is None:
+                head = client.head(f["url"])
+                head.raise_for_status()
+                # Left unknown when the hub or a redirect omits it; such files are fetched whole
+                length = head.headers.get("content-length")
+                f["size"] = int(length) if length is not None else None
+        job.begin(files)
+
+        os.makedirs(os.path.join(self.root, "blobs"), exist_ok=True)
+        os.makedirs(os.path.join(self.root, "partial"), exist_ok=True)
+        futures = {self._file_executor.submit(self._fetch_file, job, client, commit, f): f for f in files}
+        _wait_all(futures, job)
+        blobs = {futures[future]["name"]: future.result() for future in futures}
+
+        self._link_snapshot(job.model_id, blobs)
+        manifest = {
+            "model_id": job.model_id,
+            "repo": job.repo,
+            "revision": job.revision,
+            "commit": commit,
+            "files": [{"name": f["name"], "size": f["size"], "sha256": blobs[f["name"]]} for f in files],
+            "total_bytes": sum(f["size"] for f in files),
+            "downloaded_at": time.time(),
+        }
+        _write_json(f"{self.snapshot_path(job.model_id)}.json", manifest)
+        return manifest
+
+    def _fetch_file(self, job: DownloadJob, client: httpx.Client, commit: str, file: Dict[str, Any]) -> str:
+        """Make sure a file's content is in the store and return its sha256"""
+        name, expected = file["name"], file["sha256"]
+        # Files without a published sha256 (small, non-LFS ones) resume under a per-revision key
+        key = expected or hashlib.sha256(f"{job.repo}@{commit}/{name}".encode()).hexdigest()
+        with self._file_lock(key):
+            if expected and os.path.isfile(self._blob_path(expected)):
+                job.add(name, file["size"], "reused")
+                job.file_done(name)
+                return expected
+
+            if file["size"] is None:
+                part_path, state_path = os.path.join(self.root, "partial", f"{key}.part"), None
+                self._fetch_whole(job, client, file, part_path)
+            else:
+                partial = _PartialFile(os.path.join(self.root, "partial", key), file["size"], self.chunk_size)
+                try:
+                    job.add(name, partial.resumed_bytes(), "resumed")
+                    futures = [
+                        self._chunk_executor.submit(self._fetch_range, job, client, file, partial, index, start, end)
+                        for index, start, end in partial.chunks()
+                    ]
+                    _wait_all(futures, job)
+                finally:
+                    partial.close()
+                part_path, state_path = partial.path, partial.state_path
+
+            check_git = expected is None and file["blob_id"] is not None
+            sha256, blob_id = file_digests(part_path, git_blob=check_git)
+            if (expected and sha256 != expected) or (check_git and blob_id != file["blob_id"]):
+                _remove_files(part_path, state_path)
+                raise DownloadError(f"Checksum mismatch for {name}")
+
+            blob_path = self._blob_path(sha256)
+            if os.path.isfile(blob_path):
+                # Same content as a file already stored under another name or model
+                _remove_files(part_path, state_path)
+            else:
+                os.replace(part_path, blob_path)
+                _remove_files(state_path)
+        job.file_done(name)
+        return sha256
+
+    def _fetch_whole(self, job: DownloadJob, client: httpx.Client, file: Dict[str, Any], path: str):
+        """Fetch a file of unknown size in one request; an interrupted transfer starts over"""
+        failures = 0
+        while True:
+            try:
+                with open(path, "wb") as f, client.stream("GET", file["url"]) as response:
+                    if response.status_code in RETRYABLE_STATUS:
+                        raise _TransferInterrupted(f"HTTP {response.status_code}")
+                    response.raise_for_status()
+                    for data in response.iter_bytes():
+                        f.write(data)
+                        if self._stopping.is_set() or job.aborted.is_set():
+                            raise _TransferStopped("Download stopped")
+                break
+            except (httpx.TransportError, _TransferInterrupted) as e:
+                failures += 1
+                if failures > self.retries or self._stopping.is_set() or job.aborted.is_set():
+                    raise DownloadError(f"Fetching {file['name']} failed after {failures} attempts: {e}") from e
+                delay = min(self.backoff * 2 ** (failures - 1), 30) * random.uniform(0.5, 1.0)
+                logger.warning(f"Fetching {file['name']} failed ({e}); starting over in {delay:.1f}s")
+                time.sleep(delay)
+
+        file["size"] = os.path.getsize(path)
+        job.set_size(file["name"], file["size"])
+        job.add(file["name"], file["size"])
+
+    def _fetch_range(self, job: DownloadJob, client: httpx.Client, file: Dict[str, Any],
+                     partial: _PartialFile, index: int, start: int, end: int):
+        """Fetch bytes start..end of a file into its partial, continuing after dropped connections"""
+        failures = 0
+        while True:
+            position = start + partial.done.get(index, 0)
+            if position > end:
+                return
+            try:
+                with client.stream("GET", file["url"], headers={"Range": f"bytes={position}-{end}"}) as response:
+                    if response.status_code in RETRYABLE_STATUS:
+                        raise _TransferInterrupted(f"HTTP {response.status_code}")
+                    response.raise_for_status()
+                    if response.status_code != 206 and (position, end) != (0, file["size"] - 1):
+                        raise DownloadError(f"{self.hub_url} ignored a range request for {file['name']}")
+                    # Unbuffered, so whatever arrives before a connection drops is kept
+                    for data in response.iter_bytes():
+                        data = data[:end + 1 - position]
+                        if not data:
+                            break
+                        partial.write(index, start, position, data)
+                        position += len(data)
+                        job.add(file["name"], len(data))
+                        # Only consecutive failures without progress count towards the retry limit
+                        failures = 0
+                        if self._stopping.is_set() or job.aborted.is_set():
+                            raise _TransferStopped("Download stopped")
+                if position <= end:
+                    raise _TransferInterrupted("connection closed early")
+                return
+            except (httpx.TransportError, _TransferInterrupted) as e:
+                failures += 1
+                if failures > self.retries or self._stopping.is_set() or job.aborted.is_set():
+                    raise DownloadError(f"Fetching {file['name']} failed after {failures} attempts: {e}") from e
+                delay = min(self.backoff * 2 ** (failures - 1), 30) * random.uniform(0.5, 1.0)
+                logger.warning(f"Fetching {file['name']} interrupted at byte {position} ({e}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _link_snapshot(self, model_id: str, blobs: Dict[str, str]):
+        """Point the model's snapshot directory at its blobs, replacing files from older revisions"""
+        snapshot = self.snapshot_path(model_id)
+        for name, sha256 in blobs.items():
+            target = os.path.join(snapshot, name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp_path = f"{target}.tmp"
+            if os.path.lexists(tmp_path):
+                os.remove(tmp_path)
+            try:
+                os.link(self._blob_path(sha256), tmp_path)
+            except OSError:
+                # Filesystems without hard links still share the blob
+                os.symlink(self._blob_path(sha256), tmp_path)
+            os.replace(tmp_path, target)
+
+        for root, _, names in os.walk(snapshot):
+            for filename in names:
+                path = os.path.join(root, filename)
+                if os.path.relpath(path, snapshot).replace(os.sep, "/") not in blobs:
+                    os.remove(path)
+
+
+model_store = ModelStore()
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# Tests import modules the way the API does, from the backend directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep module-level globals (db, notification outbox) off the working copy's database
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}")
@@ -0,0 +1,142 @@
+import asyncio
+from contextlib import nullcontext
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("peft")
+
+from api.batching import ContinuousBatchScheduler
+from api.inference import format_prompt
+
+VOCAB = 256
+
+
+class ByteTokenizer:
+    pad_token_id = 0
+    eos_token_id = None
+
+    def __call__(self, text, truncation=True, max_length=None):
+        ids = list(text.encode("utf-8"))
+        return {"input_ids": ids[:max_length] if truncation and max_length else ids}
+
+    def decode(self, token_ids, skip_special_tokens=True):
+        return bytes(token_ids).decode("utf-8", errors="replace")
+
+
+class StubModel:
+    """Predicts a letter from the sum of every token it can attend to.
+
+    The KV cache holds the token ids themselves, so a misaligned cache, a wrong
+    attention mask or a row mixed up with another changes the output.
+    """
+    device = torch.device("cpu")
+    config = SimpleNamespace()
+
+    def __init__(self):
+        self.fail_on = None
+
+    def __call__(self, input_ids, attention_mask, position_ids, past_key_values, use_cache):
+        if self.fail_on is not None and self.fail_on in input_ids.flatten().tolist():
+            raise RuntimeError("out of memory")
+        length = input_ids.shape[1]
+        keys = input_ids.float()[:, None, :, None]
+        if past_key_values is not None:
+            keys = torch.cat([past_key_values[0][0], keys], dim=2)
+        assert keys.shape[2] == attention_mask.shape[1]
+
+        totals = (keys[:, 0, :, 0] * attention_mask).cumsum(-1)[:, -length:].long()
+        logits = torch.nn.functional.one_hot(ord("a") + totals % 26, VOCAB).float()
+        return SimpleNamespace(logits=logits, past_key_values=((keys, keys.clone()),))
+
+
+def expected(prompt: str, count: int) -> str:
+    tokens = list(format_prompt(prompt).encode("utf-8"))
+    for _ in range(count):
+        tokens.append(ord("a") + sum(tokens) % 26)
+    return bytes(tokens[-count:]).decode()
+
+
+def make_scheduler(**kwargs) -> ContinuousBatchScheduler:
+    model = StubModel()
+    inference = SimpleNamespace(model=model, tokenizer=ByteTokenizer(), activate=nullcontext)
+    return ContinuousBatchScheduler(inference, **kwargs)
+
+
+def test_concurrent_requests_share_one_prefill():
+    scheduler = make_scheduler(max_batch_size=4, max_wait_ms=500)
+    prompts = ["short", "a somewhat longer prompt", "mid length"]
+
+    async def scenario():
+        return await asyncio.gather(*[
+            scheduler.submit(prompt, max_new_tokens=4 + i, temperature=0.0) for i, prompt in enumerate(prompts)
+        ])
+
+    try:
+        results = asyncio.run(scenario())
+    finally:
+        scheduler.stop()
+
+    assert scheduler.stats["prefill_batches"] == 1
+    assert scheduler.stats["max_batch_size_seen"] == 3
+    for i, (prompt, result) in enumerate(zip(prompts, results)):
+        assert result["text"] == expected(prompt, 4 + i)
+        assert result["completion_tokens"] == 4 + i
+        assert result["stop_reason"] == "length"
+
+
+def test_sequences_join_and_retire_at_token_boundaries():
+    scheduler = make_scheduler(max_batch_size=4)
+    # Drive the worker's steps by hand instead of from its thread
+    scheduler.start = lambda: None
+
+    async def scenario():
+        a = scheduler._enqueue("first", 512, 2, 0.0)
+        b = scheduler._enqueue("the second prompt", 512, 5, 0.0)
+        scheduler._admit(scheduler._drain(4))
+        assert scheduler._active == [a, b]
+
+        scheduler._step()
+        assert scheduler._active == [b]
+
+        # Joins mid-decode, with a different cache length and the template prefix cached
+        c = scheduler._enqueue("third", 512, 3, 0.0)
+        scheduler._admit(scheduler._drain(4))
+        assert scheduler._active == [b, c]
+        assert scheduler.prefix_cache.stats["hits"] == 1
+
+        scheduler._step()
+        scheduler._step()
+        assert scheduler._active == [b]
+        scheduler._step()
+        assert scheduler._active == []
+        return await asyncio.gather(a.future, b.future, c.future)
+
+    results = asyncio.run(scenario())
+    assert [result["text"] for result in results] == [
+        expected("first", 2), expected("the second prompt", 5), expected("third", 3)
+    ]
+
+
+def test_failed_prefill_only_fails_the_new_requests():
+    scheduler = make_scheduler(max_batch_size=4)
+    scheduler.start = lambda: None
+
+    async def scenario():
+        running = scheduler._enqueue("keeps going", 512, 3, 0.0)
+        scheduler._admit(scheduler._drain(4))
+
+        scheduler.inference.model.fail_on = ord("!")
+        failing = scheduler._enqueue("boom!", 512, 3, 0.0)
+        scheduler._admit(scheduler._drain(4))
+        assert scheduler._active == [running]
+
+        while scheduler._active:
+            scheduler._step()
+        with pytest.raises(RuntimeError, match="out of memory"):
+            await failing.future
+        return await running.future
+
+    assert asyncio.run(scenario())["text"] == expected("keeps going", 3)
@@ -0,0 +1,71 @@
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+from db import database as database_module
+from db.database import MIGRATIONS, Database
+
+COMMITTED_DATABASE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "training_system.db")
+
+
+def user_version(path) -> int:
+    conn = sqlite3.connect(str(path))
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_migrate_applies_every_migration_once(tmp_path):
+    path = tmp_path / "app.db"
+    Database(str(path)).migrate()
+    assert user_version(path) == MIGRATIONS[-1][0]
+
+    # Running again on an up-to-date database is a no-op
+    Database(str(path)).migrate()
+    assert user_version(path) == MIGRATIONS[-1][0]
+
+
+def test_failed_migration_leaves_no_partial_schema(tmp_path, monkeypatch):
+    path = tmp_path / "app.db"
+    Database(str(path)).migrate()
+    latest = MIGRATIONS[-1][0]
+
+    broken = (latest + 1, "broken", ["CREATE TABLE half_done (id INTEGER)", "ALTER TABLE missing ADD COLUMN x"])
+    monkeypatch.setattr(database_module, "MIGRATIONS", MIGRATIONS + [broken])
+    with pytest.raises(sqlite3.OperationalError):
+        Database(str(path)).migrate()
+
+    conn = sqlite3.connect(str(path))
+    try:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    finally:
+        conn.close()
+    assert "half_done" not in tables
+    assert user_version(path) == latest
+
+
+def test_migrate_upgrades_the_committed_database(tmp_path):
+    path = tmp_path / "training_system.db"
+    shutil.copy(COMMITTED_DATABASE, path)
+    conn = sqlite3.connect(str(path))
+    try:
+        jobs_before = conn.execute("SELECT COUNT(*) FROM training_jobs").fetchone()[0]
+    finally:
+        conn.close()
+
+    Database(str(path)).migrate()
+
+    assert user_version(path) == MIGRATIONS[-1][0]
+    conn = sqlite3.connect(str(path))
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM training_jobs").fetchone()[0] == jobs_before
+        # Trigger-maintained counters start out in step with the existing rows
+        counted_jobs = conn.execute(
+            "SELECT COALESCE(SUM(value), 0) FROM dashboard_counters WHERE name LIKE 'jobs:%'"
+        ).fetchone()[0]
+    finally:
+        conn.close()
+    assert counted_jobs == jobs_before
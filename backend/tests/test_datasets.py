@@ -0,0 +1,87 @@
+import asyncio
+import csv
+import hashlib
+
+import pytest
+
+from storage.datasets import DatasetValidationError, RowValidator, ingest_stream
+
+
+def validate(extension: str, data: bytes, chunk_size: int = 3) -> RowValidator:
+    validator = RowValidator(extension)
+    for start in range(0, len(data), chunk_size):
+        validator.feed(data[start:start + chunk_size])
+    validator.finish()
+    return validator
+
+
+def test_csv_header_with_byte_order_mark():
+    data = "\ufeffinstruction,output\nsay hi,hi\n".encode("utf-8")
+    # One byte at a time splits the BOM itself across chunks
+    assert validate(".csv", data, chunk_size=1).rows == 1
+
+
+def test_jsonl_with_byte_order_mark():
+    data = '\ufeff{"instruction": "a", "output": "b"}\n'.encode("utf-8")
+    assert validate(".jsonl", data).rows == 1
+
+
+def test_csv_quoted_fields_may_span_lines_and_chunks():
+    data = b'instruction,output\n"line one\nline two","a, b"\nplain,row\n'
+    assert validate(".csv", data, chunk_size=5).rows == 2
+
+
+def test_multi_byte_characters_split_across_chunks():
+    data = '{"instruction": "caf\u00e9 \u2713", "output": "ok"}\n'.encode("utf-8")
+    assert validate(".jsonl", data, chunk_size=1).rows == 1
+
+
+@pytest.mark.parametrize("extension, data, line, message", [
+    (".jsonl", b'{"instruction": "a", "output": "b"}\n{"instruction": "a"}\n', 2, "Missing field(s): output"),
+    (".jsonl", b'{"instruction": "a", "output": "b"}\n\nnot json\n', 3, "Invalid JSON"),
+    (".jsonl", b'["a", "b"]\n', 1, "must be a JSON object"),
+    (".csv", b"instruction,answer\nq,a\n", 1, "Missing column(s): output"),
+    (".csv", b"instruction,output\nq,a,extra\n", 2, "Expected 2 fields, found 3"),
+    (".csv", b'instruction,output\n"never closed,a\n', 2, "Unterminated quoted CSV field"),
+    (".jsonl", b'{"instruction": "\xff", "output": "b"}\n', 1, "not valid UTF-8"),
+])
+def test_malformed_rows_report_their_line(extension, data, line, message):
+    with pytest.raises(DatasetValidationError) as error:
+        validate(extension, data)
+    assert error.value.line == line
+    assert message in str(error.value)
+
+
+def test_empty_dataset_is_rejected():
+    with pytest.raises(DatasetValidationError, match="no rows"):
+        validate(".csv", b"instruction,output\n")
+
+
+def ingest(tmp_path, data: bytes, filename: str, chunk_size: int = 1) -> dict:
+    async def chunks():
+        for start in range(0, len(data), chunk_size):
+            yield data[start:start + chunk_size]
+
+    return asyncio.run(ingest_stream(chunks(), filename, storage_dir=str(tmp_path)))
+
+
+def test_stored_blob_drops_the_byte_order_mark(tmp_path):
+    text = "instruction,output\nsay hi,hi\n"
+    stored = ingest(tmp_path, ("\ufeff" + text).encode("utf-8"), "data.csv")
+
+    # The training loader reads blobs as plain UTF-8
+    with open(stored["file_path"], encoding="utf-8", newline="") as f:
+        assert list(csv.DictReader(f)) == [{"instruction": "say hi", "output": "hi"}]
+    assert stored["sha256"] == hashlib.sha256(text.encode("utf-8")).hexdigest()
+    assert stored["size"] == len(text)
+
+    # The same rows uploaded without a BOM share the blob
+    assert ingest(tmp_path, text.encode("utf-8"), "copy.csv", chunk_size=7)["deduplicated"]
+
+
+def test_leading_bytes_that_only_resemble_a_bom_are_kept(tmp_path):
+    # A fullwidth "A" encodes to EF BC A1, which shares its first byte with a BOM
+    data = "\uff21,instruction,output\nx,say hi,hi\n".encode("utf-8")
+    stored = ingest(tmp_path, data, "data.csv")
+    with open(stored["file_path"], "rb") as f:
+        assert f.read() == data
@@ -0,0 +1,65 @@
+from api.detokenize import IncrementalDecoder, StopSequences
+
+
+class ByteTokenizer:
+    """Every token is one UTF-8 byte, so multi-byte characters span several tokens"""
+
+    def encode(self, text: str):
+        return list(text.encode("utf-8"))
+
+    def decode(self, token_ids, skip_special_tokens=True):
+        return bytes(token_ids).decode("utf-8", errors="replace")
+
+
+def run(stop: StopSequences, text: str):
+    """Deltas released while pushing text token by token, then the flushed tail"""
+    deltas = [stop.push(token) for token in ByteTokenizer().encode(text)]
+    return [delta for delta in deltas if delta], stop.flush()
+
+
+def test_incremental_decoder_holds_back_partial_characters():
+    decoder = IncrementalDecoder(ByteTokenizer())
+    deltas = [decoder.push(token) for token in ByteTokenizer().encode("héllo ✓")]
+
+    assert "".join(deltas) == "héllo ✓"
+    assert all("\ufffd" not in delta for delta in deltas)
+    # The three bytes of the check mark only produce text with the last one
+    assert deltas[-3:] == ["", "", "✓"]
+
+
+def test_stop_sequence_truncates_and_is_never_released():
+    stop = StopSequences(ByteTokenizer(), stop=["###"])
+    deltas, tail = run(stop, "answer ## still ### ignored")
+
+    assert "".join(deltas) + tail == "answer ## still "
+    assert stop.reason == "stop_sequence"
+    assert stop.text == "answer ## still "
+
+
+def test_possible_stop_prefix_is_held_until_ruled_out():
+    stop = StopSequences(ByteTokenizer(), stop=["END"])
+    tokenizer = ByteTokenizer()
+
+    assert [stop.push(token) for token in tokenizer.encode("aE")] == ["a", ""]
+    assert stop.push(tokenizer.encode("N")[0]) == ""
+    # "ENx" cannot become "END" anymore, so all of it is released at once
+    assert stop.push(tokenizer.encode("x")[0]) == "ENx"
+    assert stop.reason is None
+
+
+def test_stop_token_ends_generation_and_flushes():
+    tokenizer = ByteTokenizer()
+    stop = StopSequences(tokenizer, stop=["zz"], stop_token_ids=[0])
+
+    assert stop.push(tokenizer.encode("z")[0]) == ""
+    assert stop.push(0) == "z"
+    assert stop.reason == "stop_token"
+    # Nothing after the stop is decoded
+    assert stop.push(tokenizer.encode("a")[0]) == ""
+    assert stop.text == "z"
+
+
+def test_without_stops_every_token_is_released():
+    deltas, tail = run(StopSequences(ByteTokenizer()), "plain text")
+    assert "".join(deltas) == "plain text"
+    assert tail == ""
@@ -0,0 +1,37 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Same budget as the benchmark suite's --import-budget default
+IMPORT_BUDGET_SECONDS = 1.0
+ML_MODULES = ("torch", "transformers", "peft", "datasets", "accelerate")
+
+
+def import_main(tmp_path):
+    code = (
+        "import json, sys, time; sys.path.insert(0, sys.argv[1]); started = time.perf_counter(); "
+        "import main; elapsed = time.perf_counter() - started; "
+        "print(json.dumps({'seconds': elapsed, 'modules': sorted(sys.modules)}))"
+    )
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{tmp_path / 'import.db'}"}
+    output = subprocess.run(
+        [sys.executable, "-c", code, BACKEND_DIR],
+        cwd=tmp_path, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def test_api_imports_without_the_ml_stack_within_budget(tmp_path):
+    # The first run also writes bytecode caches, so time the fastest of a few
+    runs = [import_main(tmp_path) for _ in range(3)]
+
+    loaded = [name for name in ML_MODULES if name in runs[0]["modules"]]
+    assert not loaded, f"Importing main loaded the ML stack: {', '.join(loaded)}"
+    seconds = min(run["seconds"] for run in runs)
+    assert seconds < IMPORT_BUDGET_SECONDS, f"Importing main took {seconds:.3f}s"
@@ -0,0 +1,80 @@
+import pytest
+
+from db.database import Database
+from db.listing import Listing, ListingError
+
+JOBS = Listing(
+    "training_jobs",
+    fields={"id": "id", "status": "status", "start_time": "start_time"},
+    sort="start_time",
+    filters={"status": "status"},
+)
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = Database(str(tmp_path / "listing.db"))
+    database.migrate()
+    with database.connection() as conn:
+        conn.executemany(
+            "INSERT INTO training_jobs (id, model_id, status, start_time) VALUES (?, 'gpt2', ?, ?)",
+            [
+                (f"job-{i:02d}", "completed" if i % 2 else "failed",
+                 # Two jobs share every timestamp, and queued jobs have not started yet
+                 f"2024-01-01 00:00:{i // 2:02d}" if i < 20 else None)
+                for i in range(25)
+            ],
+        )
+    return database
+
+
+def all_pages(conn, **params):
+    rows, cursor = [], None
+    while True:
+        page = JOBS.page(conn, cursor=cursor, **params)
+        rows += page.rows
+        cursor = page.next_cursor
+        if cursor is None:
+            return rows
+
+
+def test_cursor_walks_every_row_once_newest_first(database):
+    with database.connection() as conn:
+        rows = all_pages(conn, limit=4)
+        expected = conn.execute(
+            "SELECT id FROM training_jobs ORDER BY start_time DESC, id DESC"
+        ).fetchall()
+
+    assert [row["id"] for row in rows] == [row[0] for row in expected]
+    # Rows without a start time come last
+    assert [row["start_time"] for row in rows[-5:]] == [None] * 5
+
+
+def test_filters_apply_across_pages(database):
+    with database.connection() as conn:
+        rows = all_pages(conn, limit=3, status="failed", fields="id,status")
+
+    assert len(rows) == 13
+    assert all(set(row) == {"id", "status"} and row["status"] == "failed" for row in rows)
+
+
+def test_etag_round_trip(database):
+    with database.connection() as conn:
+        first = JOBS.page(conn, limit=5)
+        assert JOBS.page(conn, limit=5, if_none_match=first.etag).not_modified
+        # Another query has its own ETag
+        assert not JOBS.page(conn, limit=6, if_none_match=first.etag).not_modified
+
+    with database.connection() as conn:
+        conn.execute("UPDATE training_jobs SET status = 'running' WHERE id = 'job-00'")
+
+    with database.connection() as conn:
+        changed = JOBS.page(conn, limit=5, if_none_match=first.etag)
+    assert not changed.not_modified
+    assert changed.etag != first.etag
+
+
+def test_malformed_cursor_is_rejected(database):
+    with database.connection() as conn:
+        with pytest.raises(ListingError):
+            JOBS.page(conn, cursor="not-a-cursor")
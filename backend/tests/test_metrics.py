@@ -0,0 +1,85 @@
+import pytest
+
+from monitoring.metrics import Histogram, Registry, drain_histograms, merge_histograms, registry
+
+
+def test_render_matches_the_exposition_format():
+    metrics = Registry()
+    latency = metrics.histogram("request_seconds", "Latency\nby route", (0.1, 1.0), ("route",))
+    metrics.gauge("queue_depth", "Queued jobs", ("queue",), fn=lambda: {("a\\b",): 3})
+
+    child = latency.labels('say "hi"\n')
+    for value in (0.05, 1.0, 4.0):
+        child.observe(value)
+
+    assert metrics.render() == "\n".join([
+        "# HELP request_seconds Latency\\nby route",
+        "# TYPE request_seconds histogram",
+        'request_seconds_bucket{route="say \\"hi\\"\\n",le="0.1"} 1',
+        # Bounds are inclusive, and every bucket counts the ones below it
+        'request_seconds_bucket{route="say \\"hi\\"\\n",le="1.0"} 2',
+        'request_seconds_bucket{route="say \\"hi\\"\\n",le="+Inf"} 3',
+        'request_seconds_sum{route="say \\"hi\\"\\n"} 5.05',
+        'request_seconds_count{route="say \\"hi\\"\\n"} 3',
+        "# HELP queue_depth Queued jobs",
+        "# TYPE queue_depth gauge",
+        'queue_depth{queue="a\\\\b"} 3',
+    ]) + "\n"
+
+
+def test_unlabelled_histogram_renders_without_braces():
+    histogram = Histogram("step_seconds", "Step time", (1,))
+    histogram.observe(2)
+    assert histogram.render()[2:] == [
+        'step_seconds_bucket{le="1.0"} 0',
+        'step_seconds_bucket{le="+Inf"} 1',
+        "step_seconds_sum 2.0",
+        "step_seconds_count 1",
+    ]
+
+
+def test_drained_deltas_merge_into_the_registry_histogram():
+    name = "test_worker_step_seconds"
+    target = registry.histogram(name, "Step time in the API process", (1.0, 10.0))
+    worker = Histogram(name, "Step time in a worker", (1.0, 10.0))
+    try:
+        for value in (0.5, 5.0, 50.0):
+            worker.observe(value)
+        snapshot = drain_histograms([worker])
+        assert snapshot == {name: ([1, 1, 1], 55.5, 3)}
+        # Draining resets, so the next drain only carries new samples
+        assert drain_histograms([worker]) == {}
+
+        merge_histograms(snapshot)
+        merge_histograms(snapshot)
+        assert target.render()[2:] == [
+            f'{name}_bucket{{le="1.0"}} 2',
+            f'{name}_bucket{{le="10.0"}} 4',
+            f'{name}_bucket{{le="+Inf"}} 6',
+            f"{name}_sum 111.0",
+            f"{name}_count 6",
+        ]
+        # Snapshots for metrics this process does not know are ignored
+        merge_histograms({"unknown_seconds": ([1, 0, 0], 0.5, 1)})
+    finally:
+        registry.metrics.pop(name)
+
+
+def test_label_sets_past_the_cap_share_one_series():
+    histogram = Histogram("request_seconds", "Latency", (1.0,), ("route", "method"), max_label_sets=3)
+    for i in range(10):
+        histogram.labels(f"/items/{i}", "GET").observe(0.5)
+    # Known label sets keep their own series
+    histogram.labels("/items/0", "GET").observe(0.5)
+
+    assert list(histogram._children) == [
+        ("/items/0", "GET"), ("/items/1", "GET"), ("/items/2", "GET"), ("other", "other")
+    ]
+    assert histogram.labels("/items/0", "GET").count == 2
+    assert histogram.labels("other", "other").count == 7
+
+
+def test_labels_must_match_the_label_names():
+    histogram = Histogram("request_seconds", "Latency", (1.0,), ("route", "method"))
+    with pytest.raises(ValueError):
+        histogram.labels("/items")
@@ -0,0 +1,164 @@
+import json
+import os
+import threading
+
+import pytest
+
+from api.model_cache import ModelCache
+
+
+class FakeModel:
+    def __init__(self, path: str):
+        self.path = path
+        self.adapters = set()
+
+    def load_adapter(self, adapter_id: str, path: str):
+        self.adapters.add(adapter_id)
+
+    def unload_adapter(self, adapter_id: str):
+        self.adapters.discard(adapter_id)
+
+
+class FakeAdapter:
+    def __init__(self, base: FakeModel, adapter_id: str):
+        self.base = base
+        self.adapter_id = adapter_id
+
+
+class FakeCache(ModelCache):
+    """Loads stand-ins whose size is the size of their weight files"""
+
+    def __init__(self, max_bytes: int, max_adapters: int = 16):
+        super().__init__(max_bytes=max_bytes, max_adapters=max_adapters)
+        self.loaded_paths = []
+        self.fail = set()
+        self.gate = None
+
+    def _load_model(self, model_path: str):
+        if self.gate is not None:
+            self.gate.wait(timeout=5)
+        if os.path.basename(model_path) in self.fail:
+            raise RuntimeError(f"cannot load {model_path}")
+        self.loaded_paths.append(model_path)
+        return FakeModel(model_path), os.path.getsize(os.path.join(model_path, "model.safetensors"))
+
+    def _attach_adapter(self, base, model_id: str, model_path: str):
+        if model_id in self.fail:
+            raise RuntimeError(f"cannot attach {model_id}")
+        base.load_adapter(model_id, model_path)
+        return FakeAdapter(base, model_id)
+
+
+@pytest.fixture
+def models(tmp_path, monkeypatch):
+    """Creates outputs/<model_id> directories, as training writes them"""
+    monkeypatch.chdir(tmp_path)
+
+    def make(model_id: str, nbytes: int, base: str = None) -> str:
+        path = tmp_path / "outputs" / model_id
+        path.mkdir(parents=True)
+        (path / "model.safetensors").write_bytes(b"\0" * nbytes)
+        if base is not None:
+            (path / "adapter_config.json").write_text(json.dumps({"base_model_name_or_path": base}))
+        return str(path)
+
+    return make
+
+
+def test_pinned_models_are_never_evicted(models):
+    cache = FakeCache(max_bytes=150)
+    models("a", 100)
+    models("b", 100)
+
+    a = cache.acquire("a")
+    cache.acquire("b")
+    # Over budget, but both are serving requests
+    assert cache.loaded("a") and cache.loaded("b")
+
+    cache.release("a")
+    assert not cache.loaded("a")
+    assert cache.loaded("b")
+    assert cache.total_bytes == 100
+    assert a.path.endswith("a")
+
+
+def test_least_recently_used_model_is_evicted_to_fit(models):
+    cache = FakeCache(max_bytes=250)
+    for model_id in "abc":
+        models(model_id, 100)
+
+    cache.preload(["a", "b"])
+    # Touch "a" so "b" is the least recently used
+    cache.acquire("a")
+    cache.release("a")
+    cache.preload(["c"])
+
+    assert [cache.loaded(model_id) for model_id in "abc"] == [True, False, True]
+    assert cache.stats["evictions"] == 1
+    assert cache.total_bytes == 200
+
+
+def test_idle_adapters_are_evicted_before_their_busy_base(models):
+    base = models("base", 100)
+    cache = FakeCache(max_bytes=135)
+    for adapter_id in ("a1", "a2", "a3"):
+        models(adapter_id, 10, base=base)
+
+    serving = cache.acquire("a1")
+    cache.preload(["a2"])
+    cache.acquire("a3")
+    # 100 + 3 * 10 fits; a fourth adapter does not, and only a2 is idle
+    models("a4", 10, base=base)
+    cache.preload(["a4"])
+
+    assert not cache.loaded("a2")
+    assert cache.loaded("a1") and cache.loaded("a3") and cache.loaded(f"base:{base}")
+    assert "a2" not in serving.base.adapters
+    assert cache.stats["adapter_evictions"] >= 1
+    assert cache.stats["evictions"] == 0
+    assert cache.total_bytes <= 135
+
+
+def test_concurrent_first_requests_share_one_load(models):
+    models("a", 100)
+    cache = FakeCache(max_bytes=0)
+    cache.gate = threading.Event()
+    results = []
+
+    threads = [threading.Thread(target=lambda: results.append(cache.acquire("a"))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    cache.gate.set()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert len(results) == 4
+    assert all(result is results[0] for result in results)
+    assert len(cache.loaded_paths) == 1
+    assert cache._entries["a"].refcount == 4
+
+
+def test_failed_load_frees_the_loading_slot(models):
+    models("a", 100)
+    cache = FakeCache(max_bytes=0)
+    cache.fail.add("a")
+
+    with pytest.raises(RuntimeError):
+        cache.acquire("a")
+    assert not cache._loading
+
+    cache.fail.clear()
+    cache.acquire("a")
+    assert cache._entries["a"].refcount == 1
+
+
+def test_failed_adapter_attach_releases_its_base(models):
+    base = models("base", 100)
+    models("a1", 10, base=base)
+    cache = FakeCache(max_bytes=0)
+    cache.fail.add("a1")
+
+    with pytest.raises(RuntimeError):
+        cache.acquire("a1")
+    assert cache._entries[f"base:{base}"].refcount == 0
+    assert not cache._loading
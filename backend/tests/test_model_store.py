@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import random
+
+import httpx
+import pytest
+
+from benchmarks.local_hub import LocalHub
+from storage.models import DownloadError, ModelStore
+
+CHUNK_SIZE = 256 * 1024
+# Above the hub's LFS threshold, so shards are listed with a sha256
+SHARD_BYTES = 1536 * 1024
+
+
+@pytest.fixture
+def hub(tmp_path):
+    """Two repos sharing their first shard, each with a .bin copy the store should skip"""
+    rng = random.Random(0)
+    shared = rng.randbytes(SHARD_BYTES)
+    for name in ("test/model-a", "test/model-b"):
+        repo = tmp_path / "hub" / name
+        repo.mkdir(parents=True)
+        shards = [shared, rng.randbytes(SHARD_BYTES)]
+        for i, data in enumerate(shards, start=1):
+            (repo / f"model-{i:05d}-of-00002.safetensors").write_bytes(data)
+        (repo / "pytorch_model.bin").write_bytes(b"".join(shards))
+        (repo / "config.json").write_text(json.dumps({"model_type": "gpt2", "name": name}))
+
+    hub = LocalHub(str(tmp_path / "hub")).start()
+    yield hub
+    hub.stop()
+
+
+def new_store(root, hub_url: str, **kwargs) -> ModelStore:
+    return ModelStore(str(root), hub_url, token="", chunk_size=CHUNK_SIZE, backoff=0.01, **kwargs)
+
+
+def test_download_stores_each_distinct_file_once(tmp_path, hub):
+    store = new_store(tmp_path / "store", hub.url)
+    try:
+        first = store.download("model-a", "test/model-a").result()
+        hub.reset_counters()
+        store.download("model-b", "test/model-b").result()
+        progress = store.progress("model-b")
+    finally:
+        store.shutdown()
+
+    assert sorted(f["name"] for f in first["files"]) == [
+        "config.json", "model-00001-of-00002.safetensors", "model-00002-of-00002.safetensors"
+    ]
+    # The shared shard is linked from the store, not fetched again
+    assert progress["reused_bytes"] == SHARD_BYTES
+    assert hub.bytes_sent < 2 * SHARD_BYTES
+    assert len(os.listdir(tmp_path / "store" / "blobs")) == 5
+
+    for f in first["files"]:
+        with open(os.path.join(store.path("model-a"), f["name"]), "rb") as stored:
+            data = stored.read()
+        assert data == (tmp_path / "hub" / "test/model-a" / f["name"]).read_bytes()
+        assert hashlib.sha256(data).hexdigest() == f["sha256"]
+
+
+def test_interrupted_download_resumes_from_partial_files(tmp_path, hub):
+    hub.link_budget = SHARD_BYTES
+    # One transfer at a time, so the link drops inside a shard rather than between requests
+    interrupted = new_store(tmp_path / "store", hub.url, retries=0, workers=1)
+    try:
+        with pytest.raises(DownloadError):
+            interrupted.download("model-a", "test/model-a").result()
+        assert not interrupted.is_downloaded("model-a")
+    finally:
+        interrupted.shutdown()
+
+    hub.link_budget = None
+    hub.reset_counters()
+    store = new_store(tmp_path / "store", hub.url)
+    try:
+        manifest = store.download("model-a", "test/model-a").result()
+        progress = store.progress("model-a")
+    finally:
+        store.shutdown()
+
+    assert progress["resumed_bytes"] > 0
+    assert progress["downloaded_bytes"] + progress["resumed_bytes"] == manifest["total_bytes"]
+    assert hub.bytes_sent < manifest["total_bytes"]
+    assert os.listdir(tmp_path / "store" / "partial") == []
+
+
+def test_checksum_mismatch_fails_the_download(tmp_path, hub):
+    # The hub keeps its first listing, so the file changes under a published checksum
+    listing = hub.listing("test/model-a")
+    published = next(s["lfs"]["sha256"] for s in listing if s["rfilename"] == "model-00002-of-00002.safetensors")
+    shard = tmp_path / "hub" / "test/model-a" / "model-00002-of-00002.safetensors"
+    shard.write_bytes(b"\0" * SHARD_BYTES)
+
+    store = new_store(tmp_path / "store", hub.url)
+    try:
+        with pytest.raises(DownloadError, match="Checksum mismatch"):
+            store.download("model-a", "test/model-a").result()
+    finally:
+        store.shutdown()
+    assert not store.is_downloaded("model-a")
+    # The bad bytes are dropped rather than resumed next time
+    assert not os.path.exists(tmp_path / "store" / "partial" / f"{published}.part")
+
+
+def test_file_without_a_reported_size_is_fetched_whole(tmp_path):
+    data = json.dumps({"model_type": "gpt2"}).encode()
+    blob_id = hashlib.sha1(f"blob {len(data)}\0".encode() + data).hexdigest()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.startswith("/api/models/"):
+            return httpx.Response(200, json={"sha": "0" * 40, "siblings": [{"rfilename": "config.json", "blobId": blob_id}]})
+        if request.method == "HEAD":
+            # No Content-Length, as some redirects answer
+            return httpx.Response(200)
+        assert "range" not in request.headers
+        return httpx.Response(200, content=data)
+
+    store = new_store(tmp_path / "store", "http://hub.test")
+    store._client = httpx.Client(transport=httpx.MockTransport(handler))
+    try:
+        manifest = store.download("tiny", "test/tiny").result()
+    finally:
+        store.shutdown()
+
+    assert manifest["files"][0]["size"] == len(data)
+    assert manifest["total_bytes"] == len(data)
+    assert store.progress("tiny")["progress"] == 1.0
+    with open(os.path.join(store.path("tiny"), "config.json"), "rb") as f:
+        assert f.read() == data
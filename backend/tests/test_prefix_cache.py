@@ -0,0 +1,61 @@
+from api.prefix_cache import PrefixCache
+
+
+class FakeTensor:
+    def __init__(self, nbytes: int):
+        self.nbytes = nbytes
+
+    def numel(self) -> int:
+        return self.nbytes
+
+    def element_size(self) -> int:
+        return 1
+
+
+def past(nbytes: int):
+    """One layer of key/value stand-ins holding nbytes in total"""
+    return ((FakeTensor(nbytes // 2), FakeTensor(nbytes // 2)),)
+
+
+def test_prefix_is_stored_after_repeated_sightings():
+    cache = PrefixCache(max_bytes=1000, block_size=4, min_sightings=2)
+    tokens = list(range(10))
+    hashes = cache.block_hashes(tokens)
+    # Blocks must leave at least one token to prefill
+    assert len(hashes) == 2
+
+    assert cache.observe(hashes, matched=0) is None
+    key, length = cache.observe(hashes, matched=0)
+    assert length == 8
+    cache.store(key, length, past(100))
+
+    assert cache.match(tokens, hashes)[0] == 8
+    # Only the longest prefix was stored, so sharing just the first block is a miss
+    other = tokens[:4] + [99] * 6
+    assert cache.match(other, cache.block_hashes(other)) == (0, None)
+
+
+def test_least_recently_used_prefix_is_evicted_first():
+    cache = PrefixCache(max_bytes=250, block_size=2, min_sightings=1)
+    prompts = {name: [ord(name)] * 3 for name in "abc"}
+    keys = {name: cache.block_hashes(tokens)[0] for name, tokens in prompts.items()}
+
+    cache.store(keys["a"], 2, past(100))
+    cache.store(keys["b"], 2, past(100))
+    # Touch "a" so "b" becomes the oldest entry
+    assert cache.match(prompts["a"], [keys["a"]])[0] == 2
+    cache.store(keys["c"], 2, past(100))
+
+    assert cache.match(prompts["b"], [keys["b"]])[0] == 0
+    assert cache.match(prompts["a"], [keys["a"]])[0] == 2
+    assert cache.match(prompts["c"], [keys["c"]])[0] == 2
+    assert cache.total_bytes == 200
+    assert cache.stats["evictions"] == 1
+
+
+def test_entry_larger_than_the_cache_is_not_stored():
+    cache = PrefixCache(max_bytes=50, block_size=2, min_sightings=1)
+    key = cache.block_hashes([1, 2, 3])[0]
+    cache.store(key, 2, past(100))
+    assert cache.metrics()["entries"] == 0
+    assert cache.total_bytes == 0
@@ -0,0 +1,113 @@
+from api import response_cache as response_cache_module
+from api.response_cache import ENTRY_OVERHEAD_BYTES, ResponseCache, is_deterministic, normalize_prompt
+
+GREEDY = {"temperature": 0.0, "seed": None}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def entry_bytes(prompt: str, text: str) -> int:
+    return ENTRY_OVERHEAD_BYTES + len(prompt.encode()) + len(text.encode())
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache_module.time, "monotonic", clock)
+    cache = ResponseCache(max_bytes=10_000, ttl=60)
+    key = cache.key("d1", "v1", "hello", GREEDY)
+    cache.put(key, {"text": "world"})
+
+    clock.now += 59
+    assert cache.get(key) == {"text": "world"}
+
+    clock.now += 2
+    assert cache.get(key) is None
+    assert cache.stats["expired"] == 1
+    assert cache.total_bytes == 0
+
+
+def test_least_recently_used_entries_are_evicted_to_fit_the_byte_budget():
+    size = entry_bytes("p0", "x" * 100)
+    cache = ResponseCache(max_bytes=3 * size, ttl=60)
+    keys = [cache.key("d1", "v1", f"p{i}", GREEDY) for i in range(4)]
+    for key in keys[:3]:
+        cache.put(key, {"text": "x" * 100})
+
+    # Touch p0 so p1 is the least recently used
+    assert cache.get(keys[0]) is not None
+    cache.put(keys[3], {"text": "x" * 100})
+
+    assert [cache.get(key) is not None for key in keys] == [True, False, True, True]
+    assert cache.stats["evictions"] == 1
+    assert cache.total_bytes == 3 * size
+
+
+def test_responses_larger_than_the_budget_are_not_stored():
+    cache = ResponseCache(max_bytes=ENTRY_OVERHEAD_BYTES + 10, ttl=60)
+    key = cache.key("d1", "v1", "hello", GREEDY)
+    cache.put(key, {"text": "far too long for the budget"})
+    assert cache.get(key) is None
+    assert cache.total_bytes == 0
+
+
+def test_invalidate_retires_only_that_deployments_entries():
+    cache = ResponseCache(max_bytes=10_000, ttl=60)
+    stale = cache.key("d1", "v1", "hello", GREEDY)
+    other = cache.key("d2", "v1", "hello", GREEDY)
+    cache.put(stale, {"text": "old"})
+    cache.put(other, {"text": "kept"})
+
+    cache.invalidate("d1")
+
+    fresh = cache.key("d1", "v1", "hello", GREEDY)
+    assert fresh != stale
+    assert cache.get(fresh) is None
+    assert cache.get(cache.key("d2", "v1", "hello", GREEDY)) == {"text": "kept"}
+
+
+def test_keys_depend_on_version_and_generation_parameters():
+    cache = ResponseCache(max_bytes=10_000, ttl=60)
+    key = cache.key("d1", "v1", "hello", {**GREEDY, "max_new_tokens": 16})
+    assert key != cache.key("d1", "v2", "hello", {**GREEDY, "max_new_tokens": 16})
+    assert key != cache.key("d1", "v1", "hello", {**GREEDY, "max_new_tokens": 32})
+    # Parameter order does not matter
+    assert key == cache.key("d1", "v1", "hello", {"max_new_tokens": 16, "seed": None, "temperature": 0.0})
+
+
+def test_equivalent_prompts_share_an_entry():
+    cache = ResponseCache(max_bytes=10_000, ttl=60)
+    cache.put(cache.key("d1", "v1", "caf\u00e9\r\nau lait", GREEDY), {"text": "yes"})
+
+    # Decomposed accent, Unix line ending and surrounding whitespace
+    assert cache.get(cache.key("d1", "v1", "  cafe\u0301\nau lait\n", GREEDY)) == {"text": "yes"}
+    assert normalize_prompt("cafe\u0301\r\n") == "caf\u00e9"
+    # Whitespace inside the prompt is significant
+    assert cache.get(cache.key("d1", "v1", "caf\u00e9  au lait", GREEDY)) is None
+
+
+def test_only_deterministic_requests_are_cacheable():
+    assert is_deterministic(0.0, None)
+    assert is_deterministic(-1.0, None)
+    assert is_deterministic(0.7, 42)
+    # Unseeded sampling gives a different completion every time
+    assert not is_deterministic(0.7, None)
+
+
+def test_metrics_are_reported_per_deployment():
+    cache = ResponseCache(max_bytes=10_000, ttl=60)
+    key = cache.key("d1", "v1", "hello", GREEDY)
+    cache.get(key)
+    cache.put(key, {"text": "world"})
+    cache.get(key)
+    cache.get(cache.key("d2", "v1", "hello", GREEDY))
+
+    assert cache.metrics("d1")["hits"] == 1
+    assert cache.metrics("d1")["hit_rate"] == 0.5
+    assert cache.metrics("d2")["misses"] == 1
+    assert cache.metrics()["misses"] == 2
@@ -0,0 +1,131 @@
+import asyncio
+from contextlib import nullcontext
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("peft")
+
+from api.inference import format_prompt
+from api.speculative import SpeculativeDecoder, SpeculativeScheduler, _KVState
+
+VOCAB = 256
+
+
+class ByteTokenizer:
+    pad_token_id = 0
+    eos_token_id = None
+
+    def __call__(self, text, truncation=True, max_length=None):
+        ids = list(text.encode("utf-8"))
+        return {"input_ids": ids[:max_length] if truncation and max_length else ids}
+
+    def __len__(self):
+        return VOCAB
+
+    def get_vocab(self):
+        return {chr(i): i for i in range(VOCAB)}
+
+    def decode(self, token_ids, skip_special_tokens=True):
+        return bytes(token_ids).decode("utf-8", errors="replace")
+
+
+def target_rule(total: int) -> int:
+    return ord("a") + total % 26
+
+
+def draft_rule(total: int) -> int:
+    # Disagrees with the target about one time in three
+    return target_rule(total) + 1 if total % 3 == 0 else target_rule(total)
+
+
+class StubModel:
+    """Predicts the next token from the sum of every token before it.
+
+    The KV cache holds the token ids themselves, so positions left behind by a
+    bad rewind change the output.
+    """
+    device = torch.device("cpu")
+
+    def __init__(self, rule):
+        self.rule = rule
+        self.config = SimpleNamespace(vocab_size=VOCAB)
+
+    def __call__(self, input_ids, position_ids, past_key_values, use_cache):
+        length = input_ids.shape[1]
+        keys = input_ids.float()[:, None, :, None]
+        if past_key_values is not None:
+            keys = torch.cat([past_key_values[0][0], keys], dim=2)
+        # New positions continue right after the cached ones
+        assert position_ids[0].tolist() == list(range(keys.shape[2] - length, keys.shape[2]))
+
+        totals = keys[0, 0, :, 0].cumsum(-1)[-length:].long().tolist()
+        next_ids = torch.tensor([self.rule(total) for total in totals])
+        logits = torch.nn.functional.one_hot(next_ids, VOCAB).float()[None]
+        return SimpleNamespace(logits=logits, past_key_values=((keys, keys.clone()),))
+
+
+def inference(rule) -> SimpleNamespace:
+    return SimpleNamespace(model=StubModel(rule), tokenizer=ByteTokenizer(), activate=nullcontext)
+
+
+def plain_greedy(prompt_ids, count: int):
+    tokens = list(prompt_ids)
+    for _ in range(count):
+        tokens.append(target_rule(sum(tokens)))
+    return tokens[-count:]
+
+
+@pytest.mark.parametrize("num_draft_tokens", [0, 1, 3, 5])
+def test_greedy_speculation_matches_plain_decoding(num_draft_tokens):
+    prompt_ids = list(b"speculate")
+    decoder = SpeculativeDecoder(inference(target_rule), inference(draft_rule), num_draft_tokens)
+
+    assert list(decoder.generate(prompt_ids, 24)) == plain_greedy(prompt_ids, 24)
+    assert decoder.stats["tokens"] == 24
+    if num_draft_tokens > 1:
+        # Some proposals were rejected partway through a round, and rounds still saved passes
+        assert 0 < decoder.stats["accepted_tokens"] < decoder.stats["draft_tokens"]
+        assert decoder.stats["rounds"] < 24
+
+
+def test_rewind_drops_rejected_positions_from_the_cache():
+    state = _KVState(inference(target_rule))
+    state.forward([1, 2, 3, 4, 5])
+
+    state.rewind(3)
+    assert state.length == 3
+    assert all(tensor.shape[2] == 3 for layer in state.past for tensor in layer)
+    assert state.past[0][0][0, 0, :, 0].tolist() == [1, 2, 3]
+
+    # The next token only sees what was kept: 1 + 2 + 3 + 9
+    logits = state.forward([9])
+    assert int(logits[-1].argmax()) == target_rule(15)
+    assert state.length == 4
+
+    # Rewinding past the end is a no-op
+    state.rewind(10)
+    assert state.length == 4
+
+
+def test_scheduler_serves_requests_with_the_draft():
+    scheduler = SpeculativeScheduler(inference(target_rule), inference(draft_rule), num_draft_tokens=3)
+
+    async def scenario():
+        return await asyncio.gather(*[
+            scheduler.submit(prompt, max_new_tokens=10, temperature=0.0) for prompt in ("first", "second")
+        ])
+
+    try:
+        results = asyncio.run(scenario())
+    finally:
+        scheduler.stop()
+
+    for prompt, result in zip(("first", "second"), results):
+        expected = plain_greedy(list(format_prompt(prompt).encode("utf-8")), 10)
+        assert result["text"] == bytes(expected).decode()
+        assert result["completion_tokens"] == 10
+        assert result["stop_reason"] == "length"
+    assert scheduler.stats["speculative"]["accepted_tokens"] > 0
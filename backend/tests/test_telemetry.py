@@ -0,0 +1,44 @@
+import asyncio
+
+from training.telemetry import TelemetryBuffer
+
+
+def test_since_returns_the_delta_and_reports_evicted_steps():
+    buffer = TelemetryBuffer(maxlen=3)
+    for step in range(5):
+        buffer.append({"step": step, "loss": 1.0 / (step + 1)})
+    # A second log at the same step merges into its entry
+    buffer.append({"step": 4, "eval_loss": 0.5})
+
+    entries, truncated = buffer.since(2)
+    assert [entry["step"] for entry in entries] == [3, 4]
+    assert entries[-1]["eval_loss"] == 0.5
+    assert not truncated
+    assert buffer.since(0)[1]
+
+
+def test_update_while_subscriber_is_busy_is_not_missed():
+    buffer = TelemetryBuffer()
+
+    async def scenario():
+        version = buffer.version
+        assert buffer.since(-1) == ([], False)
+        # Lands while the subscriber is still sending what it read
+        buffer.append({"step": 0})
+        buffer.close("completed")
+        return await buffer.wait(version, timeout=5)
+
+    assert asyncio.run(scenario()) is True
+
+
+def test_wait_wakes_on_append_and_times_out_when_idle():
+    buffer = TelemetryBuffer()
+
+    async def scenario():
+        assert await buffer.wait(buffer.version, timeout=0.01) is False
+        waiter = asyncio.ensure_future(buffer.wait(buffer.version, timeout=5))
+        await asyncio.sleep(0)
+        buffer.append({"step": 0})
+        return await waiter
+
+    assert asyncio.run(scenario()) is True
@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("datasets")
+pytest.importorskip("peft")
+
+from training.trainer import AITrainer
+
+
+class WordTokenizer:
+    """One token per word, with ids from a growing vocabulary"""
+    eos_token_id = 0
+    pad_token_id = 0
+
+    def __init__(self):
+        self.vocab = {}
+
+    def __call__(self, texts, truncation=True, max_length=None):
+        input_ids = []
+        for text in texts:
+            ids = [self.vocab.setdefault(word, len(self.vocab) + 1) for word in text.split()]
+            input_ids.append(ids[:max_length] if truncation and max_length else ids)
+        return {"input_ids": input_ids, "attention_mask": [[1] * len(ids) for ids in input_ids]}
+
+
+def test_streaming_packing_yields_full_blocks(tmp_path):
+    path = tmp_path / "data.jsonl"
+    with open(path, "w") as f:
+        for i in range(50):
+            f.write(json.dumps({"instruction": f"say {i}", "output": " ".join(["word"] * (i % 7 + 1))}) + "\n")
+
+    trainer = AITrainer({"streaming": True, "packing": True, "max_length": 16, "shuffle_buffer_size": 8})
+    trainer.tokenizer = WordTokenizer()
+    trainer.load_dataset(str(path))
+
+    blocks = [block for _, block in zip(range(5), trainer.dataset)]
+    assert len(blocks) == 5
+    for block in blocks:
+        assert set(block) == {"input_ids", "labels", "position_ids"}
+        assert len(block["input_ids"]) == len(block["labels"]) == len(block["position_ids"]) == 16
+        # Documents restart positions and never predict across the boundary
+        for i, position in enumerate(block["position_ids"]):
+            if position == 0:
+                assert block["labels"][i] == -100
@@ -0,0 +1,104 @@
+import asyncio
+import sqlite3
+import time
+
+import training.scheduler as scheduler_module
+from db.database import Database
+from training.scheduler import TrainingScheduler
+
+
+class FakeProcess:
+    def __init__(self, alive: bool = True):
+        self.alive = alive
+        self.exitcode = None if alive else 0
+        self.pid = 1234
+        self.started = False
+
+    def is_alive(self):
+        return self.alive
+
+    def start(self):
+        self.started = True
+
+    def join(self, timeout=None):
+        pass
+
+    def kill(self):
+        self.alive = False
+
+
+class FakeContext:
+    """Stands in for the spawn context so launches do not start real workers"""
+
+    def __init__(self):
+        self.processes = []
+
+    def Process(self, **kwargs):
+        process = FakeProcess()
+        self.processes.append(process)
+        return process
+
+    def Event(self):
+        return asyncio.Event()
+
+
+class LockedDatabase:
+    async def execute(self, sql, params=()):
+        raise sqlite3.OperationalError("database is locked")
+
+
+def test_resume_waits_for_the_previous_worker(tmp_path, monkeypatch):
+    monkeypatch.setattr(scheduler_module, "notify_training_event", lambda *args, **kwargs: None)
+
+    async def scenario():
+        database = Database(str(tmp_path / "jobs.db"))
+        database.migrate()
+        scheduler = TrainingScheduler(database)
+        scheduler._ctx = FakeContext()
+        await database.execute(
+            "INSERT INTO training_jobs (id, model_id, status, queued_time) VALUES ('job-1', 'gpt2', 'stopped', CURRENT_TIMESTAMP)"
+        )
+
+        # Stopped on request, but the worker is still writing its final checkpoint
+        old_worker = FakeProcess()
+        scheduler._running["job-1"] = old_worker
+        scheduler._stop_deadlines["job-1"] = time.monotonic() + 60
+
+        assert await scheduler.resume("job-1")
+        assert not await scheduler._launch_next()
+        assert scheduler._running["job-1"] is old_worker
+        assert scheduler._ctx.processes == []
+
+        # Once the old worker has exited and been reaped, the job starts afresh
+        old_worker.alive = False
+        scheduler._results["job-1"] = {"type": "stopped"}
+        await scheduler._reap()
+        assert "job-1" not in scheduler._stop_deadlines
+
+        assert await scheduler._launch_next()
+        assert scheduler._running["job-1"] is scheduler._ctx.processes[0]
+        row = await database.fetchone("SELECT status FROM training_jobs WHERE id = 'job-1'")
+        assert row[0] == "running"
+
+    asyncio.run(scenario())
+
+
+def test_device_events_are_written_before_the_next_event(tmp_path):
+    async def scenario():
+        database = Database(str(tmp_path / "jobs.db"))
+        database.migrate()
+        scheduler = TrainingScheduler(database)
+        await database.execute(
+            "INSERT INTO training_jobs (id, model_id, status, queued_time) VALUES ('job-1', 'gpt2', 'running', CURRENT_TIMESTAMP)"
+        )
+
+        await scheduler._handle_event({"job_id": "job-1", "type": "device", "gpu_count": 2})
+        row = await database.fetchone("SELECT gpu_count FROM training_jobs WHERE id = 'job-1'")
+        assert row[0] == 2
+
+        # A failed write is logged; the event loop keeps draining
+        database.close()
+        scheduler.db = LockedDatabase()
+        await scheduler._handle_event({"job_id": "job-1", "type": "device", "gpu_count": 4})
+
+    asyncio.run(scenario())
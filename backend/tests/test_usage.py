@@ -0,0 +1,165 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from api import usage as usage_module
+from api.usage import UsageTracker
+from db.database import Database
+
+
+class Clock:
+    def __init__(self):
+        # Start on a minute boundary so bucket minutes are easy to predict
+        self.now = 60_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(usage_module.time, "time", clock)
+    monkeypatch.setattr(usage_module.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = Database(str(tmp_path / "usage.db"))
+    database.migrate()
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def alerts(monkeypatch):
+    sent = []
+    monkeypatch.setattr(usage_module.notification_service, "notify_api_usage_digest",
+                        lambda hot, threshold, window: sent.append(hot))
+    return sent
+
+
+class LockedDatabase:
+    async def run(self, fn):
+        raise sqlite3.OperationalError("database is locked")
+
+
+def tracker(database=None, **kwargs) -> UsageTracker:
+    options = {"window_seconds": 60, "bucket_seconds": 5, "flush_interval": 30,
+               "alert_threshold": 10, "alert_interval": 900}
+    options.update(kwargs)
+    return UsageTracker(database, **options)
+
+
+def tick(usage: UsageTracker, clock: Clock, seconds: float = None):
+    """Let a bucket's worth of time pass and rotate, as the background task does"""
+    clock.now += usage.bucket_seconds if seconds is None else seconds
+    usage._rotate()
+
+
+def usage_rows(database: Database) -> list:
+    with database.connection() as conn:
+        return [tuple(r) for r in conn.execute(
+            "SELECT deployment_id, endpoint, minute, request_count, error_count FROM api_usage ORDER BY minute"
+        )]
+
+
+def test_rotation_keeps_only_the_sliding_window(clock):
+    usage = tracker()
+    usage.record("d1", "inference")
+    usage.record_error("d1", "inference")
+    tick(usage, clock)
+
+    clock.now += 25
+    usage.record("d1", "inference")
+    usage.record("d2", "inference")
+    assert usage.window_counts("d1") == {"inference": {"requests": 2, "errors": 1}}
+    assert usage.window_counts() == {
+        "d1:inference": {"requests": 2, "errors": 1},
+        "d2:inference": {"requests": 1, "errors": 0},
+    }
+
+    tick(usage, clock)
+    # The first bucket, and its error, have left the window
+    clock.now += 30
+    assert usage.window_counts("d1") == {"inference": {"requests": 1, "errors": 0}}
+
+
+def test_window_never_holds_more_buckets_than_it_spans(clock):
+    usage = tracker(window_seconds=20, bucket_seconds=5)
+    for _ in range(10):
+        usage.record("d1", "inference")
+        tick(usage, clock)
+    assert len(usage._window) == 4
+    assert usage.window_counts("d1") == {"inference": {"requests": 4, "errors": 0}}
+
+
+def test_flush_upserts_per_minute_totals(clock, database):
+    usage = tracker(database)
+    for _ in range(3):
+        usage.record("d1", "inference")
+    usage.record_error("d1", "inference")
+    tick(usage, clock)
+    # Same minute, next bucket
+    usage.record("d1", "inference")
+    tick(usage, clock)
+    # Nothing recorded until the next minute
+    tick(usage, clock, 50)
+    usage.record("d1", "inference")
+    tick(usage, clock)
+
+    asyncio.run(usage.flush())
+    assert usage_rows(database) == [
+        ("d1", "inference", 60_000, 4, 1),
+        ("d1", "inference", 60_060, 1, 0),
+    ]
+
+    # A later flush for a minute already written adds to it
+    usage.record("d1", "inference")
+    usage.record_error("d1", "inference")
+    tick(usage, clock)
+    asyncio.run(usage.flush())
+    assert usage_rows(database)[-1] == ("d1", "inference", 60_060, 2, 1)
+    assert usage.stats["flushes"] == 2
+
+
+def test_failed_flush_keeps_the_counts(clock, database):
+    usage = tracker(database)
+    usage.record("d1", "inference")
+    tick(usage, clock)
+
+    usage.db = LockedDatabase()
+    with pytest.raises(sqlite3.OperationalError):
+        asyncio.run(usage.flush())
+
+    usage.db = database
+    asyncio.run(usage.flush())
+    assert usage_rows(database) == [("d1", "inference", 60_000, 1, 0)]
+
+
+def test_digest_alert_fires_once_per_interval(clock, alerts):
+    usage = tracker(alert_threshold=10, alert_interval=900)
+    for _ in range(9):
+        usage.record("d1", "inference")
+    usage._check_alerts()
+    assert alerts == []
+
+    usage.record("d1", "inference")
+    for _ in range(12):
+        usage.record("d2", "inference")
+    usage._check_alerts()
+    # One digest, hottest endpoint first
+    assert alerts == [[("d2:inference", 12), ("d1:inference", 10)]]
+
+    clock.now += 5
+    usage._check_alerts()
+    assert len(alerts) == 1
+    assert usage.stats["alerts_suppressed"] == 1
+
+    clock.now += 900
+    usage.record("d1", "inference")
+    usage._check_alerts()
+    assert len(alerts) == 2
+    assert usage.stats["alerts_sent"] == 2
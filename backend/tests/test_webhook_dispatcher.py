@@ -0,0 +1,179 @@
+import asyncio
+import json
+import time
+
+import httpx
+
+from db.database import Database
+from webhooks.dispatcher import SENDING_LEASE_SECONDS, CircuitBreaker, WebhookDispatcher
+
+URL = "http://receiver.test/hook"
+
+
+def test_circuit_breaker_opens_and_probes_after_the_timeout():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        breaker.record_failure(now=100)
+    assert breaker.allow(now=100)
+
+    breaker.record_failure(now=100)
+    assert not breaker.allow(now=159)
+    assert breaker.allow(now=160)
+
+    breaker.record_success()
+    assert breaker.failures == 0
+    assert breaker.allow(now=0)
+
+
+def deliver_all(dispatcher: WebhookDispatcher, handler, rows):
+    async def scenario():
+        dispatcher._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            return [await dispatcher._deliver(row) for row in rows]
+        finally:
+            await dispatcher._client.aclose()
+
+    return asyncio.run(scenario())
+
+
+def row(attempts: int = 0, row_id: int = 1):
+    return {"id": row_id, "target": "slack", "url": URL, "payload": json.dumps({"text": "done"}), "attempts": attempts}
+
+
+def test_failed_delivery_backs_off_exponentially(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr("webhooks.dispatcher.time.time", lambda: now)
+    dispatcher = WebhookDispatcher(database=None, max_attempts=10, base_backoff=2.0, max_backoff=30.0)
+    # Keep the breaker closed so every attempt reaches the receiver
+    dispatcher._breakers[URL] = CircuitBreaker(failure_threshold=100)
+
+    updates = deliver_all(dispatcher, lambda request: httpx.Response(503), [row(attempts) for attempts in range(6)])
+
+    for attempts, (status, new_attempts, retry_at, error, _, _) in enumerate(updates):
+        backoff = min(30.0, 2.0 * 2 ** attempts)
+        assert status == "pending"
+        assert new_attempts == attempts + 1
+        assert error == "HTTP 503"
+        # Jitter only ever shortens the wait, by at most half
+        assert now + backoff * 0.5 <= retry_at <= now + backoff
+
+
+def test_delivery_gives_up_after_max_attempts():
+    dispatcher = WebhookDispatcher(database=None, max_attempts=3)
+    [update] = deliver_all(dispatcher, lambda request: httpx.Response(500), [row(attempts=2)])
+    assert update[:2] == ("dead", 3)
+    assert dispatcher.stats["dead"] == 1
+
+
+def test_open_circuit_defers_without_spending_attempts():
+    dispatcher = WebhookDispatcher(database=None, max_attempts=10)
+    dispatcher._breakers[URL] = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    requests = []
+
+    def handler(request):
+        requests.append(json.loads(request.content))
+        return httpx.Response(502)
+
+    updates = deliver_all(dispatcher, handler, [row(row_id=i) for i in range(4)])
+
+    assert len(requests) == 2
+    assert [update[0] for update in updates] == ["pending"] * 4
+    # Short-circuited rows keep their attempt count and wait for the breaker to close
+    assert [update[1] for update in updates[2:]] == [0, 0]
+    assert updates[2][3] == "circuit open"
+    assert dispatcher.stats["short_circuited"] == 2
+
+
+def test_successful_delivery_resets_the_breaker():
+    dispatcher = WebhookDispatcher(database=None)
+    breaker = dispatcher._breakers[URL] = CircuitBreaker(failure_threshold=5)
+    breaker.failures = 4
+
+    [update] = deliver_all(dispatcher, lambda request: httpx.Response(204), [row()])
+    assert update[:2] == ("delivered", 1)
+    assert breaker.failures == 0
+
+
+def outbox(tmp_path, payloads) -> Database:
+    database = Database(str(tmp_path / "outbox.db"))
+    database.migrate()
+    WebhookDispatcher(database)._insert_rows([("slack", URL, payload) for payload in payloads])
+    return database
+
+
+def statuses(database: Database) -> list:
+    with database.connection() as conn:
+        return [r["status"] for r in conn.execute("SELECT status FROM notification_outbox ORDER BY id")]
+
+
+def test_concurrent_dispatchers_deliver_each_row_once(tmp_path):
+    database = outbox(tmp_path, [{"n": i} for i in range(20)])
+    received = []
+
+    async def handler(request):
+        received.append(json.loads(request.content)["n"])
+        # Let the other dispatcher run while this batch is in flight
+        await asyncio.sleep(0.01)
+        return httpx.Response(204)
+
+    async def scenario():
+        dispatchers = [WebhookDispatcher(database, concurrency=8) for _ in range(2)]
+        for dispatcher in dispatchers:
+            dispatcher._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            await asyncio.gather(*[dispatcher._deliver_due() for dispatcher in dispatchers])
+        finally:
+            for dispatcher in dispatchers:
+                await dispatcher._client.aclose()
+
+    try:
+        asyncio.run(scenario())
+        assert sorted(received) == list(range(20))
+        assert statuses(database) == ["delivered"] * 20
+    finally:
+        database.close()
+
+
+def test_one_bad_row_does_not_fail_the_batch(tmp_path):
+    database = outbox(tmp_path, [{"n": 1}, {"n": 2}])
+    with database.connection() as conn:
+        conn.execute("UPDATE notification_outbox SET payload = 'not json' WHERE id = 1")
+
+    async def scenario():
+        dispatcher = WebhookDispatcher(database)
+        dispatcher._client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(204)))
+        try:
+            await dispatcher._deliver_due()
+        finally:
+            await dispatcher._client.aclose()
+
+    try:
+        asyncio.run(scenario())
+        with database.connection() as conn:
+            rows = conn.execute(
+                "SELECT status, attempts, last_error, locked_until FROM notification_outbox ORDER BY id"
+            ).fetchall()
+        assert [(r["status"], r["attempts"]) for r in rows] == [("pending", 1), ("delivered", 1)]
+        assert rows[0]["last_error"].startswith("JSONDecodeError")
+        assert all(r["locked_until"] is None for r in rows)
+    finally:
+        database.close()
+
+
+def test_expired_claims_are_delivered_by_another_dispatcher(tmp_path):
+    database = outbox(tmp_path, [{"n": 1}, {"n": 2}])
+    now = time.time()
+    with database.connection() as conn:
+        # Row 1 was claimed by a process that died; row 2's claimer is still within its lease
+        conn.execute("UPDATE notification_outbox SET status = 'sending', locked_until = ? WHERE id = 1", (now - 1,))
+        conn.execute("UPDATE notification_outbox SET status = 'sending', locked_until = ? WHERE id = 2",
+                     (now + SENDING_LEASE_SECONDS,))
+
+    try:
+        dispatcher = WebhookDispatcher(database)
+        claimed = asyncio.run(database.run(lambda conn: dispatcher._claim_due(conn, time.time())))
+        assert [r["id"] for r in claimed] == [1]
+        # Claimed rows are not handed out again
+        assert asyncio.run(database.run(lambda conn: dispatcher._claim_due(conn, time.time()))) == []
+    finally:
+        database.close()
@@ -0,0 +1,121 @@
+import dataclasses
+import json
+import logging
+import os
+import re
+import shutil
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+import torch
+from transformers import Trainer
+from transformers.trainer import OPTIMIZER_NAME, SCHEDULER_NAME, TRAINER_STATE_NAME, TRAINING_ARGS_NAME
+from transformers.trainer_utils import PREFIX_CHECKPOINT_DIR
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_CHECKPOINT_RE = re.compile(rf"^{PREFIX_CHECKPOINT_DIR}-(\d+)$")
+
+
+def _to_cpu(value: Any) -> Any:
+    """Deep-copy tensors to CPU so later optimizer steps cannot change the snapshot"""
+    if isinstance(value, torch.Tensor):
+        return value.detach().to("cpu", copy=True)
+    if isinstance(value, dict):
+        return {k: _to_cpu(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_to_cpu(v) for v in value)
+    return value
+
+
+class BackgroundCheckpointTrainer(Trainer):
+    """Trainer whose checkpoints are written by a background thread.
+
+    The training thread only snapshots trainable weights, optimizer, scheduler,
+    RNG and trainer state to CPU; one writer thread serializes them into the
+    regular checkpoint-<step> layout, so resume_from_checkpoint works as usual.
+    Writes are strictly one at a time: a new snapshot waits for the previous
+    write, which bounds memory to a single pending checkpoint. Each checkpoint
+    is written to a temporary directory and renamed into place when complete.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+        self._pending: Optional[Future] = None
+        self.last_checkpoint: Optional[str] = None
+
+    def _save_checkpoint(self, model, trial, metrics=None):
+        self.wait_for_checkpoint()
+
+        run_dir = self._get_output_dir(trial=trial)
+        output_dir = os.path.join(run_dir, f"{PREFIX_CHECKPOINT_DIR}-{self.state.global_step}")
+        tmp_dir = f"{output_dir}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        # RNG state is tiny and must be captured at this exact step
+        self._save_rng_state(tmp_dir)
+
+        unwrapped = self.accelerator.unwrap_model(self.model)
+        trainable = {name for name, param in unwrapped.named_parameters() if param.requires_grad}
+        # Adapters only need their own weights; a full fine-tune needs everything
+        is_adapter = hasattr(unwrapped, "peft_config")
+        state_dict = {
+            name: tensor.detach().to("cpu", copy=True)
+            for name, tensor in unwrapped.state_dict().items()
+            if not is_adapter or name in trainable
+        }
+        snapshot = {
+            "state_dict": state_dict,
+            "optimizer": _to_cpu(self.optimizer.state_dict()) if self.optimizer is not None else None,
+            "scheduler": self.lr_scheduler.state_dict() if self.lr_scheduler is not None else None,
+            "trainer_state": json.dumps(dataclasses.asdict(self.state), indent=2, sort_keys=True) + "\n",
+        }
+
+        self._pending = self._writer.submit(
+            self._write_checkpoint, unwrapped, snapshot, tmp_dir, output_dir, run_dir
+        )
+
+    def _write_checkpoint(self, model, snapshot: Dict[str, Any], tmp_dir: str, output_dir: str, run_dir: str):
+        model.save_pretrained(tmp_dir, state_dict=snapshot["state_dict"], safe_serialization=True)
+        if self.tokenizer is not None:
+            self.tokenizer.save_pretrained(tmp_dir)
+        torch.save(self.args, os.path.join(tmp_dir, TRAINING_ARGS_NAME))
+        if snapshot["optimizer"] is not None:
+            torch.save(snapshot["optimizer"], os.path.join(tmp_dir, OPTIMIZER_NAME))
+        if snapshot["scheduler"] is not None:
+            torch.save(snapshot["scheduler"], os.path.join(tmp_dir, SCHEDULER_NAME))
+        with open(os.path.join(tmp_dir, TRAINER_STATE_NAME), "w") as f:
+            f.write(snapshot["trainer_state"])
+
+        shutil.rmtree(output_dir, ignore_errors=True)
+        os.replace(tmp_dir, output_dir)
+        self.last_checkpoint = output_dir
+        logger.info(f"Checkpoint written to {output_dir}")
+        self._rotate(run_dir)
+
+    def _rotate(self, run_dir: str):
+        limit = self.args.save_total_limit
+        if not limit:
+            return
+        steps = sorted(
+            int(match.group(1))
+            for match in (_CHECKPOINT_RE.match(name) for name in os.listdir(run_dir))
+            if match
+        )
+        for step in steps[:-limit]:
+            shutil.rmtree(os.path.join(run_dir, f"{PREFIX_CHECKPOINT_DIR}-{step}"), ignore_errors=True)
+
+    def wait_for_checkpoint(self):
+        """Block until the in-flight checkpoint write, if any, has finished"""
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            # Surface write errors on the training thread
+            pending.result()
+
+    def close(self):
+        self.wait_for_checkpoint()
+        self._writer.shutdown(wait=True)
+
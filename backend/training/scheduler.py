@@ -0,0 +1,394 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import re
+import signal
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from monitoring.metrics import merge_histograms
+from training.telemetry import TelemetryBuffer
+from webhooks.notifications import notify_training_event
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Telemetry of finished jobs stays available for late subscribers, up to this many jobs
+MAX_FINISHED_TELEMETRY = 20
+# How long to wait for a dead worker's final event before judging it by exit code
+RESULT_GRACE_SECONDS = 5.0
+# How long a stopping worker may spend writing its final checkpoint before it is killed
+STOP_TIMEOUT_SECONDS = float(os.getenv('TRAINING_STOP_TIMEOUT_SECONDS', '120'))
+
+_CHECKPOINT_RE = re.compile(r"^checkpoint-(\d+)$")
+
+
+def job_output_dir(job_id: str) -> str:
+    return os.path.join("outputs", job_id)
+
+
+def latest_checkpoint(job_id: str) -> Optional[str]:
+    """Newest complete checkpoint of a job; partial writes never match the pattern"""
+    output_dir = job_output_dir(job_id)
+    if not os.path.isdir(output_dir):
+        return None
+    steps = [
+        int(match.group(1))
+        for match in (_CHECKPOINT_RE.match(name) for name in os.listdir(output_dir))
+        if match and os.path.isfile(os.path.join(output_dir, match.group(0), "trainer_state.json"))
+    ]
+    return os.path.join(output_dir, f"checkpoint-{max(steps)}") if steps else None
+
+
+def _run_job_process(job_config: Dict[str, Any], events, cancel_event):
+    """Entry point of an isolated training worker process"""
+    job_id = job_config['job_id']
+
+    def report(event: Dict[str, Any]):
+        events.put({"job_id": job_id, **event})
+
+    # Preemption (SIGTERM) stops at the next step with a checkpoint, like a user stop
+    signal.signal(signal.SIGTERM, lambda signum, frame: cancel_event.set())
+
+    try:
+        # Import the ML stack here so the API process never pays for it
+        from training.trainer import TrainingCancelled, run_training_job
+        import torch
+    except BaseException as e:
+        report({"type": "failed", "error": str(e)})
+        raise SystemExit(1)
+
+    # Lets the dashboard charge the run to GPU-hours or CPU-hours
+    report({"type": "device", "gpu_count": torch.cuda.device_count()})
+
+    try:
+        output_path = run_training_job(job_config, reporter=report, cancel_event=cancel_event)
+        report({"type": "completed", "output_path": output_path})
+    except TrainingCancelled as e:
+        report({"type": "stopped", "checkpoint": e.checkpoint})
+    except BaseException as e:
+        report({"type": "failed", "error": str(e)})
+        raise SystemExit(1)
+
+
+class TrainingScheduler:
+    """Priority job queue that runs training jobs in isolated worker processes.
+
+    Job state lives in the training_jobs table: queued jobs are picked by
+    priority and then age, at most `max_concurrent` run at a time, and a worker
+    that crashes or is OOM-killed only fails its own job. Only one API process
+    may run a scheduler against a database: start() treats every 'running' job
+    as orphaned, which would re-queue another live scheduler's jobs.
+    """
+
+    def __init__(self, db, max_concurrent: Optional[int] = None):
+        self.db = db
+        self.max_concurrent = max_concurrent or int(os.getenv('MAX_CONCURRENT_JOBS', '1'))
+        self._ctx = multiprocessing.get_context("spawn")
+        self._events = None
+        self._running: Dict[str, multiprocessing.Process] = {}
+        self._results: Dict[str, Dict[str, Any]] = {}
+        self._exited_at: Dict[str, float] = {}
+        self._started: Dict[str, tuple] = {}
+        self._cancel_events: Dict[str, Any] = {}
+        self._stop_deadlines: Dict[str, float] = {}
+        self.queued = 0
+        self.progress: Dict[str, float] = {}
+        self.telemetry: "OrderedDict[str, TelemetryBuffer]" = OrderedDict()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+
+    async def start(self):
+        """Recover interrupted jobs and start dispatching.
+
+        Assumes this is the only scheduler on the database (a single API process),
+        so no 'running' job can still have a live worker elsewhere.
+        """
+        self._events = self._ctx.Queue()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+
+        # Jobs that were running when the API went down go back to the queue
+        recovered = await self.db.execute(
+            "UPDATE training_jobs SET status = 'queued' WHERE status = 'running'"
+        )
+        if recovered:
+            logger.info(f"Re-queued {recovered} interrupted training job(s)")
+
+        loop = asyncio.get_running_loop()
+        self._tasks = [
+            loop.create_task(self._dispatch_loop()),
+            loop.create_task(self._event_loop()),
+        ]
+
+    async def shutdown(self):
+        """Stop dispatching and checkpoint running workers; their jobs are re-queued and resume"""
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        for event in self._cancel_events.values():
+            event.set()
+        deadline = time.monotonic() + STOP_TIMEOUT_SECONDS
+        for job_id, process in list(self._running.items()):
+            await asyncio.to_thread(process.join, max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.kill()
+                await asyncio.to_thread(process.join, 10)
+            await self.db.execute(
+                "UPDATE training_jobs SET status = 'queued' WHERE id = ? AND status = 'running'",
+                (job_id,)
+            )
+        self._running.clear()
+        self._started.clear()
+        self._cancel_events.clear()
+        self._stop_deadlines.clear()
+
+    async def submit(self, job_id: str, model_id: str, dataset_id: str, dataset_path: str,
+                     config: Dict[str, Any], priority: int = 0):
+        """Queue a job; it starts as soon as a worker slot is free"""
+        await self.db.execute('''
+            INSERT INTO training_jobs (id, model_id, dataset_id, config, status, priority, queued_time, dataset_path)
+            VALUES (?, ?, ?, ?, 'queued', ?, CURRENT_TIMESTAMP, ?)
+        ''', (job_id, model_id, dataset_id, json.dumps(config), priority, dataset_path))
+        self._wake()
+
+    async def cancel(self, job_id: str) -> Optional[str]:
+        """Cancel a queued job or stop a running one; returns the resulting status"""
+        cancelled = await self.db.execute(
+            "UPDATE training_jobs SET status = 'cancelled', end_time = CURRENT_TIMESTAMP "
+            "WHERE id = ? AND status = 'queued'",
+            (job_id,)
+        )
+        if cancelled:
+            return "cancelled"
+
+        process = self._running.get(job_id)
+        if process is None:
+            return None
+
+        # Mark first so the reaper does not record the exit as a failure
+        await self.db.execute(
+            "UPDATE training_jobs SET status = 'stopped', end_time = CURRENT_TIMESTAMP WHERE id = ?",
+            (job_id,)
+        )
+        # The worker checkpoints at its next step boundary and exits; kill it if it hangs
+        self._cancel_events[job_id].set()
+        self._stop_deadlines[job_id] = time.monotonic() + STOP_TIMEOUT_SECONDS
+        self._wake()
+        return "stopped"
+
+    async def resume(self, job_id: str) -> bool:
+        """Re-queue a stopped or failed job; it continues from its latest checkpoint.
+
+        A job stopped moments ago may still have its worker writing the final
+        checkpoint; it stays queued until that worker has been reaped.
+        """
+        resumed = await self.db.execute('''
+            UPDATE training_jobs
+            SET status = 'queued', queued_time = CURRENT_TIMESTAMP, end_time = NULL
+            WHERE id = ? AND status IN ('stopped', 'failed', 'cancelled')
+        ''', (job_id,))
+        if resumed:
+            self._wake()
+        return bool(resumed)
+
+    def running_jobs(self) -> List[str]:
+        return list(self._running)
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _dispatch_loop(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                await self._reap()
+                while len(self._running) < self.max_concurrent:
+                    if not await self._launch_next():
+                        break
+                row = await self.db.fetchone("SELECT COUNT(*) FROM training_jobs WHERE status = 'queued'")
+                self.queued = row[0]
+            except Exception as e:
+                logger.error(f"Training scheduler dispatch failed: {str(e)}")
+
+    async def _launch_next(self) -> bool:
+        # A resumed job whose previous worker has not exited yet must wait for it:
+        # both would write the same outputs and checkpoints
+        running = list(self._running)
+        row = await self.db.fetchone(f'''
+            SELECT id, model_id, dataset_id, config, dataset_path
+            FROM training_jobs
+            WHERE status = 'queued' AND id NOT IN ({', '.join('?' * len(running))})
+            ORDER BY priority DESC, queued_time ASC
+            LIMIT 1
+        ''', running)
+        if row is None:
+            return False
+
+        job_id = row["id"]
+        claimed = await self.db.execute(
+            "UPDATE training_jobs SET status = 'running', start_time = CURRENT_TIMESTAMP "
+            "WHERE id = ? AND status = 'queued'",
+            (job_id,)
+        )
+        if not claimed:
+            return True
+
+        job_config = {
+            "job_id": job_id,
+            "model_id": row["model_id"],
+            "dataset_id": row["dataset_id"],
+            "dataset_path": row["dataset_path"],
+            "config": json.loads(row["config"]) if row["config"] else {},
+            # Re-queued, preempted and resumed jobs pick up where they left off
+            "resume_from_checkpoint": latest_checkpoint(job_id),
+        }
+        cancel_event = self._ctx.Event()
+        process = self._ctx.Process(
+            target=_run_job_process,
+            args=(job_config, self._events, cancel_event),
+            name=f"training-{job_id}",
+            daemon=False,
+        )
+        process.start()
+        self._running[job_id] = process
+        self._cancel_events[job_id] = cancel_event
+        self._started[job_id] = (row["model_id"], time.monotonic())
+        self.progress[job_id] = 0.0
+        self.telemetry[job_id] = TelemetryBuffer()
+        logger.info(f"Started training job {job_id} in worker pid {process.pid}")
+        notify_training_event("training_started", {
+            "job_id": job_id,
+            "model_name": row["model_id"],
+            "dataset_name": row["dataset_id"],
+        })
+        return True
+
+    async def _reap(self):
+        """Record the outcome of workers that have exited"""
+        for job_id, process in list(self._running.items()):
+            if process.is_alive():
+                deadline = self._stop_deadlines.get(job_id)
+                if deadline is not None and time.monotonic() > deadline:
+                    logger.warning(f"Training job {job_id} did not stop in time, killing worker")
+                    process.kill()
+                continue
+
+            # The final event can trail the process exit through the queue
+            if job_id not in self._results:
+                exited_at = self._exited_at.setdefault(job_id, time.monotonic())
+                if time.monotonic() - exited_at < RESULT_GRACE_SECONDS:
+                    continue
+
+            process.join()
+            del self._running[job_id]
+            self._exited_at.pop(job_id, None)
+            self._cancel_events.pop(job_id, None)
+            self._stop_deadlines.pop(job_id, None)
+
+            result = self._results.pop(job_id, {})
+            if result.get("type") == "completed":
+                status = "completed"
+                await self.db.execute('''
+                    UPDATE training_jobs
+                    SET status = 'completed', end_time = CURRENT_TIMESTAMP, output_path = ?
+                    WHERE id = ? AND status = 'running'
+                ''', (result.get("output_path"), job_id))
+                self.progress[job_id] = 100.0
+            elif result.get("type") == "stopped":
+                # Stopped on request or preempted; the job can be resumed from its checkpoint
+                await self.db.execute(
+                    "UPDATE training_jobs SET status = 'stopped', end_time = CURRENT_TIMESTAMP "
+                    "WHERE id = ? AND status = 'running'",
+                    (job_id,)
+                )
+                status = "stopped"
+            else:
+                error = result.get("error") or f"Training worker exited with code {process.exitcode}"
+                failed = await self.db.execute('''
+                    UPDATE training_jobs
+                    SET status = 'failed', end_time = CURRENT_TIMESTAMP, logs = ?
+                    WHERE id = ? AND status = 'running'
+                ''', (error, job_id))
+                # No row updated means the job was stopped on purpose
+                status = "failed" if failed else "stopped"
+            self._close_telemetry(job_id, status)
+            self._notify_finished(job_id, status, result)
+            logger.info(f"Training job {job_id} finished with exit code {process.exitcode}")
+
+    def _notify_finished(self, job_id: str, status: str, result: Dict[str, Any]):
+        model_id, started = self._started.pop(job_id, (None, time.monotonic()))
+        if status == "completed":
+            notify_training_event("training_completed", {
+                "job_id": job_id,
+                "model_name": model_id,
+                "training_time": f"{(time.monotonic() - started) / 60:.1f} min",
+            })
+        elif status == "failed":
+            notify_training_event("training_failed", {
+                "job_id": job_id,
+                "model_name": model_id,
+                "error_message": result.get("error") or "Training worker exited unexpectedly",
+            })
+
+    def _close_telemetry(self, job_id: str, status: str):
+        buffer = self.telemetry.get(job_id)
+        if buffer is not None:
+            buffer.close(status)
+            self.telemetry.move_to_end(job_id)
+
+        finished = [j for j, b in self.telemetry.items() if b.closed]
+        for old_job_id in finished[:-MAX_FINISHED_TELEMETRY]:
+            del self.telemetry[old_job_id]
+            self.progress.pop(old_job_id, None)
+
+    async def _event_loop(self):
+        """Drain progress and result events sent by the worker processes"""
+        while not self._stopping:
+            try:
+                event = await asyncio.to_thread(self._events.get, True, 0.5)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+            await self._handle_event(event)
+
+    async def _handle_event(self, event: Dict[str, Any]):
+        job_id = event.get("job_id")
+        kind = event.get("type")
+
+        if kind == "log":
+            entry = {k: v for k, v in event.items() if k not in ("job_id", "type")}
+            entry.setdefault("timestamp", datetime.now().isoformat())
+            buffer = self.telemetry.get(job_id)
+            if buffer is not None:
+                buffer.append(entry)
+            if "progress" in entry:
+                self.progress[job_id] = entry["progress"]
+        elif kind == "metrics":
+            merge_histograms(event.get("histograms", {}))
+        elif kind == "device":
+            try:
+                await self.db.execute(
+                    "UPDATE training_jobs SET gpu_count = ? WHERE id = ?",
+                    (event["gpu_count"], job_id)
+                )
+            except Exception as e:
+                # Losing the GPU count must not stop the loop that drains worker events
+                logger.error(f"Could not record devices of job {job_id}: {str(e)}")
+        elif kind in ("completed", "failed", "stopped"):
+            self._results[job_id] = event
+            self._wake()
+
@@ -0,0 +1,73 @@
+import asyncio
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+# Newest step entries kept per job; older ones are dropped
+MAX_ENTRIES = 1000
+
+
+class TelemetryBuffer:
+    """Bounded ring buffer of step metrics for one training job.
+
+    Entries are keyed by training step, which doubles as the resume cursor:
+    clients ask for everything after the last step they saw and get only the
+    delta. Async subscribers are woken on every append instead of polling.
+    `version` moves on every append and close, so a subscriber that was busy
+    when one happened still sees it on its next wait().
+    """
+
+    def __init__(self, maxlen: int = MAX_ENTRIES):
+        self.entries: "deque[Dict[str, Any]]" = deque(maxlen=maxlen)
+        self.last_step = -1
+        self.dropped_through_step = -1
+        self.status: Optional[str] = None
+        self.version = 0
+        self._waiter: Optional[asyncio.Future] = None
+
+    @property
+    def closed(self) -> bool:
+        return self.status is not None
+
+    def append(self, entry: Dict[str, Any]):
+        step = entry.get("step", self.last_step + 1)
+        if self.entries and step <= self.last_step:
+            # Several logs at one step (e.g. the end-of-training summary) merge into one entry
+            self.entries[-1].update(entry)
+        else:
+            if len(self.entries) == self.entries.maxlen:
+                self.dropped_through_step = self.entries[0]["step"]
+            self.entries.append({**entry, "step": step})
+            self.last_step = step
+        self._notify()
+
+    def close(self, status: str):
+        self.status = status
+        self._notify()
+
+    def since(self, after_step: int) -> Tuple[List[Dict[str, Any]], bool]:
+        """Entries newer than `after_step`, plus whether some were already evicted"""
+        new = []
+        for entry in reversed(self.entries):
+            if entry["step"] <= after_step:
+                break
+            new.append(entry)
+        new.reverse()
+        return new, after_step < self.dropped_through_step
+
+    async def wait(self, seen_version: int, timeout: float) -> bool:
+        """Wait for an append or close after `seen_version`; False on timeout"""
+        if self.version != seen_version:
+            return True
+        if self._waiter is None or self._waiter.done():
+            self._waiter = asyncio.get_running_loop().create_future()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._waiter), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def _notify(self):
+        self.version += 1
+        waiter, self._waiter = self._waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
@@ -1,27 +1,231 @@
 import os
 import json
+import hashlib
+import shutil
+import time
 import torch
 from transformers import (
     AutoTokenizer, 
     AutoModelForCausalLM,
     TrainingArguments,
     Trainer,
+    TrainerCallback,
     DataCollatorForLanguageModeling
 )
-from datasets import Dataset, load_dataset
+from datasets import Dataset, load_dataset, load_from_disk
 from peft import LoraConfig, get_peft_model, TaskType
 import logging
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Callable, List, Optional
+
+from storage.models import model_store
+from training.checkpoints import BackgroundCheckpointTrainer
+from monitoring.metrics import DATALOADER_WAIT_SECONDS, TRAINING_HISTOGRAMS, TRAINING_STEP_SECONDS, drain_histograms
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+PROMPT_TEMPLATE = "### Instruction:\n{instruction}\n\n### Response:\n{output}"
+TOKENIZED_CACHE_PATH = os.getenv('TOKENIZED_CACHE_PATH', './cache/tokenized')
+# Bump when the layout of cached tokenized datasets changes
+TOKENIZED_CACHE_VERSION = 2
+# Below this many rows, spawning tokenizer processes costs more than it saves
+MIN_ROWS_PER_WORKER = 2000
+
+def file_sha256(path: str) -> str:
+    """Content hash of a dataset file; blobs from the upload store are already named by it"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if len(stem) == 64 and all(c in "0123456789abcdef" for c in stem):
+        return stem
+    
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def tokenizer_fingerprint(tokenizer) -> str:
+    """Identify a tokenizer by its vocabulary and settings rather than by name alone"""
+    digest = hashlib.sha256()
+    digest.update(type(tokenizer).__name__.encode())
+    digest.update(str(tokenizer.name_or_path).encode())
+    digest.update(str(len(tokenizer)).encode())
+    digest.update(json.dumps(tokenizer.special_tokens_map, sort_keys=True, default=str).encode())
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        digest.update(backend.to_str().encode())
+    return digest.hexdigest()
+
+def pack_examples(examples: Dict[str, list], block_size: int, eos_token_id: Optional[int]) -> Dict[str, list]:
+    """Concatenate tokenized examples and cut the stream into block_size blocks.
+
+    Every document ends with EOS, restarts its position ids at zero and has its
+    first label masked, so no loss is computed across a document boundary.
+    Attention is not isolated: each token still attends to the earlier
+    documents in its block, with every attention implementation.
+    """
+    blocks = {"input_ids": [], "labels": [], "position_ids": []}
+    buffers = {"input_ids": [], "labels": [], "position_ids": []}
+    
+    for ids in examples["input_ids"]:
+        if eos_token_id is not None and (not ids or ids[-1] != eos_token_id):
+            ids = ids + [eos_token_id]
+        ids = ids[:block_size]
+        buffers["input_ids"] += ids
+        buffers["labels"] += [-100] + ids[1:]
+        buffers["position_ids"] += list(range(len(ids)))
+        
+        while len(buffers["input_ids"]) >= block_size:
+            for name, buffer in buffers.items():
+                blocks[name].append(buffer[:block_size])
+                del buffer[:block_size]
+    
+    # Keep the tail as a short block rather than dropping data
+    if buffers["input_ids"]:
+        for name, buffer in buffers.items():
+            blocks[name].append(buffer)
+    
+    return blocks
+
+class TokenStats:
+    """Real vs. padded token counts seen by the data collator"""
+    def __init__(self):
+        self.real_tokens = 0
+        self.total_tokens = 0
+    
+    def add(self, attention_mask: torch.Tensor):
+        self.real_tokens += int(attention_mask.sum())
+        self.total_tokens += attention_mask.numel()
+    
+    @property
+    def padding_ratio(self) -> float:
+        return 1 - self.real_tokens / self.total_tokens if self.total_tokens else 0.0
+
+class PaddedCollator:
+    """Pads variable-length examples per batch and records how much of it is padding"""
+    def __init__(self, tokenizer, stats: TokenStats):
+        self.collator = DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=False)
+        self.stats = stats
+    
+    def __call__(self, features):
+        # The length column only feeds the length-grouped sampler
+        batch = self.collator([{k: v for k, v in f.items() if k != "length"} for f in features])
+        self.stats.add(batch["attention_mask"])
+        return batch
+
+class PackedCollator:
+    """Stacks packed blocks; only a tail block can be short and need padding.
+
+    The attention mask is plain causal over the whole block, so packed
+    documents see each other; only their losses are kept apart.
+    """
+    def __init__(self, pad_token_id: int, stats: TokenStats, use_position_ids: bool):
+        self.pad_token_id = pad_token_id
+        self.stats = stats
+        self.use_position_ids = use_position_ids
+    
+    def __call__(self, features):
+        longest = max(len(f["input_ids"]) for f in features)
+        batch = {"input_ids": [], "labels": [], "attention_mask": [], "position_ids": []}
+        
+        for f in features:
+            padding = longest - len(f["input_ids"])
+            batch["input_ids"].append(f["input_ids"] + [self.pad_token_id] * padding)
+            batch["labels"].append(f["labels"] + [-100] * padding)
+            batch["attention_mask"].append([1] * len(f["input_ids"]) + [0] * padding)
+            batch["position_ids"].append(f["position_ids"] + [0] * padding)
+        
+        batch = {k: torch.tensor(v, dtype=torch.long) for k, v in batch.items()}
+        # Restarted position ids only reset rotary offsets under flash attention;
+        # the installed transformers does not use them to split varlen sequences
+        if not self.use_position_ids:
+            del batch["position_ids"]
+        self.stats.add(batch["attention_mask"])
+        return batch
+
+class ThroughputCallback(TrainerCallback):
+    """Adds effective (non-pad) tokens/sec and padding ratio to every training log"""
+    def __init__(self, stats: TokenStats):
+        self.stats = stats
+        self.start_time = None
+    
+    def metrics(self) -> Dict[str, float]:
+        elapsed = time.perf_counter() - self.start_time if self.start_time else 0.0
+        return {
+            "tokens_per_sec": self.stats.real_tokens / elapsed if elapsed else 0.0,
+            "padding_ratio": self.stats.padding_ratio,
+        }
+    
+    def on_train_begin(self, args, state, control, **kwargs):
+        self.start_time = time.perf_counter()
+    
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        metrics = self.metrics()
+        if logs is not None:
+            logs.update(metrics)
+        if state.log_history:
+            state.log_history[-1].update(metrics)
+
+class StepTimingCallback(TrainerCallback):
+    """Observes optimizer step time and the gap between steps, which is mostly dataloader wait"""
+    def __init__(self):
+        self.step_started = None
+        self.step_ended = None
+    
+    def on_step_begin(self, args, state, control, **kwargs):
+        self.step_started = time.perf_counter()
+        if self.step_ended is not None:
+            DATALOADER_WAIT_SECONDS.observe(self.step_started - self.step_ended)
+    
+    def on_step_end(self, args, state, control, **kwargs):
+        self.step_ended = time.perf_counter()
+        if self.step_started is not None:
+            TRAINING_STEP_SECONDS.observe(self.step_ended - self.step_started)
+
+class TrainingCancelled(Exception):
+    """Raised when a job stops early on request; carries the checkpoint it can resume from"""
+    def __init__(self, checkpoint: Optional[str]):
+        self.checkpoint = checkpoint
+        super().__init__(f"Training stopped, checkpoint: {checkpoint}")
+
+class CancellationCallback(TrainerCallback):
+    """Stops at the next optimizer step boundary once the event is set, saving a checkpoint first"""
+    def __init__(self, cancel_event):
+        self.cancel_event = cancel_event
+        self.cancelled = False
+    
+    def on_step_end(self, args, state, control, **kwargs):
+        if self.cancel_event.is_set():
+            self.cancelled = True
+            control.should_save = True
+            control.should_training_stop = True
+
+class ProgressCallback(TrainerCallback):
+    """Forwards step metrics to a reporter, e.g. the scheduler's event queue"""
+    def __init__(self, reporter: Callable[[Dict[str, Any]], None]):
+        self.reporter = reporter
+    
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        event = {
+            "type": "log",
+            "step": state.global_step,
+            "max_steps": state.max_steps,
+            "progress": 100.0 * state.global_step / state.max_steps if state.max_steps else 0.0,
+        }
+        event.update({k: v for k, v in (logs or {}).items() if isinstance(v, (int, float))})
+        self.reporter(event)
+        
+        # Histograms live in this process; ship their deltas to the API process
+        histograms = drain_histograms(TRAINING_HISTOGRAMS)
+        if histograms:
+            self.reporter({"type": "metrics", "histograms": histograms})
+
 class AITrainer:
     def __init__(self, config: Dict[str, Any]):
         self.config = config
         self.model = None
         self.tokenizer = None
         self.dataset = None
+        self.token_stats = TokenStats()
         
     def load_model(self, model_name: str):
         """Load the base model and tokenizer"""
@@ -52,10 +256,58 @@ class AITrainer:
             
         logger.info("Model loaded successfully")
         
+    def tokenized_cache_dir(self, dataset_path: str) -> str:
+        """Cache location keyed by dataset content, tokenizer, prompt template and max_length"""
+        key = {
+            "version": TOKENIZED_CACHE_VERSION,
+            "dataset": file_sha256(dataset_path),
+            "tokenizer": tokenizer_fingerprint(self.tokenizer),
+            "template": PROMPT_TEMPLATE,
+            "max_length": self.config.get('max_length', 512),
+        }
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+        return os.path.join(TOKENIZED_CACHE_PATH, digest)
+        
+    def _preprocess_function(self) -> Callable[[Dict[str, list]], Dict[str, list]]:
+        tokenizer = self.tokenizer
+        max_length = self.config.get('max_length', 512)
+        
+        def preprocess_function(examples):
+            # Combine instruction and output for training
+            texts = [
+                PROMPT_TEMPLATE.format(instruction=instruction, output=output)
+                for instruction, output in zip(examples['instruction'], examples['output'])
+            ]
+            
+            # Tokenize without padding; the data collator pads each training batch
+            tokenized = tokenizer(
+                texts,
+                truncation=True,
+                max_length=max_length,
+            )
+            tokenized["length"] = [len(ids) for ids in tokenized["input_ids"]]
+            return tokenized
+        
+        return preprocess_function
+        
     def load_dataset(self, dataset_path: str):
         """Load and preprocess the dataset"""
         logger.info(f"Loading dataset: {dataset_path}")
         
+        if self.config.get('streaming', False):
+            self._load_streaming_dataset(dataset_path)
+            return
+        
+        use_cache = self.config.get('use_tokenized_cache', True)
+        cache_dir = self.tokenized_cache_dir(dataset_path) if use_cache else None
+        
+        # Reruns on the same data memory-map the tokenized Arrow files and skip preprocessing
+        if cache_dir and os.path.isdir(cache_dir):
+            self.dataset = load_from_disk(cache_dir)
+            logger.info(f"Loaded {len(self.dataset)} tokenized examples from cache: {cache_dir}")
+            self._maybe_pack()
+            return
+        
         # Determine file format and load accordingly
         if dataset_path.endswith('.jsonl'):
             dataset = load_dataset('json', data_files=dataset_path, split='train')
@@ -65,43 +317,116 @@ class AITrainer:
             raise ValueError(f"Unsupported file format: {dataset_path}")
             
         # Preprocess dataset
-        def preprocess_function(examples):
-            # Combine instruction and output for training
-            texts = []
-            for i in range(len(examples['instruction'])):
-                text = f"### Instruction:\n{examples['instruction'][i]}\n\n### Response:\n{examples['output'][i]}"
-                texts.append(text)
-            
-            # Tokenize
-            tokenized = self.tokenizer(
-                texts,
-                truncation=True,
-                padding=True,
-                max_length=self.config.get('max_length', 512),
-                return_tensors="pt"
-            )
-            
-            # Set labels for language modeling
-            tokenized["labels"] = tokenized["input_ids"].clone()
-            
-            return tokenized
-            
+        preprocess_function = self._preprocess_function()
+        
+        num_proc = self.config.get('tokenization_workers') or os.cpu_count() or 1
+        num_proc = max(1, min(num_proc, len(dataset) // MIN_ROWS_PER_WORKER))
+        
         self.dataset = dataset.map(
             preprocess_function,
             batched=True,
+            num_proc=num_proc if num_proc > 1 else None,
             remove_columns=dataset.column_names
         )
         
+        if cache_dir:
+            # Write next to the final location and rename, so readers never see a partial cache
+            os.makedirs(TOKENIZED_CACHE_PATH, exist_ok=True)
+            tmp_dir = f"{cache_dir}.tmp-{os.getpid()}"
+            self.dataset.save_to_disk(tmp_dir)
+            try:
+                os.replace(tmp_dir, cache_dir)
+            except OSError:
+                # Another job populated the same cache first
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+            self.dataset = load_from_disk(cache_dir)
+        
         logger.info(f"Dataset loaded with {len(self.dataset)} examples")
+        self._maybe_pack()
+    
+    def _load_streaming_dataset(self, dataset_path: str):
+        """Iterate the file lazily: rows are tokenized as batches are drawn, in constant memory"""
+        if dataset_path.endswith('.jsonl'):
+            raw = load_dataset('json', data_files=dataset_path, split='train', streaming=True)
+        elif dataset_path.endswith('.csv'):
+            raw = load_dataset('csv', data_files=dataset_path, split='train', streaming=True)
+        else:
+            raise ValueError(f"Unsupported file format: {dataset_path}")
+        
+        # Streaming readers may not know the schema up front; the first row tells us
+        first = next(iter(raw))
+        preprocess_function = self._preprocess_function()
+        dataset = raw.map(preprocess_function, batched=True, remove_columns=list(first.keys()))
+        
+        if self.config.get('packing', False):
+            # Iterable map merges the outputs into the input row before dropping
+            # remove_columns, so only drop the tokenizer columns packing does not replace
+            tokenized = preprocess_function({k: [v] for k, v in first.items()})
+            dataset = dataset.map(
+                pack_examples,
+                batched=True,
+                batch_size=1000,
+                remove_columns=[c for c in tokenized.keys() if c not in ("input_ids", "labels", "position_ids")],
+                fn_kwargs={
+                    "block_size": self.config.get('max_length', 512),
+                    "eos_token_id": self.tokenizer.eos_token_id,
+                },
+            )
         
-    def train(self, output_dir: str):
-        """Start the training process"""
+        # Only shuffle_buffer_size examples are held in memory; the order changes every epoch
+        self.dataset = dataset.shuffle(
+            seed=self.config.get('seed', 42),
+            buffer_size=self.config.get('shuffle_buffer_size', 10000)
+        )
+        logger.info(f"Streaming dataset from {dataset_path}")
+    
+    def max_steps(self) -> int:
+        """Optimizer steps for a streaming run, which has no length to derive epochs from"""
+        if self.config.get('max_steps'):
+            return int(self.config['max_steps'])
+        
+        rows = self.config.get('dataset_rows')
+        if not rows:
+            raise ValueError("Streaming training needs max_steps or the dataset row count")
+        examples_per_step = self.config.get('batch_size', 4) * self.config.get('gradient_accumulation_steps', 4)
+        steps_per_epoch = max(1, -(-rows // examples_per_step))
+        return int(steps_per_epoch * self.config.get('epochs', 3))
+        
+    def _maybe_pack(self):
+        """Pack tokenized examples into full max_length blocks when packing is enabled"""
+        if not self.config.get('packing', False):
+            return
+        
+        num_examples = len(self.dataset)
+        self.dataset = self.dataset.map(
+            pack_examples,
+            batched=True,
+            batch_size=1000,
+            remove_columns=self.dataset.column_names,
+            fn_kwargs={
+                "block_size": self.config.get('max_length', 512),
+                "eos_token_id": self.tokenizer.eos_token_id,
+            },
+        )
+        logger.info(f"Packed {num_examples} examples into {len(self.dataset)} blocks")
+        
+    def train(self, output_dir: str, callbacks: Optional[List[TrainerCallback]] = None,
+              cancel_event=None, resume_from_checkpoint: Optional[str] = None):
+        """Start the training process, optionally resuming from a checkpoint.
+
+        Setting `cancel_event` stops training at the next step boundary after a
+        checkpoint is written, and raises TrainingCancelled.
+        """
         logger.info("Starting training...")
+        packing = self.config.get('packing', False)
+        streaming = self.config.get('streaming', False)
         
         # Training arguments
         training_args = TrainingArguments(
             output_dir=output_dir,
             num_train_epochs=self.config.get('epochs', 3),
+            # An iterable dataset has no length, so the schedule is expressed in steps
+            max_steps=self.max_steps() if streaming else self.config.get('max_steps') or -1,
             per_device_train_batch_size=self.config.get('batch_size', 4),
             gradient_accumulation_steps=self.config.get('gradient_accumulation_steps', 4),
             warmup_steps=self.config.get('warmup_steps', 100),
@@ -117,25 +442,48 @@ class AITrainer:
             gradient_checkpointing=self.config.get('gradient_checkpointing', True),
             optim=self.config.get('optimizer', 'adamw_torch'),
             lr_scheduler_type=self.config.get('scheduler', 'cosine'),
+            # Batch similar lengths together to cut padding when examples are not packed
+            group_by_length=self.config.get('group_by_length', True) and not packing and not streaming,
         )
         
         # Data collator
-        data_collator = DataCollatorForLanguageModeling(
-            tokenizer=self.tokenizer,
-            mlm=False
-        )
+        self.token_stats = TokenStats()
+        if packing:
+            attn_implementation = getattr(self.model.config, "_attn_implementation", None)
+            data_collator = PackedCollator(
+                self.tokenizer.pad_token_id,
+                self.token_stats,
+                use_position_ids=attn_implementation == "flash_attention_2"
+            )
+        else:
+            data_collator = PaddedCollator(self.tokenizer, self.token_stats)
+        throughput = ThroughputCallback(self.token_stats)
+        cancellation = CancellationCallback(cancel_event) if cancel_event is not None else None
         
-        # Initialize trainer
-        trainer = Trainer(
+        # Initialize trainer; checkpoints are written off the training thread
+        trainer = BackgroundCheckpointTrainer(
             model=self.model,
             args=training_args,
             train_dataset=self.dataset,
             data_collator=data_collator,
             tokenizer=self.tokenizer,
+            callbacks=[throughput, StepTimingCallback()] + ([cancellation] if cancellation else []) + (callbacks or []),
         )
         
         # Start training
-        trainer.train()
+        if resume_from_checkpoint:
+            logger.info(f"Resuming from checkpoint: {resume_from_checkpoint}")
+        try:
+            trainer.train(resume_from_checkpoint=resume_from_checkpoint)
+        finally:
+            trainer.close()
+        
+        if cancellation is not None and cancellation.cancelled:
+            raise TrainingCancelled(trainer.last_checkpoint)
+        
+        metrics = throughput.metrics()
+        logger.info(f"Effective throughput: {metrics['tokens_per_sec']:.1f} tokens/sec, "
+                    f"padding ratio: {metrics['padding_ratio']:.1%}")
         
         # Save the final model
         trainer.save_model()
@@ -145,24 +493,17 @@ class AITrainer:
         
         return output_dir
 
-def run_training_job(job_config: Dict[str, Any]) -> str:
+def run_training_job(job_config: Dict[str, Any],
+                     reporter: Optional[Callable[[Dict[str, Any]], None]] = None,
+                     cancel_event=None) -> str:
     """Main function to run a training job"""
     try:
         # Initialize trainer
         trainer = AITrainer(job_config['config'])
         
-        # Load model
-        model_mapping = {
-            'llama-7b': 'meta-llama/Llama-2-7b-hf',
-            'mistral-7b': 'mistralai/Mistral-7B-v0.1',
-            'phi-3-mini': 'microsoft/Phi-3-mini-4k-instruct',
-            'gemma-7b': 'google/gemma-7b'
-        }
+        # Load model from the local store; POST /api/models/download fetches it first
+        model_name = model_store.path(job_config['model_id'])
         
-        model_name = model_mapping.get(job_config['model_id'])
-        if not model_name:
-            raise ValueError(f"Unknown model: {job_config['model_id']}")
-            
         trainer.load_model(model_name)
         
         # Load dataset
@@ -172,10 +513,18 @@ def run_training_job(job_config: Dict[str, Any]) -> str:
         output_dir = f"outputs/{job_config['job_id']}"
         os.makedirs(output_dir, exist_ok=True)
         
-        result_path = trainer.train(output_dir)
+        callbacks = [ProgressCallback(reporter)] if reporter else None
+        result_path = trainer.train(
+            output_dir,
+            callbacks=callbacks,
+            cancel_event=cancel_event,
+            resume_from_checkpoint=job_config.get('resume_from_checkpoint')
+        )
         
         return result_path
         
+    except TrainingCancelled:
+        raise
     except Exception as e:
         logger.error(f"Training failed: {str(e)}")
         raise e
\ No newline at end of file
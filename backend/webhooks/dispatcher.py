@@ -0,0 +1,291 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+# httpx logs every request at INFO
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+DEFAULT_TIMEOUT = float(os.getenv('NOTIFICATION_TIMEOUT_SECONDS', '5'))
+DEFAULT_MAX_ATTEMPTS = int(os.getenv('NOTIFICATION_MAX_ATTEMPTS', '8'))
+DEFAULT_CONCURRENCY = int(os.getenv('NOTIFICATION_CONCURRENCY', '16'))
+
+# Delivered rows are kept this long for inspection before being pruned
+DELIVERED_RETENTION_SECONDS = 24 * 3600
+# A claimed row is handed to another dispatcher if its claimer has not finished it by then
+SENDING_LEASE_SECONDS = 300
+
+
+def _insert_outbox(conn, rows: List[Tuple[str, str, Dict[str, Any]]]):
+    now = time.time()
+    conn.executemany('''
+        INSERT INTO notification_outbox (target, url, payload, status, attempts, next_attempt_at, created_at, updated_at)
+        VALUES (?, ?, ?, 'pending', 0, ?, ?, ?)
+    ''', [(target, url, json.dumps(payload), now, now, now) for target, url, payload in rows])
+
+
+class CircuitBreaker:
+    """Stops hammering a receiver after repeated failures, then probes it again"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.open_until = 0.0
+
+    def allow(self, now: float) -> bool:
+        # Closed, or open long enough that one trial delivery may go through
+        return self.failures < self.failure_threshold or now >= self.open_until
+
+    def record_success(self):
+        self.failures = 0
+        self.open_until = 0.0
+
+    def record_failure(self, now: float):
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.open_until = now + self.reset_timeout
+
+
+class WebhookDispatcher:
+    """Durable, concurrent delivery of notifications through a SQLite outbox.
+
+    enqueue() only appends to an in-memory queue and returns immediately. A
+    background task persists queued events to the notification_outbox table,
+    then delivers every due row concurrently over a pooled HTTP client with
+    per-target timeouts, exponential backoff and a circuit breaker per URL.
+    Rows survive restarts and are retried until delivered or dead-lettered.
+    Processes without a running dispatcher (e.g. training workers) write
+    straight to the outbox, and the API process delivers those rows. Due rows
+    are claimed before sending, so several dispatchers never deliver the same
+    row twice; a claim left behind by a crashed process expires after
+    SENDING_LEASE_SECONDS.
+    """
+
+    def __init__(self, database, timeouts: Optional[Dict[str, float]] = None,
+                 max_attempts: Optional[int] = None, base_backoff: float = 1.0,
+                 max_backoff: float = 300.0, concurrency: Optional[int] = None,
+                 poll_interval: float = 1.0):
+        self.db = database
+        self.timeouts = timeouts or {}
+        self.max_attempts = max_attempts or DEFAULT_MAX_ATTEMPTS
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.concurrency = concurrency or DEFAULT_CONCURRENCY
+        self.poll_interval = poll_interval
+
+        self._pending: "deque[Tuple[str, str, Dict[str, Any]]]" = deque()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._owner_thread: Optional[int] = None
+
+        self.stats = {"enqueued": 0, "delivered": 0, "failed_attempts": 0, "dead": 0, "short_circuited": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def enqueue(self, target: str, url: str, payload: Dict[str, Any]):
+        """Queue one delivery; never blocks on the network"""
+        self.stats["enqueued"] += 1
+        if not self.running:
+            self._insert_rows([(target, url, payload)])
+            return
+
+        self._pending.append((target, url, payload))
+        if threading.get_ident() == self._owner_thread:
+            self._wakeup.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._owner_thread = threading.get_ident()
+        self._wakeup = asyncio.Event()
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        )
+        self._task = self._loop.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Anything not yet persisted goes to the outbox for the next start
+        await self._flush_pending()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _run(self):
+        last_prune = 0.0
+        while True:
+            try:
+                await self._flush_pending()
+                delay = await self._deliver_due()
+
+                if time.time() - last_prune > 3600:
+                    await self.db.execute(
+                        "DELETE FROM notification_outbox WHERE status = 'delivered' AND updated_at < ?",
+                        (time.time() - DELIVERED_RETENTION_SECONDS,)
+                    )
+                    last_prune = time.time()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Notification dispatcher iteration failed: {str(e)}")
+                delay = self.poll_interval
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def _insert_rows(self, rows: List[Tuple[str, str, Dict[str, Any]]]):
+        with self.db.connection() as conn:
+            _insert_outbox(conn, rows)
+
+    async def _flush_pending(self):
+        rows = []
+        while self._pending:
+            rows.append(self._pending.popleft())
+        if not rows:
+            return
+        try:
+            await self.db.run(lambda conn: _insert_outbox(conn, rows))
+        except Exception:
+            # Keep the events in memory and try again on the next pass
+            self._pending.extendleft(reversed(rows))
+            raise
+
+    async def _deliver_due(self) -> float:
+        """Send every due delivery concurrently; returns seconds until the next one is due"""
+        rows = await self.db.run(lambda conn: self._claim_due(conn, time.time()))
+
+        if rows:
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def deliver(row):
+                async with semaphore:
+                    try:
+                        return await self._deliver(row)
+                    except Exception as e:
+                        # A bad row (unreadable payload, invalid URL) must not sink the rest of the batch
+                        self.stats["failed_attempts"] += 1
+                        return self._retry_or_give_up(row, row["attempts"] + 1, f"{type(e).__name__}: {str(e)}")
+
+            try:
+                updates = await asyncio.gather(*[deliver(row) for row in rows])
+            except asyncio.CancelledError:
+                # Hand unfinished rows back instead of leaving them leased until the lease runs out
+                ids = [(row["id"],) for row in rows]
+                await self.db.run(lambda conn: conn.executemany(
+                    "UPDATE notification_outbox SET status = 'pending', locked_until = NULL WHERE id = ? AND status = 'sending'",
+                    ids
+                ))
+                raise
+            await self.db.run(lambda conn: conn.executemany('''
+                UPDATE notification_outbox
+                SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, updated_at = ?, locked_until = NULL
+                WHERE id = ?
+            ''', updates))
+
+        next_due = await self.db.fetchone(
+            "SELECT MIN(next_attempt_at) FROM notification_outbox WHERE status = 'pending'"
+        )
+        if next_due is None or next_due[0] is None:
+            return self.poll_interval
+        return min(self.poll_interval, max(0.0, next_due[0] - time.time()))
+
+    def _claim_due(self, conn, now: float) -> list:
+        """Mark due rows as sending and return the ones this dispatcher won"""
+        candidates = conn.execute('''
+            SELECT id, target, url, payload, attempts
+            FROM notification_outbox
+            WHERE (status = 'pending' AND next_attempt_at <= ?)
+               OR (status = 'sending' AND locked_until < ?)
+            ORDER BY next_attempt_at
+            LIMIT ?
+        ''', (now, now, self.concurrency * 4)).fetchall()
+
+        claimed = []
+        for row in candidates:
+            # Another dispatcher may have claimed the row since the SELECT; the write lock
+            # taken by the first UPDATE makes every check after it final
+            cursor = conn.execute('''
+                UPDATE notification_outbox
+                SET status = 'sending', locked_until = ?, updated_at = ?
+                WHERE id = ? AND (status = 'pending' OR (status = 'sending' AND locked_until < ?))
+            ''', (now + SENDING_LEASE_SECONDS, now, row["id"], now))
+            if cursor.rowcount == 1:
+                claimed.append(row)
+        return claimed
+
+    async def _deliver(self, row) -> tuple:
+        """Attempt one delivery and return the outbox update for it"""
+        now = time.time()
+        url = row["url"]
+        attempts = row["attempts"]
+        breaker = self._breakers.setdefault(url, CircuitBreaker())
+
+        if not breaker.allow(now):
+            # Defer without spending an attempt while the receiver is known to be down
+            self.stats["short_circuited"] += 1
+            return ("pending", attempts, breaker.open_until, "circuit open", now, row["id"])
+
+        error = None
+        try:
+            response = await self._client.post(
+                url,
+                json=json.loads(row["payload"]),
+                headers=self._headers(row["target"]),
+                timeout=self.timeouts.get(row["target"], DEFAULT_TIMEOUT),
+            )
+            if response.is_success:
+                breaker.record_success()
+                self.stats["delivered"] += 1
+                return ("delivered", attempts + 1, now, None, time.time(), row["id"])
+            error = f"HTTP {response.status_code}"
+        except httpx.HTTPError as e:
+            error = f"{type(e).__name__}: {str(e)}"
+
+        breaker.record_failure(time.time())
+        self.stats["failed_attempts"] += 1
+        return self._retry_or_give_up(row, attempts + 1, error)
+
+    def _retry_or_give_up(self, row, attempts: int, error: str) -> tuple:
+        url = row["url"]
+        now = time.time()
+        if attempts >= self.max_attempts:
+            self.stats["dead"] += 1
+            logger.error(f"Giving up on {row['target']} notification to {url} after {attempts} attempts: {error}")
+            return ("dead", attempts, now, error, time.time(), row["id"])
+
+        # Exponential backoff with jitter so retries to one receiver do not synchronize
+        backoff = min(self.max_backoff, self.base_backoff * 2 ** (attempts - 1))
+        retry_at = time.time() + backoff * random.uniform(0.5, 1.0)
+        logger.warning(f"{row['target']} notification to {url} failed ({error}), retry {attempts}")
+        return ("pending", attempts, retry_at, error, time.time(), row["id"])
+
+    def _headers(self, target: str) -> Dict[str, str]:
+        # Credentials are resolved at send time so they never land in the outbox
+        if target == "email":
+            return {"Authorization": f"Bearer {os.getenv('EMAIL_API_KEY', '')}"}
+        return {}
@@ -1,116 +1,66 @@
-import requests
-import json
 import os
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
 import logging
 
+from db.database import db
+from webhooks.dispatcher import WebhookDispatcher
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class NotificationService:
-    def __init__(self):
+    def __init__(self, dispatcher: Optional[WebhookDispatcher] = None):
         self.slack_webhook_url = os.getenv('SLACK_WEBHOOK_URL')
         self.email_api_key = os.getenv('EMAIL_API_KEY')
+        self.email_api_url = os.getenv('EMAIL_API_URL', 'https://api.sendgrid.com/v3/mail/send')
         self.discord_webhook_url = os.getenv('DISCORD_WEBHOOK_URL')
+        self.webhook_urls = [url.strip() for url in os.getenv('WEBHOOK_URLS', '').split(',') if url.strip()]
+        self.dispatcher = dispatcher or webhook_dispatcher
     
     def send_slack_notification(self, message: str, channel: str = "#ai-training") -> bool:
-        """Send notification to Slack"""
+        """Queue a Slack notification"""
         if not self.slack_webhook_url:
             logger.warning("Slack webhook URL not configured")
             return False
         
-        try:
-            payload = {
-                "channel": channel,
-                "username": "AI Training Bot",
-                "text": message,
-                "icon_emoji": ":robot_face:"
-            }
-            
-            response = requests.post(
-                self.slack_webhook_url,
-                json=payload,
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                logger.info("Slack notification sent successfully")
-                return True
-            else:
-                logger.error(f"Failed to send Slack notification: {response.status_code}")
-                return False
-                
-        except Exception as e:
-            logger.error(f"Error sending Slack notification: {str(e)}")
-            return False
+        payload = {
+            "channel": channel,
+            "username": "AI Training Bot",
+            "text": message,
+            "icon_emoji": ":robot_face:"
+        }
+        self.dispatcher.enqueue("slack", self.slack_webhook_url, payload)
+        return True
     
     def send_discord_notification(self, message: str) -> bool:
-        """Send notification to Discord"""
+        """Queue a Discord notification"""
         if not self.discord_webhook_url:
             logger.warning("Discord webhook URL not configured")
             return False
         
-        try:
-            payload = {
-                "content": message,
-                "username": "AI Training Bot"
-            }
-            
-            response = requests.post(
-                self.discord_webhook_url,
-                json=payload,
-                timeout=10
-            )
-            
-            if response.status_code == 204:
-                logger.info("Discord notification sent successfully")
-                return True
-            else:
-                logger.error(f"Failed to send Discord notification: {response.status_code}")
-                return False
-                
-        except Exception as e:
-            logger.error(f"Error sending Discord notification: {str(e)}")
-            return False
+        payload = {
+            "content": message,
+            "username": "AI Training Bot"
+        }
+        self.dispatcher.enqueue("discord", self.discord_webhook_url, payload)
+        return True
     
     def send_email_notification(self, to_email: str, subject: str, message: str) -> bool:
-        """Send email notification (using SendGrid or similar service)"""
+        """Queue an email notification (using SendGrid or similar service)"""
         if not self.email_api_key:
             logger.warning("Email API key not configured")
             return False
         
-        try:
-            # Example using SendGrid API
-            headers = {
-                'Authorization': f'Bearer {self.email_api_key}',
-                'Content-Type': 'application/json'
-            }
-            
-            payload = {
-                "personalizations": [{"to": [{"email": to_email}]}],
-                "from": {"email": "noreply@aitraining.com", "name": "AI Training System"},
-                "subject": subject,
-                "content": [{"type": "text/plain", "value": message}]
-            }
-            
-            response = requests.post(
-                'https://api.sendgrid.com/v3/mail/send',
-                headers=headers,
-                json=payload,
-                timeout=10
-            )
-            
-            if response.status_code == 202:
-                logger.info("Email notification sent successfully")
-                return True
-            else:
-                logger.error(f"Failed to send email notification: {response.status_code}")
-                return False
-                
-        except Exception as e:
-            logger.error(f"Error sending email notification: {str(e)}")
-            return False
+        # The API key is added by the dispatcher at send time
+        payload = {
+            "personalizations": [{"to": [{"email": to_email}]}],
+            "from": {"email": "noreply@aitraining.com", "name": "AI Training System"},
+            "subject": subject,
+            "content": [{"type": "text/plain", "value": message}]
+        }
+        self.dispatcher.enqueue("email", self.email_api_url, payload)
+        return True
     
     def notify_training_started(self, job_id: str, model_name: str, dataset_name: str):
         """Send notification when training starts"""
@@ -151,48 +101,40 @@ class NotificationService:
             message = f"📊 High API Usage Alert!\n\nEndpoint: {endpoint}\nRequests: {request_count}\nThreshold: {threshold}\nTime: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
             
             self.send_slack_notification(message)
+    
+    def notify_api_usage_digest(self, hot_endpoints: List[Tuple[str, int]], threshold: int, window_seconds: int):
+        """Send one coalesced alert for every endpoint over the usage threshold"""
+        lines = "\n".join(f"{endpoint}: {count}" for endpoint, count in hot_endpoints)
+        message = f"📊 High API Usage Alert!\n\n{len(hot_endpoints)} endpoint(s) at or above {threshold} requests in the last {window_seconds}s:\n{lines}\nTime: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+        
+        self.send_slack_notification(message)
+
+    def send_webhook_notification(self, event_type: str, data: Dict[str, Any]):
+        """Queue a webhook notification to every external system in WEBHOOK_URLS"""
+        if not self.webhook_urls:
+            return
+        
+        payload = {
+            "event_type": event_type,
+            "timestamp": datetime.now().isoformat(),
+            "data": data
+        }
+        for webhook_url in self.webhook_urls:
+            self.dispatcher.enqueue("webhook", webhook_url, payload)
+
+# Global dispatcher; the API process starts it, other processes write to the outbox
+webhook_dispatcher = WebhookDispatcher(db, timeouts={"email": 10.0})
 
 # Global notification service instance
 notification_service = NotificationService()
 
 def send_webhook_notification(event_type: str, data: Dict[str, Any]):
     """Send webhook notification to external systems"""
-    webhook_urls = os.getenv('WEBHOOK_URLS', '').split(',')
-    
-    if not webhook_urls or webhook_urls == ['']:
-        logger.info("No webhook URLs configured")
-        return
-    
-    payload = {
-        "event_type": event_type,
-        "timestamp": datetime.now().isoformat(),
-        "data": data
-    }
-    
-    for webhook_url in webhook_urls:
-        webhook_url = webhook_url.strip()
-        if not webhook_url:
-            continue
-            
-        try:
-            response = requests.post(
-                webhook_url,
-                json=payload,
-                headers={'Content-Type': 'application/json'},
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                logger.info(f"Webhook notification sent to {webhook_url}")
-            else:
-                logger.error(f"Failed to send webhook to {webhook_url}: {response.status_code}")
-                
-        except Exception as e:
-            logger.error(f"Error sending webhook to {webhook_url}: {str(e)}")
+    notification_service.send_webhook_notification(event_type, data)
 
 # Example usage functions
 def notify_training_event(event_type: str, job_data: Dict[str, Any]):
-    """Unified function to handle training event notifications"""
+    """Unified function to handle training event notifications; only enqueues deliveries"""
     
     if event_type == "training_started":
         notification_service.notify_training_started(
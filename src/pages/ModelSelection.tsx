@@ -13,6 +13,7 @@ interface Model {
   downloadUrl: string
   isDownloaded: boolean
   isDownloading: boolean
+  downloadProgress?: number | null
 }
 
 const ModelSelection: React.FC = () => {
@@ -106,23 +107,46 @@ const ModelSelection: React.FC = () => {
         body: JSON.stringify({ model_id: modelId }),
       })
 
-      if (response.ok) {
-        setModels(prev => 
-          prev.map(model => 
-            model.id === modelId 
-              ? { ...model, isDownloaded: true, isDownloading: false }
+      if (!response.ok) {
+        throw new Error('Download failed')
+      }
+
+      // The download runs in the background; follow its progress until it finishes
+      while (true) {
+        await new Promise(resolve => setTimeout(resolve, 1000))
+        const progressResponse = await fetch(`/api/models/${modelId}/download`)
+        if (!progressResponse.ok) {
+          throw new Error('Download failed')
+        }
+        const progress = await progressResponse.json()
+        if (progress.status === 'failed') {
+          throw new Error(progress.error || 'Download failed')
+        }
+        if (progress.status === 'completed') {
+          break
+        }
+        setModels(prev =>
+          prev.map(model =>
+            model.id === modelId
+              ? { ...model, downloadProgress: progress.progress }
               : model
           )
         )
-        toast.success('Model downloaded successfully!')
-      } else {
-        throw new Error('Download failed')
       }
+
+      setModels(prev => 
+        prev.map(model => 
+          model.id === modelId 
+            ? { ...model, isDownloaded: true, isDownloading: false, downloadProgress: null }
+            : model
+        )
+      )
+      toast.success('Model downloaded successfully!')
     } catch (error) {
       setModels(prev => 
         prev.map(model => 
           model.id === modelId 
-            ? { ...model, isDownloading: false }
+            ? { ...model, isDownloading: false, downloadProgress: null }
             : model
         )
       )
@@ -225,7 +249,11 @@ const ModelSelection: React.FC = () => {
                     className="inline-flex items-center px-3 py-1.5 border border-gray-300 text-sm font-medium rounded-md text-gray-700 bg-white hover:bg-gray-50 disabled:opacity-50"
                   >
                     <Download className="h-4 w-4 mr-1" />
-                    {model.isDownloading ? 'Downloading...' : 'Download'}
+                    {model.isDownloading
+                      ? model.downloadProgress != null
+                        ? `Downloading ${Math.round(model.downloadProgress * 100)}%`
+                        : 'Downloading...'
+                      : 'Download'}
                   </button>
                 )}
                 
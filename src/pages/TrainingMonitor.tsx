@@ -25,6 +25,9 @@ interface TrainingJob {
   output_path: string | null
 }
 
+// Newest log entries kept for the loss chart
+const MAX_LOG_POINTS = 500
+
 const TrainingMonitor: React.FC = () => {
   const [trainingStatus, setTrainingStatus] = useState<TrainingStatus>({
     is_training: false,
@@ -38,13 +41,55 @@ const TrainingMonitor: React.FC = () => {
   const [isStarting, setIsStarting] = useState(false)
 
   useEffect(() => {
-    // Fetch training status periodically
-    const fetchStatus = async () => {
+    let source: EventSource | null = null
+    let streamingJob: string | null = null
+    let lastStep = -1
+
+    // Push new step metrics for the running job instead of re-polling its whole log
+    const openStream = (jobId: string) => {
+      source?.close()
+      streamingJob = jobId
+      source = new EventSource(`/api/training/jobs/${jobId}/stream?after_step=${lastStep}`)
+
+      source.addEventListener('step', (event) => {
+        const entry = JSON.parse((event as MessageEvent).data)
+        lastStep = entry.step
+        setTrainingStatus((prev) => ({
+          ...prev,
+          progress: entry.progress ?? prev.progress,
+          logs: [...prev.logs, entry].slice(-MAX_LOG_POINTS)
+        }))
+      })
+
+      source.addEventListener('done', () => {
+        source?.close()
+        source = null
+        streamingJob = null
+        fetchStatus()
+        fetchJobs()
+      })
+    }
+
+    // Fetch training status; logs are only needed once, to seed the chart
+    const fetchStatus = async (includeLogs = false) => {
       try {
-        const response = await fetch('/api/training/status')
+        const response = await fetch(`/api/training/status?include_logs=${includeLogs}`)
         if (response.ok) {
-          const data = await response.json()
-          setTrainingStatus(data)
+          const data: TrainingStatus = await response.json()
+          setTrainingStatus((prev) => ({
+            ...data,
+            logs: includeLogs ? data.logs : data.current_job === prev.current_job ? prev.logs : []
+          }))
+
+          if (includeLogs && data.logs.length > 0) {
+            lastStep = data.logs[data.logs.length - 1].step
+          }
+          if (data.current_job && data.current_job !== streamingJob) {
+            if (!includeLogs) {
+              lastStep = -1
+            }
+            openStream(data.current_job)
+          }
         }
       } catch (error) {
         console.error('Failed to fetch training status:', error)
@@ -64,12 +109,15 @@ const TrainingMonitor: React.FC = () => {
       }
     }
 
-    fetchStatus()
+    fetchStatus(true)
     fetchJobs()
 
-    // Set up polling for training status
-    const interval = setInterval(fetchStatus, 2000)
-    return () => clearInterval(interval)
+    // Cheap check for newly started jobs; step metrics arrive over the stream
+    const interval = setInterval(() => fetchStatus(), 10000)
+    return () => {
+      clearInterval(interval)
+      source?.close()
+    }
   }, [])
 
   const startTraining = async () => {